@@ -1,286 +1,41 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_from_directory
-import pysqlite3 as sqlite3
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_from_directory, stream_with_context
 import os
+import queue
+import concurrent.futures
 import hashlib
-import requests
 import json
-from datetime import datetime
+import logging
 from dotenv import load_dotenv
 load_dotenv()
 
 # Импортируем функции из database.py
-def get_connection():
-    return sqlite3.connect('bot_database.db', check_same_thread=False)
-
-def init_db():
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    # Таблица пользователей
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            first_name TEXT,
-            registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Таблица сообщений
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            message_text TEXT,
-            message_type TEXT,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            is_from_admin BOOLEAN DEFAULT FALSE,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )
-    ''')
-    
-    # Таблица тикетов поддержки
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS support_tickets (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            description TEXT,
-            ticket_type TEXT,
-            status TEXT DEFAULT 'open',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            resolved_at TIMESTAMP,
-            admin_notes TEXT,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )
-    ''')
-    
-    # Таблица для медиафайлов
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS media_files (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            ticket_id INTEGER,
-            file_id TEXT,
-            file_type TEXT,
-            file_path TEXT,
-            caption TEXT,
-            uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (user_id),
-            FOREIGN KEY (ticket_id) REFERENCES support_tickets (id)
-        )
-    ''')
-    
-    # Создаем папку для медиафайлов
-    os.makedirs('media', exist_ok=True)
-    
-    conn.commit()
-    conn.close()
-
-def save_user(user_id: int, first_name: str, username: str = None):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT OR REPLACE INTO users (user_id, username, first_name, last_activity)
-        VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-    ''', (user_id, username, first_name))
-    conn.commit()
-    conn.close()
-
-def save_message(user_id: int, message_text: str, message_type: str = 'text', is_from_admin: bool = False):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO messages (user_id, message_text, message_type, is_from_admin)
-        VALUES (?, ?, ?, ?)
-    ''', (user_id, message_text, message_type, is_from_admin))
-    conn.commit()
-    conn.close()
-
-def get_user_by_id(user_id: int):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-    row = cursor.fetchone()
-    conn.close()
-    
-    if row:
-        return {
-            'user_id': row[0],
-            'username': row[1],
-            'first_name': row[2],
-            'registration_date': row[3],
-            'last_activity': row[4]
-        }
-    return None
-
-def get_ticket_by_id(ticket_id: int):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT st.*, u.username, u.first_name 
-        FROM support_tickets st 
-        JOIN users u ON st.user_id = u.user_id 
-        WHERE st.id = ?
-    ''', (ticket_id,))
-    row = cursor.fetchone()
-    conn.close()
-    
-    if row:
-        return {
-            'id': row[0],
-            'user_id': row[1],
-            'description': row[2],
-            'ticket_type': row[3],
-            'status': row[4],
-            'created_at': row[5],
-            'resolved_at': row[6],
-            'admin_notes': row[7],
-            'username': row[8],
-            'first_name': row[9]
-        }
-    return None
-
-def get_media_files_by_ticket(ticket_id: int):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT * FROM media_files 
-        WHERE ticket_id = ? 
-        ORDER BY uploaded_at
-    ''', (ticket_id,))
-    
-    media_files = []
-    for row in cursor.fetchall():
-        media_files.append({
-            'id': row[0],
-            'user_id': row[1],
-            'ticket_id': row[2],
-            'file_id': row[3],
-            'file_type': row[4],
-            'file_path': row[5],
-            'caption': row[6],
-            'uploaded_at': row[7]
-        })
-    
-    conn.close()
-    return media_files
-
-def get_conversation_messages(user_id: int, limit: int = 50):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT * FROM messages 
-        WHERE user_id = ? 
-        ORDER BY timestamp DESC 
-        LIMIT ?
-    ''', (user_id, limit))
-    
-    messages = []
-    for row in cursor.fetchall():
-        messages.append({
-            'id': row[0],
-            'user_id': row[1],
-            'message_text': row[2],
-            'message_type': row[3],
-            'timestamp': row[4],
-            'is_from_admin': bool(row[5])
-        })
-    
-    conn.close()
-    return messages[::-1]
-
-def get_all_tickets(status: str = None):
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    if status:
-        cursor.execute('''
-            SELECT st.*, u.username, u.first_name 
-            FROM support_tickets st 
-            JOIN users u ON st.user_id = u.user_id 
-            WHERE st.status = ?
-            ORDER BY st.created_at DESC
-        ''', (status,))
-    else:
-        cursor.execute('''
-            SELECT st.*, u.username, u.first_name 
-            FROM support_tickets st 
-            JOIN users u ON st.user_id = u.user_id 
-            ORDER BY st.created_at DESC
-        ''')
-    
-    tickets = []
-    for row in cursor.fetchall():
-        tickets.append({
-            'id': row[0],
-            'user_id': row[1],
-            'description': row[2],
-            'ticket_type': row[3],
-            'status': row[4],
-            'created_at': row[5],
-            'resolved_at': row[6],
-            'admin_notes': row[7],
-            'username': row[8],
-            'first_name': row[9]
-        })
-    
-    conn.close()
-    return tickets
+from database import (
+    release_connection, init_db, save_message,
+    get_ticket_by_id, get_media_files_by_ticket,
+    get_conversation_messages, update_ticket_status,
+    get_system_stats, get_tickets_page, count_tickets, clamp_page_size, PAGE_SIZE,
+    get_data_version, get_last_message_id, get_users_page, count_users,
+    iter_tickets, iter_users, get_lock_stats, get_cache_stats, STREAM_BATCH_SIZE
+)
+from rollups import query_timeseries, query_menu_clicks, start_rollup_refresher
+from change_feed import change_feed, RESET_EVENT_KIND
+from search import search, SEARCH_PAGE_SIZE
+from export import EXPORT_FORMATS, plan_export, export_chunks, export_filename
+from outbound import ThreadedOutboundQueue, http_sender, PRIORITY_ADMIN, OUTBOUND_WAIT_TIMEOUT, OUTBOUND_CONCURRENCY
+from telegram_http import TelegramHTTPClient
+from cache import TTLCache
+from outbox import enqueue_reply, get_outbox_entry
+from broadcast import (
+    AUDIENCES, CAMPAIGN_STATUSES, BROADCAST_ACTIVE_DAYS, count_audience, create_campaign,
+    change_campaign_status, get_campaign, list_campaigns, get_campaign_recipients
+)
 
-def update_ticket_status(ticket_id: int, status: str, admin_notes: str = None):
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    if status == 'resolved':
-        cursor.execute('''
-            UPDATE support_tickets 
-            SET status = ?, admin_notes = ?, resolved_at = CURRENT_TIMESTAMP 
-            WHERE id = ?
-        ''', (status, admin_notes, ticket_id))
-    else:
-        cursor.execute('''
-            UPDATE support_tickets 
-            SET status = ?, admin_notes = ? 
-            WHERE id = ?
-        ''', (status, admin_notes, ticket_id))
-    
-    conn.commit()
-    conn.close()
-
-def get_system_stats():
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT COUNT(*) FROM users')
-    total_users = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM support_tickets WHERE status = "open"')
-    open_tickets = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM support_tickets WHERE status = "resolved"')
-    resolved_tickets = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM messages')
-    total_messages = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM media_files')
-    total_media = cursor.fetchone()[0]
-    
-    # Активные пользователи за последние 24 часа
-    cursor.execute('SELECT COUNT(*) FROM users WHERE last_activity > datetime("now", "-1 day")')
-    active_users = cursor.fetchone()[0]
-    
-    conn.close()
-    
-    return {
-        'total_users': total_users,
-        'open_tickets': open_tickets,
-        'resolved_tickets': resolved_tickets,
-        'total_messages': total_messages,
-        'total_media': total_media,
-        'active_users': active_users
-    }
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
 
 # Инициализация Flask приложения
 app = Flask(__name__)
@@ -289,12 +44,61 @@ app.secret_key = 'admin-secret-key-12345-change-in-production'
 # Настройки
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT')
 
-if (TELEGRAM_BOT_TOKEN == ""):
-    print("Ключ для телеграмм бота не был установлен")
+if not TELEGRAM_BOT_TOKEN:
+    logger.warning("Ключ для телеграмм бота не был установлен")
     
+# outbox - ответ сохраняется в базе и отправляется ботом,
+# direct - админка отправляет сама и ждет итога (бот не запущен)
+ADMIN_DELIVERY_MODE = os.getenv('ADMIN_DELIVERY_MODE', 'outbox')
+
 UPLOAD_FOLDER = 'media'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+@app.teardown_appcontext
+def teardown_db(exception):
+    # Соединение потока запроса возвращается в пул
+    release_connection()
+
+# Интервал пустых комментариев, чтобы прокси не закрывали SSE-соединение
+SSE_HEARTBEAT = float(os.getenv('SSE_HEARTBEAT', '15'))  # секунды
+# Каждый открытый SSE-поток занимает поток обработки запросов на все время
+# подключения, поэтому число потоков ограничено: остальные клиенты опрашивают API
+SSE_MAX_SUBSCRIBERS = int(os.getenv('SSE_MAX_SUBSCRIBERS', '20'))
+
+# Последнее сообщение переписки по тикетам: ticket_id -> (версия данных, user_id, ID сообщения).
+# Кэш общий для потоков запросов: с блокировкой и вытеснением давно не открытых тикетов
+CONVERSATION_ETAG_CACHE_SIZE = 10000
+CONVERSATION_ETAG_TTL = 3600  # секунды
+_conversation_etags = TTLCache(CONVERSATION_ETAG_CACHE_SIZE, CONVERSATION_ETAG_TTL)
+
+# Потоковая выдача больших списков: JSON-массив или NDJSON (объект на строку).
+# Строки читаются из курсора пачками, память не зависит от размера таблицы.
+STREAM_FORMATS = ('json', 'ndjson')
+
+def stream_records(records, fmt):
+    """Потоковый ответ из итератора словарей"""
+    def generate():
+        chunk = ['[' if fmt == 'json' else '']
+        separator = ''
+        for record in records:
+            line = json.dumps(record, ensure_ascii=False)
+            if fmt == 'json':
+                chunk.append(separator + line)
+                separator = ','
+            else:
+                chunk.append(line + '\n')
+            if len(chunk) >= STREAM_BATCH_SIZE:
+                yield ''.join(chunk)
+                chunk = []
+        if fmt == 'json':
+            chunk.append(']')
+        yield ''.join(chunk)
+    
+    # Контекст запроса держится до конца выдачи: соединение вернется в пул
+    # в teardown только после того, как курсор дочитан
+    mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'application/json'
+    return app.response_class(stream_with_context(generate()), mimetype=mimetype)
+
 # Хэширование паролей
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
@@ -304,42 +108,35 @@ ADMIN_CREDENTIALS = {
     'admin': hash_password('admin123')
 }
 
+# Сообщения пользователям отправляются через очередь с ограничением скорости.
+# Соединения с API переиспользуются: пул на каждый одновременный запрос очереди
+telegram_client = TelegramHTTPClient(TELEGRAM_BOT_TOKEN or '', pool_size=OUTBOUND_CONCURRENCY)
+outbound = ThreadedOutboundQueue(http_sender(telegram_client))
+
+def _save_sent_message(user_id, message, result):
+    if result.ok:
+        # Сохраняем сообщение в базу
+        save_message(user_id, message, 'text', True)
+
 def send_telegram_message(user_id, message):
-    """Отправка сообщения пользователю через Telegram Bot API"""
-    if TELEGRAM_BOT_TOKEN == 'YOUR_BOT_TOKEN_HERE':
+    """Отправка сообщения пользователю через очередь отправки Telegram Bot API"""
+    if not TELEGRAM_BOT_TOKEN or TELEGRAM_BOT_TOKEN == 'YOUR_BOT_TOKEN_HERE':
         return False, "Токен бота не настроен"
     
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    payload = {
-        'chat_id': user_id,
-        'text': f"👨‍💼 Ответ от поддержки:\n\n{message}",
-        'parse_mode': 'HTML'
-    }
-    
+    future = outbound.submit(
+        user_id,
+        f"👨‍💼 Ответ от поддержки:\n\n{message}",
+        PRIORITY_ADMIN,
+        parse_mode='HTML'
+    )
     try:
-        response = requests.post(url, json=payload, timeout=10)
-        print(f"[DEBUG] Отправка сообщения пользователю {user_id}: {message}")
-        print(f"[DEBUG] Response status: {response.status_code}")
-        print(f"[DEBUG] Response text: {response.text}")
-        
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('ok'):
-                # Сохраняем сообщение в базу
-                save_message(user_id, message, 'text', True)
-                return True, "Сообщение отправлено"
-            else:
-                error_msg = f"Telegram API error: {data.get('description')}"
-                print(f"[DEBUG] {error_msg}")
-                return False, error_msg
-        else:
-            error_msg = f"HTTP error: {response.status_code}"
-            print(f"[DEBUG] {error_msg}")
-            return False, error_msg
-    except Exception as e:
-        error_msg = f"Exception: {str(e)}"
-        print(f"[DEBUG] {error_msg}")
-        return False, error_msg
+        result = future.result(OUTBOUND_WAIT_TIMEOUT)
+    except concurrent.futures.TimeoutError:
+        # Сообщение отправится позже (например, после паузы по 429), тогда и сохраним
+        future.add_done_callback(lambda done: _save_sent_message(user_id, message, done.result()))
+        return False, "Сообщение в очереди отправки"
+    _save_sent_message(user_id, message, result)
+    return result.ok, result.description
 
 # Маршруты Flask
 @app.route('/')
@@ -369,7 +166,8 @@ def dashboard():
         return redirect(url_for('login'))
     
     stats = get_system_stats()
-    open_tickets = get_all_tickets('open')
+    # На дашборде показываются только последние открытые тикеты
+    open_tickets, _ = get_tickets_page('open', limit=10)
     
     return render_template('dashboard.html', 
                          stats=stats,
@@ -382,14 +180,24 @@ def tickets_page():
         return redirect(url_for('login'))
     
     status = request.args.get('status', 'all')
-    if status == 'all':
-        tickets = get_all_tickets()
-    else:
-        tickets = get_all_tickets(status)
+    status_filter = None if status == 'all' else status
+    limit = clamp_page_size(request.args.get('limit', PAGE_SIZE))
+    cursor = request.args.get('cursor')
+    
+    try:
+        tickets, next_cursor = get_tickets_page(status_filter, limit, cursor)
+    except ValueError:
+        # Поврежденный курсор - показываем первую страницу
+        cursor = None
+        tickets, next_cursor = get_tickets_page(status_filter, limit)
     
     return render_template('tickets.html', 
                          tickets=tickets, 
                          status=status,
+                         total=count_tickets(status_filter),
+                         limit=limit,
+                         cursor=cursor,
+                         next_cursor=next_cursor,
                          admin=session.get('admin'))
 
 @app.route('/ticket/<int:ticket_id>')
@@ -415,36 +223,61 @@ def users_page():
     if 'admin' not in session:
         return redirect(url_for('login'))
     
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT u.*, 
-               COUNT(DISTINCT m.id) as message_count,
-               COUNT(DISTINCT st.id) as ticket_count,
-               MAX(m.timestamp) as last_message
-        FROM users u
-        LEFT JOIN messages m ON u.user_id = m.user_id
-        LEFT JOIN support_tickets st ON u.user_id = st.user_id
-        GROUP BY u.user_id
-        ORDER BY u.last_activity DESC
-    ''')
-    
-    users = []
-    for row in cursor.fetchall():
-        users.append({
-            'user_id': row[0],
-            'username': row[1],
-            'first_name': row[2],
-            'registration_date': row[3],
-            'last_activity': row[4],
-            'message_count': row[5],
-            'ticket_count': row[6],
-            'last_message': row[7]
-        })
+    sort = request.args.get('sort', 'last_activity')
+    order = request.args.get('order', 'desc')
+    limit = clamp_page_size(request.args.get('limit', PAGE_SIZE))
+    cursor = request.args.get('cursor')
+    
+    try:
+        users, next_cursor = get_users_page(sort, order, limit, cursor)
+    except ValueError:
+        # Неизвестная сортировка или поврежденный курсор - показываем первую страницу
+        sort, order, cursor = 'last_activity', 'desc', None
+        users, next_cursor = get_users_page(sort, order, limit)
+    
+    return render_template('users.html',
+                         users=users,
+                         total=count_users(),
+                         sort=sort,
+                         order=order,
+                         limit=limit,
+                         cursor=cursor,
+                         next_cursor=next_cursor,
+                         admin=session.get('admin'))
+
+@app.route('/search')
+def search_page():
+    if 'admin' not in session:
+        return redirect(url_for('login'))
+    
+    query = request.args.get('q', '').strip()
+    cursor = request.args.get('cursor')
+    results, next_cursor, error = [], None, None
+    if query:
+        try:
+            results, next_cursor = search(query, cursor=cursor)
+        except ValueError as e:
+            error = str(e)
     
-    conn.close()
+    return render_template('search.html',
+                         query=query,
+                         results=results,
+                         cursor=cursor,
+                         next_cursor=next_cursor,
+                         error=error,
+                         admin=session.get('admin'))
+
+@app.route('/broadcasts')
+def broadcasts_page():
+    if 'admin' not in session:
+        return redirect(url_for('login'))
     
-    return render_template('users.html', users=users, admin=session.get('admin'))
+    return render_template('broadcasts.html',
+                         campaigns=list_campaigns(),
+                         audiences={key: label for key, (label, _) in AUDIENCES.items()},
+                         statuses=CAMPAIGN_STATUSES,
+                         active_days=BROADCAST_ACTIVE_DAYS,
+                         admin=session.get('admin'))
 
 @app.route('/media/<path:filename>')
 def serve_media(filename):
@@ -459,8 +292,45 @@ def api_tickets():
         return jsonify({'error': 'Unauthorized'}), 401
     
     status = request.args.get('status')
-    tickets = get_all_tickets(status)
-    return jsonify(tickets)
+    
+    # ?format=json|ndjson - все тикеты одним потоком вместо страницы
+    fmt = request.args.get('format')
+    if fmt:
+        if fmt not in STREAM_FORMATS:
+            return jsonify({'error': f'Unknown format: {fmt}'}), 400
+        return stream_records(iter_tickets(status), fmt)
+    
+    limit = clamp_page_size(request.args.get('limit', PAGE_SIZE))
+    
+    try:
+        tickets, next_cursor = get_tickets_page(status, limit, request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'tickets': tickets,
+        'next_cursor': next_cursor,
+        'total': count_tickets(status)
+    })
+
+@app.route('/api/search')
+def api_search():
+    if 'admin' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    sources = request.args.get('sources')
+    try:
+        results, next_cursor = search(
+            request.args.get('q', ''),
+            sources=sources.split(',') if sources else None,
+            user_id=request.args.get('user_id', type=int),
+            limit=request.args.get('limit', SEARCH_PAGE_SIZE, type=int),
+            cursor=request.args.get('cursor')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({'results': results, 'next_cursor': next_cursor})
 
 @app.route('/api/tickets/<int:ticket_id>', methods=['PUT'])
 def api_update_ticket(ticket_id):
@@ -489,6 +359,11 @@ def api_send_message(ticket_id):
     if not message:
         return jsonify({'error': 'Message is required'}), 400
     
+    if ADMIN_DELIVERY_MODE == 'outbox':
+        # Бот отправит ответ сам, итог придет событием outbox_status
+        outbox_id = enqueue_reply(ticket['user_id'], message, ticket_id)
+        return jsonify({'success': True, 'message': 'Сообщение в очереди отправки', 'outbox_id': outbox_id}), 202
+    
     success, result_message = send_telegram_message(ticket['user_id'], message)
     
     if success:
@@ -496,17 +371,114 @@ def api_send_message(ticket_id):
     else:
         return jsonify({'success': False, 'error': result_message}), 500
 
+@app.route('/api/outbox/<int:outbox_id>')
+def api_outbox(outbox_id):
+    if 'admin' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    entry = get_outbox_entry(outbox_id)
+    if not entry:
+        return jsonify({'error': 'Outbox entry not found'}), 404
+    return jsonify(entry)
+
 @app.route('/api/ticket/<int:ticket_id>/conversation')
 def api_get_conversation(ticket_id):
     if 'admin' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    ticket = get_ticket_by_id(ticket_id)
-    if not ticket:
-        return jsonify({'error': 'Ticket not found'}), 404
+    since_id = request.args.get('since_id', type=int)
     
-    conversation = get_conversation_messages(ticket['user_id'])
-    return jsonify(conversation)
+    # Пока версия данных базы не изменилась, ETag переписки берется из памяти
+    # и неизмененная переписка отдается как 304 без запросов к таблицам
+    data_version = get_data_version()
+    cached = _conversation_etags.get(ticket_id)
+    if cached and cached[0] == data_version:
+        user_id, last_message_id = cached[1], cached[2]
+    else:
+        ticket = get_ticket_by_id(ticket_id)
+        if not ticket:
+            return jsonify({'error': 'Ticket not found'}), 404
+        user_id = ticket['user_id']
+        last_message_id = get_last_message_id(user_id)
+        _conversation_etags.set(ticket_id, (data_version, user_id, last_message_id))
+    etag = f"{ticket_id}-{last_message_id}"
+    
+    # 304 только если клиент уже видел последнее сообщение: ETag мог прийти
+    # с ответа, в котором были не все новые сообщения
+    up_to_date = since_id is None or since_id >= last_message_id
+    if up_to_date and request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    
+    conversation = get_conversation_messages(user_id, since_id=since_id)
+    response = jsonify(conversation)
+    if since_id is not None and conversation and conversation[-1]['id'] < last_message_id:
+        # Порция ограничена: клиент сразу запрашивает следующую, ETag не отдаем
+        response.headers['X-Has-More'] = '1'
+    else:
+        response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/events')
+def api_events():
+    if 'admin' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    # EventSource при переподключении присылает ID последнего полученного события
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return jsonify({'error': 'Invalid Last-Event-ID'}), 400
+    
+    user_id = request.args.get('user_id', type=int)
+    ticket_id = request.args.get('ticket_id', type=int)
+    kinds = set(filter(None, request.args.get('kinds', '').split(',')))
+    
+    def matches(event):
+        # Часть событий пропущена - клиент должен перезагрузить данные
+        if event['kind'] == RESET_EVENT_KIND:
+            return True
+        if user_id is not None and event['user_id'] != user_id:
+            return False
+        # Сообщения привязаны к пользователю, а не к тикету
+        if ticket_id is not None and event['kind'] != 'message':
+            event_ticket_id = event['data'].get('ticket_id') if event['kind'] == 'outbox_status' else event['entity_id']
+            if event_ticket_id != ticket_id:
+                return False
+        return not kinds or event['kind'] in kinds
+    
+    subscriber = change_feed.subscribe(last_event_id, SSE_MAX_SUBSCRIBERS)
+    if subscriber is None:
+        response = jsonify({'error': 'Too many event streams'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '60'
+        return response
+    
+    def stream():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    event = subscriber.get(timeout=SSE_HEARTBEAT)
+                except queue.Empty:
+                    yield ': ping\n\n'
+                    continue
+                if event is None:
+                    # Клиент отстал и был отключен от ленты, EventSource переподключится
+                    return
+                if matches(event):
+                    data = json.dumps(event['data'], ensure_ascii=False)
+                    yield f"id: {event['id']}\nevent: {event['kind']}\ndata: {data}\n\n"
+        finally:
+            change_feed.unsubscribe(subscriber)
+    
+    response = app.response_class(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @app.route('/api/stats')
 def api_stats():
@@ -516,27 +488,209 @@ def api_stats():
     stats = get_system_stats()
     return jsonify(stats)
 
+@app.route('/api/stats/db')
+def api_stats_db():
+    if 'admin' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    # Ожидание блокировки записи в процессе админки
+    return jsonify(get_lock_stats())
+
+@app.route('/api/stats/outbound')
+def api_stats_outbound():
+    if 'admin' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    stats = outbound.stats()
+    # Время запросов к Bot API из админки
+    stats['http'] = telegram_client.stats()
+    return jsonify(stats)
+
+@app.route('/api/stats/cache')
+def api_stats_cache():
+    if 'admin' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    return jsonify(get_cache_stats())
+
+@app.route('/api/stats/timeseries')
+def api_stats_timeseries():
+    if 'admin' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    is_from_admin = request.args.get('is_from_admin')
+    if is_from_admin is not None:
+        is_from_admin = is_from_admin.lower() in ('1', 'true', 'yes')
+    
+    try:
+        series = query_timeseries(
+            metric=request.args.get('metric', 'messages'),
+            granularity=request.args.get('granularity', 'hour'),
+            start=request.args.get('from'),
+            end=request.args.get('to'),
+            kind=request.args.get('kind'),
+            is_from_admin=is_from_admin,
+            group_by=request.args.get('group_by')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify(series)
+
+@app.route('/api/stats/menu')
+def api_stats_menu():
+    if 'admin' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    try:
+        series = query_menu_clicks(
+            granularity=request.args.get('granularity', 'day'),
+            start=request.args.get('from'),
+            end=request.args.get('to'),
+            user_id=request.args.get('user_id', type=int),
+            button=request.args.get('button')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify(series)
+
 @app.route('/api/users')
 def api_users():
     if 'admin' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
     
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM users ORDER BY last_activity DESC')
-    
-    users = []
-    for row in cursor.fetchall():
-        users.append({
-            'user_id': row[0],
-            'username': row[1],
-            'first_name': row[2],
-            'registration_date': row[3],
-            'last_activity': row[4]
+    # Постраничный режим с агрегатами: ?sort=...&order=...&limit=...&cursor=...
+    if any(arg in request.args for arg in ('sort', 'order', 'limit', 'cursor')):
+        try:
+            users, next_cursor = get_users_page(
+                request.args.get('sort', 'last_activity'),
+                request.args.get('order', 'desc'),
+                request.args.get('limit', PAGE_SIZE),
+                request.args.get('cursor')
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        return jsonify({
+            'users': users,
+            'next_cursor': next_cursor,
+            'total': count_users()
         })
     
-    conn.close()
-    return jsonify(users)
+    # Полный список отдается потоком: JSON-массив или ?format=ndjson
+    fmt = request.args.get('format', 'json')
+    if fmt not in STREAM_FORMATS:
+        return jsonify({'error': f'Unknown format: {fmt}'}), 400
+    return stream_records(iter_users(), fmt)
+
+@app.route('/api/export/<table>')
+def api_export(table):
+    if 'admin' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f'Unknown format: {fmt}'}), 400
+    filters = {
+        'start': request.args.get('from'),
+        'end': request.args.get('to'),
+        'ticket_type': request.args.get('ticket_type'),
+        'cursor': request.args.get('cursor'),
+    }
+    
+    try:
+        until_key, next_cursor = plan_export(table, limit=request.args.get('limit', type=int), **filters)
+        chunks = export_chunks(table, fmt, until_key=until_key, **filters)
+        first_chunk = next(chunks)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    def generate():
+        yield first_chunk
+        yield from chunks
+    
+    # Выгрузка читает снимок через отдельное соединение только для чтения
+    # и не держит соединение запроса, поэтому контекст запроса не нужен
+    response = app.response_class(generate(), mimetype=EXPORT_FORMATS[fmt][0])
+    response.headers['Content-Disposition'] = f'attachment; filename="{export_filename(table, fmt)}"'
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+@app.route('/api/broadcasts', methods=['GET', 'POST'])
+def api_broadcasts():
+    if 'admin' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    if request.method == 'GET':
+        return jsonify({'campaigns': list_campaigns(request.args.get('limit', PAGE_SIZE))})
+    
+    # Рассылку отправляет бот: здесь она только сохраняется со списком получателей
+    data = request.get_json() or {}
+    try:
+        campaign_id = create_campaign(
+            data.get('title'),
+            data.get('message_text'),
+            data.get('audience', 'all'),
+            data.get('days')
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify(get_campaign(campaign_id)), 201
+
+@app.route('/api/broadcasts/audience')
+def api_broadcasts_audience():
+    if 'admin' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    try:
+        count = count_audience(request.args.get('audience', 'all'), request.args.get('days', type=int))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({'count': count})
+
+@app.route('/api/broadcasts/<int:campaign_id>')
+def api_broadcast(campaign_id):
+    if 'admin' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    campaign = get_campaign(campaign_id)
+    if not campaign:
+        return jsonify({'error': 'Campaign not found'}), 404
+    return jsonify(campaign)
+
+@app.route('/api/broadcasts/<int:campaign_id>/<action>', methods=['POST'])
+def api_broadcast_action(campaign_id, action):
+    if 'admin' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    try:
+        status = change_campaign_status(campaign_id, action)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if status is None:
+        return jsonify({'error': 'Campaign not found'}), 404
+    return jsonify(get_campaign(campaign_id))
+
+@app.route('/api/broadcasts/<int:campaign_id>/recipients')
+def api_broadcast_recipients(campaign_id):
+    if 'admin' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    try:
+        recipients, next_cursor = get_campaign_recipients(
+            campaign_id,
+            request.args.get('status'),
+            request.args.get('limit', PAGE_SIZE),
+            request.args.get('cursor')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({'recipients': recipients, 'next_cursor': next_cursor})
 
 @app.route('/logout')
 def logout():
@@ -758,9 +912,9 @@ def create_basic_templates():
                     <p>{{ ticket.description[:100] }}{% if ticket.description|length > 100 %}...{% endif %}</p>
                 </div>
                 {% endfor %}
-                {% if open_tickets|length > 5 %}
+                {% if stats.open_tickets > 5 %}
                 <div style="text-align: center; margin-top: 15px;">
-                    <a href="/tickets?status=open">Показать все {{ open_tickets|length }} открытых тикетов</a>
+                    <a href="/tickets?status=open">Показать все {{ stats.open_tickets }} открытых тикетов</a>
                 </div>
                 {% endif %}
             {% else %}
@@ -896,6 +1050,9 @@ if __name__ == '__main__':
     # Инициализируем базу данных
     init_db()
     
+    # Фоновое обновление агрегатов для /api/stats/timeseries
+    start_rollup_refresher()
+    
     # Создаем базовые шаблоны если их нет
     if not os.path.exists('templates'):
         create_basic_templates()
@@ -0,0 +1,175 @@
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict
+
+import pysqlite3 as sqlite3
+
+from database import get_connection, begin_write, archive_schema, DB_JOURNAL_MODE
+from migrations import search_index_sql
+from rollups import refresh_rollups
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Настройки архивации
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '365'))
+ARCHIVE_PERIOD = os.getenv('ARCHIVE_PERIOD', 'year')  # year или month
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '5000'))
+
+PERIOD_FORMATS = {
+    'year': '%Y',
+    'month': '%Y-%m',
+}
+
+# Что переносится в архив: таблица -> (колонка периода, условие "устарело")
+ARCHIVE_SOURCES = {
+    'messages': ('timestamp', 'timestamp < ?'),
+    'support_tickets': ('created_at', "status = 'resolved' AND COALESCE(resolved_at, created_at) < ?"),
+}
+
+# Схема архивной базы: те же колонки, что в основной, индекс для переписки
+# и полнотекстовые индексы для поиска
+ARCHIVE_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        message_text TEXT,
+        message_type TEXT,
+        timestamp TIMESTAMP,
+        is_from_admin BOOLEAN DEFAULT FALSE
+    )''',
+    '''CREATE TABLE IF NOT EXISTS support_tickets (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        description TEXT,
+        ticket_type TEXT,
+        status TEXT,
+        created_at TIMESTAMP,
+        resolved_at TIMESTAMP,
+        admin_notes TEXT
+    )''',
+    'CREATE INDEX IF NOT EXISTS idx_messages_user_timestamp ON messages (user_id, timestamp)',
+    *search_index_sql('messages_fts', 'messages', ['message_text']),
+    *search_index_sql('tickets_fts', 'support_tickets', ['description', 'admin_notes']),
+]
+
+def _create_archive(path: str):
+    """Создание файла архивной базы со схемой"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute(f'PRAGMA journal_mode = {DB_JOURNAL_MODE}')
+        for statement in ARCHIVE_SCHEMA:
+            conn.execute(statement)
+        conn.commit()
+    finally:
+        conn.close()
+
+def _open_archive(conn, period: str) -> str:
+    """Архив периода: создается при необходимости, регистрируется в каталоге
+    и подключается к соединению. Возвращает имя схемы."""
+    schema = archive_schema(period)
+    attached = {row[1] for row in conn.execute('PRAGMA database_list')}
+    if schema in attached:
+        return schema
+
+    row = conn.execute('SELECT path FROM archives WHERE period = ?', (period,)).fetchone()
+    path = row[0] if row else os.path.abspath(os.path.join(ARCHIVE_DIR, f'archive_{period}.db'))
+    _create_archive(path)
+    if not row:
+        with conn:
+            conn.execute('INSERT OR IGNORE INTO archives (period, path) VALUES (?, ?)', (period, path))
+    conn.execute('ATTACH DATABASE ? AS ' + schema, (path,))
+    return schema
+
+def _restore_user_stats(conn, table: str, schema: str):
+    """Возврат в user_stats перенесенных строк пачки: триггеры удаления их вычли,
+    но агрегаты пользователей учитывают и архивную историю"""
+    if table == 'messages':
+        conn.execute(f'''
+            INSERT INTO user_stats (user_id, message_count, last_message)
+            SELECT user_id, COUNT(*), COALESCE(MAX(timestamp), '') FROM {schema}.messages
+            WHERE id IN (SELECT id FROM temp.archive_batch) GROUP BY user_id
+            ON CONFLICT (user_id) DO UPDATE SET
+                message_count = message_count + excluded.message_count,
+                last_message = max(last_message, excluded.last_message)
+        ''')
+    else:
+        conn.execute(f'''
+            INSERT INTO user_stats (user_id, ticket_count)
+            SELECT user_id, COUNT(*) FROM {schema}.support_tickets
+            WHERE id IN (SELECT id FROM temp.archive_batch) GROUP BY user_id
+            ON CONFLICT (user_id) DO UPDATE SET ticket_count = ticket_count + excluded.ticket_count
+        ''')
+
+def _archive_batch(conn, table: str, cutoff: str, period_format: str) -> int:
+    """Перенос следующей пачки устаревших строк таблицы в архив их периода"""
+    period_column, condition = ARCHIVE_SOURCES[table]
+    row = conn.execute(f'''
+        SELECT strftime(?, {period_column}) FROM {table}
+        WHERE {condition}
+        ORDER BY id LIMIT 1
+    ''', (period_format, cutoff)).fetchone()
+    if not row or row[0] is None:
+        return 0
+    period = row[0]
+    schema = _open_archive(conn, period)
+    counter = 'messages' if table == 'messages' else 'tickets'
+
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS archive_batch (id INTEGER PRIMARY KEY)')
+    begin_write(conn)
+    try:
+        conn.execute('DELETE FROM temp.archive_batch')
+        conn.execute(f'''
+            INSERT INTO temp.archive_batch (id)
+            SELECT id FROM main.{table}
+            WHERE {condition} AND strftime(?, {period_column}) = ?
+            ORDER BY id LIMIT ?
+        ''', (cutoff, period_format, period, ARCHIVE_BATCH_SIZE))
+        # OR IGNORE: после прерванного переноса строки могут уже быть в архиве
+        conn.execute(f'''
+            INSERT OR IGNORE INTO {schema}.{table}
+            SELECT * FROM main.{table} WHERE id IN (SELECT id FROM temp.archive_batch)
+        ''')
+        count = conn.execute(f'''
+            DELETE FROM main.{table} WHERE id IN (SELECT id FROM temp.archive_batch)
+        ''').rowcount
+        _restore_user_stats(conn, table, schema)
+        conn.execute(f'''
+            UPDATE archives SET {counter} = {counter} + ?, updated_at = CURRENT_TIMESTAMP
+            WHERE period = ?
+        ''', (count, period))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return count
+
+def run_archival(days: int = ARCHIVE_AFTER_DAYS, period: str = ARCHIVE_PERIOD) -> Dict[str, int]:
+    """Перенос сообщений и решенных тикетов старше days дней в архивные базы по периодам.
+
+    Горячая база остается небольшой; переписка, карточка тикета, поиск и
+    статистика читают архивы через ATTACH.
+    """
+    if period not in PERIOD_FORMATS:
+        raise ValueError(f"Неизвестный период архивации: {period}")
+    cutoff = (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+    # Агрегаты активности считаются по основной базе: учитываем строки до переноса
+    refresh_rollups()
+
+    conn = get_connection()
+    archived = {}
+    for table in ARCHIVE_SOURCES:
+        total = 0
+        while True:
+            count = _archive_batch(conn, table, cutoff, PERIOD_FORMATS[period])
+            total += count
+            if not count:
+                break
+        archived[table] = total
+        if total:
+            logger.info(f"В архив перенесено строк {table}: {total}")
+    return archived
@@ -1,9 +1,9 @@
 import logging
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import ContextTypes, ConversationHandler, MessageHandler, filters, CommandHandler, CallbackContext
-from database import save_user, save_message, create_support_ticket, save_media_file
-import os
-import requests
+from persistence import save_user, save_message, save_menu_click, create_support_ticket, queue_media_download, update_ticket_status
+from outbound import PRIORITY_ADMIN
+from media_pipeline import extract_media, MEDIA_MAX_FILE_SIZE
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
@@ -28,7 +28,7 @@ def create_back_menu():
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
     user = update.effective_user
-    save_user(user.id, user.first_name, user.username)
+    await save_user(user.id, user.first_name, user.username)
     
     welcome_text = f"""
 Приветствую, {user.first_name}! 
@@ -47,7 +47,7 @@ async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     if text == "👨‍💼 Обратиться к менеджеру":
-        save_message(user_id, "Обратиться к менеджеру", 'user')
+        await save_menu_click(user_id, "Обратиться к менеджеру")
         await update.message.reply_text(
             "Опишите вашу проблему или вопрос. Менеджер свяжется с вами в ближайшее время.",
             reply_markup=create_back_menu()
@@ -55,18 +55,18 @@ async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return MANAGER_DIALOG
     
     elif text == "⚠️ Отчет о нарушении":
-        save_message(user_id, "Отчет о нарушении", 'user')
+        await save_menu_click(user_id, "Отчет о нарушении")
         await update.message.reply_text(
             "Опишите нарушение и при необходимости прикрепите фото/видео:",
             reply_markup=create_back_menu()
         )
         # Создаем тикет для отчетов
-        ticket_id = create_support_ticket(user_id, "Отчет о нарушении (начало)", 'violation_report')
+        ticket_id = await create_support_ticket(user_id, "Отчет о нарушении (начало)", 'violation_report')
         context.user_data['current_ticket_id'] = ticket_id
         return REPORT_ISSUE
     
     elif text == "🏢 Информация об организации":
-        save_message(user_id, "Информация об организации", 'user')
+        await save_menu_click(user_id, "Информация об организации")
         org_info = """
 🏢 Наша организация:
 • Основана в 2010 году
@@ -80,7 +80,7 @@ async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return MAIN_MENU
     
     elif text == "📅 График работы":
-        save_message(user_id, "График работы", 'user')
+        await save_menu_click(user_id, "График работы")
         schedule = """
 🕒 График работы сотрудников:
 Пн-Пт: 9:00 - 18:00
@@ -94,7 +94,7 @@ async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return MAIN_MENU
     
     elif text == "💰 Расчет ЗП":
-        save_message(user_id, "Расчет ЗП", 'user')
+        await save_menu_click(user_id, "Расчет ЗП")
         salary_info = """
 💰 Расчет заработной платы:
 
@@ -110,7 +110,7 @@ async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return MAIN_MENU
     
     elif text == "↩️ Назад в меню":
-        save_message(user_id, "Назад в меню", 'user')
+        await save_menu_click(user_id, "Назад в меню")
         await update.message.reply_text(
             "Главное меню:",
             reply_markup=create_main_menu()
@@ -129,18 +129,11 @@ async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # Добавьте эту функцию в bot_handlers.py (если её нет)
 async def send_admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int, message: str):
     """Отправка ответа от администратора пользователю"""
-    try:
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=f"👨‍💼 Ответ от поддержки:\n\n{message}",
-            parse_mode='HTML'
-        )
+    ok, description = await send_message_to_user(context.bot_data['outbound'], user_id, message)
+    if ok:
         # Сохраняем сообщение в базу
-        save_message(user_id, message, 'text', True)
-        return True, "Сообщение отправлено"
-    except Exception as e:
-        logger.error(f"Ошибка отправки сообщения пользователю {user_id}: {e}")
-        return False, f"Ошибка отправки: {str(e)}"
+        await save_message(user_id, message, 'text', True)
+    return ok, description
 
 async def handle_manager_dialog(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка диалога с менеджером"""
@@ -148,7 +141,7 @@ async def handle_manager_dialog(update: Update, context: ContextTypes.DEFAULT_TY
     text = update.message.text
     
     if text == "↩️ Назад в меню":
-        save_message(user_id, "Отмена обращения к менеджеру", 'user')
+        await save_menu_click(user_id, "Отмена обращения к менеджеру")
         await update.message.reply_text(
             "Обращение к менеджеру отменено.",
             reply_markup=create_main_menu()
@@ -156,10 +149,10 @@ async def handle_manager_dialog(update: Update, context: ContextTypes.DEFAULT_TY
         return MAIN_MENU
     
     # Сохраняем сообщение пользователя
-    save_message(user_id, text, 'user')
+    await save_message(user_id, text, 'user')
     
     # Создаем тикет для обращения к менеджеру
-    ticket_id = create_support_ticket(user_id, text, 'manager_request')
+    ticket_id = await create_support_ticket(user_id, text, 'manager_request')
     
     await update.message.reply_text(
         f"✅ Ваше обращение #{ticket_id} принято! Менеджер свяжется с вами в течение 15 минут.",
@@ -175,11 +168,11 @@ async def handle_report_issue(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     if not current_ticket_id:
         # Создаем новый тикет если его нет
-        current_ticket_id = create_support_ticket(user_id, "Отчет о нарушении", 'violation_report')
+        current_ticket_id = await create_support_ticket(user_id, "Отчет о нарушении", 'violation_report')
         context.user_data['current_ticket_id'] = current_ticket_id
     
     if update.message.text == "↩️ Назад в меню":
-        save_message(user_id, "Отмена отчета о нарушении", 'user')
+        await save_menu_click(user_id, "Отмена отчета о нарушении")
         await update.message.reply_text(
             "Создание отчета отменено.",
             reply_markup=create_main_menu()
@@ -189,11 +182,10 @@ async def handle_report_issue(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     # Обработка текстовых сообщений
     if update.message.text:
-        save_message(user_id, update.message.text, 'user')
+        await save_message(user_id, update.message.text, 'user')
         
         # Обновляем описание тикета
-        from database import update_ticket_status
-        update_ticket_status(current_ticket_id, 'open', f"Описание нарушения: {update.message.text}")
+        await update_ticket_status(current_ticket_id, 'open', f"Описание нарушения: {update.message.text}")
         
         await update.message.reply_text(
             "✅ Описание нарушения сохранено! Хотите прикрепить фото/видео?",
@@ -218,7 +210,7 @@ async def handle_media_decision(update: Update, context: ContextTypes.DEFAULT_TY
     current_ticket_id = context.user_data.get('current_ticket_id')
     
     if text == "✅ Да, прикрепить файл":
-        save_message(user_id, "Решил прикрепить файл", 'user')
+        await save_menu_click(user_id, "Решил прикрепить файл")
         await update.message.reply_text(
             "Прикрепите фото, видео или документ:",
             reply_markup=ReplyKeyboardMarkup([[KeyboardButton("❌ Завершить без файла")]], resize_keyboard=True)
@@ -226,7 +218,7 @@ async def handle_media_decision(update: Update, context: ContextTypes.DEFAULT_TY
         return REPORT_ISSUE
     
     elif text == "❌ Нет, завершить отчет" or text == "❌ Завершить без файла":
-        save_message(user_id, "Завершил отчет без файла", 'user')
+        await save_menu_click(user_id, "Завершил отчет без файла")
         await update.message.reply_text(
             f"✅ Отчет о нарушении #{current_ticket_id} завершен! Спасибо за бдительность.",
             reply_markup=create_main_menu()
@@ -237,52 +229,32 @@ async def handle_media_decision(update: Update, context: ContextTypes.DEFAULT_TY
     return WAITING_MEDIA
 
 async def handle_media_file(update: Update, context: ContextTypes.DEFAULT_TYPE, ticket_id: int):
-    """Обработка медиафайлов"""
+    """Обработка медиафайлов: файл ставится в очередь загрузки, пользователь не ждет скачивания"""
     user_id = update.effective_user.id
     
     try:
-        # Определяем тип файла и получаем файл
-        if update.message.photo:
-            file = await update.message.photo[-1].get_file()
-            file_type = 'photo'
-            caption = update.message.caption
-        elif update.message.video:
-            file = await update.message.video.get_file()
-            file_type = 'video'
-            caption = update.message.caption
-        elif update.message.document:
-            file = await update.message.document.get_file()
-            file_type = 'document'
-            caption = update.message.caption
-        else:
+        media = extract_media(update.message)
+        if media is None:
             await update.message.reply_text(
                 "❌ Неподдерживаемый тип файла.",
                 reply_markup=create_back_menu()
             )
             return
         
-        # Сохраняем файл локально
-        file_extension = '.jpg' if file_type == 'photo' else os.path.splitext(file.file_path)[1] if file.file_path else '.bin'
-        filename = f"{user_id}_{ticket_id}_{file.file_id}{file_extension}"
-        file_path = os.path.join('media', filename)
-        
-        # Создаем папку media если её нет
-        os.makedirs('media', exist_ok=True)
-        
-        # Скачиваем файл
-        await file.download_to_drive(file_path)
-        
-        # Сохраняем информацию о файле в базу
-        save_media_file(user_id, ticket_id, file.file_id, file_type, filename, caption)
+        if media['file_size'] and media['file_size'] > MEDIA_MAX_FILE_SIZE:
+            await update.message.reply_text(
+                f"❌ Файл слишком большой, бот принимает файлы до {MEDIA_MAX_FILE_SIZE // (1024 * 1024)} МБ.",
+                reply_markup=create_back_menu()
+            )
+            return
         
-        # Сохраняем сообщение о файле
-        media_message = f"Прикрепил {file_type}: {filename}"
-        if caption:
-            media_message += f" с подписью: {caption}"
-        save_message(user_id, media_message, 'user')
+        # Задание записано в базу до ответа пользователю и переживет перезапуск бота.
+        # Файл, media_files и сообщение о вложении сохранит фоновый загрузчик.
+        await queue_media_download(user_id, ticket_id, media, update.message.caption)
+        context.bot_data['media_downloader'].wake()
         
         await update.message.reply_text(
-            "✅ Файл успешно прикреплен к отчету! Можете прикрепить еще файлы или завершить отчет.",
+            "✅ Файл принят и будет прикреплен к отчету! Можете прикрепить еще файлы или завершить отчет.",
             reply_markup=ReplyKeyboardMarkup([
                 [KeyboardButton("✅ Прикрепить еще файл")],
                 [KeyboardButton("❌ Завершить отчет")]
@@ -303,7 +275,7 @@ async def handle_additional_media(update: Update, context: ContextTypes.DEFAULT_
     current_ticket_id = context.user_data.get('current_ticket_id')
     
     if text == "✅ Прикрепить еще файл":
-        save_message(user_id, "Хочет прикрепить еще файл", 'user')
+        await save_menu_click(user_id, "Хочет прикрепить еще файл")
         await update.message.reply_text(
             "Прикрепите следующий файл:",
             reply_markup=ReplyKeyboardMarkup([[KeyboardButton("❌ Завершить отчет")]], resize_keyboard=True)
@@ -311,7 +283,7 @@ async def handle_additional_media(update: Update, context: ContextTypes.DEFAULT_
         return REPORT_ISSUE
     
     elif text == "❌ Завершить отчет":
-        save_message(user_id, "Завершил отчет с файлами", 'user')
+        await save_menu_click(user_id, "Завершил отчет с файлами")
         await update.message.reply_text(
             f"✅ Отчет о нарушении #{current_ticket_id} завершен! Спасибо за предоставленную информацию.",
             reply_markup=create_main_menu()
@@ -324,7 +296,7 @@ async def handle_additional_media(update: Update, context: ContextTypes.DEFAULT_
 async def cancel_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик отмены"""
     user_id = update.effective_user.id
-    save_message(user_id, "Отмена действия", 'user')
+    await save_menu_click(user_id, "Отмена действия")
     
     await update.message.reply_text(
         "Действие отменено.",
@@ -389,16 +361,19 @@ def register_handlers(application):
     
     logger.info("Все обработчики зарегистрированы")
 
-# Функция для отправки сообщений от администратора пользователю
-async def send_message_to_user(bot, user_id: int, message: str):
-    """Отправка сообщения от администратора пользователю"""
-    try:
-        await bot.send_message(
-            chat_id=user_id,
-            text=f"👨‍💼 Ответ от поддержки:\n\n{message}",
-            parse_mode='HTML'
-        )
-        return True, "Сообщение отправлено"
-    except Exception as e:
-        logger.error(f"Ошибка отправки сообщения пользователю {user_id}: {e}")
-        return False, f"Ошибка отправки: {str(e)}"
+# Функции для отправки сообщений от администратора пользователю
+async def deliver_admin_reply(outbound, user_id: int, message: str):
+    """Отправка ответа администратора через очередь отправки, возвращает DeliveryResult"""
+    return await outbound.send(
+        user_id,
+        f"👨‍💼 Ответ от поддержки:\n\n{message}",
+        PRIORITY_ADMIN,
+        parse_mode='HTML'
+    )
+
+async def send_message_to_user(outbound, user_id: int, message: str):
+    """Отправка сообщения от администратора пользователю через очередь отправки"""
+    result = await deliver_admin_reply(outbound, user_id, message)
+    if not result.ok:
+        logger.error(f"Ошибка отправки сообщения пользователю {user_id}: {result.error}")
+    return result.ok, result.description
@@ -1,10 +1,15 @@
 import logging
 import os
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler
-from bot_handlers import register_handlers, send_message_to_user
-from database import init_db, save_message
+from telegram.ext import Application
+from bot_handlers import register_handlers, send_message_to_user, deliver_admin_reply
+from database import init_db, close_all_connections, get_lock_stats
+import persistence
+from update_processor import KeyedUpdateProcessor
+from outbound import OutboundQueue, bot_sender
+from broadcast import CampaignSender
+from outbox import OutboxRelay
+from media_pipeline import MediaDownloader
 import asyncio
-import os
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -15,24 +20,84 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Способ получения обновлений: polling (getUpdates) или webhook (см. webhook.py)
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+
 class TelegramBot:
-    def __init__(self, token):
-        self.application = Application.builder().token(token).build()
+    def __init__(self, token, mode: str = BOT_MODE):
+        if mode not in ('polling', 'webhook'):
+            raise ValueError(f"Неизвестный режим бота: {mode}")
+        self.mode = mode
+        builder = (
+            Application.builder()
+            .token(token)
+            .post_init(self.on_startup)
+            .post_stop(self.on_stop)
+            .post_shutdown(self.on_shutdown)
+            # Разные пользователи обрабатываются параллельно, один пользователь - по порядку
+            .concurrent_updates(KeyedUpdateProcessor())
+        )
+        if mode == 'webhook':
+            # Обновления кладет в update_queue сервер webhook, Updater не нужен
+            builder = builder.updater(None)
+        self.application = builder.build()
+        # Все исходящие сообщения бота идут через общую очередь с ограничением скорости
+        self.outbound = OutboundQueue(bot_sender(self.application.bot))
+        self.application.bot_data['outbound'] = self.outbound
+        # Рассылки из админки отправляются из процесса бота через ту же очередь
+        self.campaign_sender = CampaignSender(self.outbound)
+        # Ответы администраторов, сохраненные админкой в outbox
+        self.outbox_relay = OutboxRelay(self.send_admin_reply)
+        # Вложения пользователей скачиваются в фоне, обработчики только ставят их в очередь
+        self.media_downloader = MediaDownloader(self.application.bot, self.outbound)
+        self.application.bot_data['media_downloader'] = self.media_downloader
         self.setup_handlers()
     
     def setup_handlers(self):
         """Регистрация обработчиков"""
         register_handlers(self.application)
     
+    async def on_startup(self, application):
+        """Запуск фоновой отправки ответов из админки и рассылок, загрузки вложений"""
+        self.outbox_relay.start()
+        self.campaign_sender.start()
+        self.media_downloader.start()
+    
+    async def on_stop(self, application):
+        """Остановка фоновых задач и отправка оставшихся сообщений.
+
+        Вызывается после остановки обработки обновлений, но до shutdown():
+        клиент бота еще открыт, и начатые отправки завершаются.
+        """
+        await self.outbox_relay.stop()
+        await self.campaign_sender.stop()
+        await self.media_downloader.stop()
+        await self.outbound.stop()
+
+    async def on_shutdown(self, application):
+        """Запись данных из очереди и закрытие соединений при остановке"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, persistence.shutdown)
+        logger.info(f"Ожидание блокировки записи: {get_lock_stats()}")
+        close_all_connections()
+    
     async def send_admin_message(self, user_id: int, message: str):
         """Публичный метод для отправки сообщений от администратора"""
-        return await send_message_to_user(self.application.bot, user_id, message)
+        return await send_message_to_user(self.outbound, user_id, message)
+    
+    async def send_admin_reply(self, user_id: int, message: str):
+        """Отправка ответа администратора с подробным итогом (DeliveryResult)"""
+        return await deliver_admin_reply(self.outbound, user_id, message)
     
     def run(self):
         """Запуск бота"""
         print("🤖 Бот запущен...")
         print("📊 Используйте /start для начала работы")
-        self.application.run_polling()
+        if self.mode == 'webhook':
+            from webhook import run_webhook
+            asyncio.run(run_webhook(self.application))
+        else:
+            self.application.run_polling()
 
 def main():
     # Инициализация базы данных
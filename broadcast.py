@@ -0,0 +1,324 @@
+import asyncio
+import logging
+import os
+from typing import Optional, List, Dict, Any, Tuple
+
+from database import (
+    get_read_connection, write_transaction, encode_cursor, decode_cursor,
+    clamp_page_size, PAGE_SIZE
+)
+from outbound import DeliveryResult, PRIORITY_BULK
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Настройки рассылок
+BROADCAST_BATCH_SIZE = int(os.getenv('BROADCAST_BATCH_SIZE', '100'))  # получателей в одной пачке
+BROADCAST_POLL_INTERVAL = float(os.getenv('BROADCAST_POLL_INTERVAL', '5'))  # секунды между проверками новых рассылок
+BROADCAST_ACTIVE_DAYS = int(os.getenv('BROADCAST_ACTIVE_DAYS', '30'))
+BROADCAST_MAX_ATTEMPTS = int(os.getenv('BROADCAST_MAX_ATTEMPTS', '3'))  # попыток на получателя при временных ошибках
+
+# Аудитории: имя -> (описание, запрос user_id). В запросе активных ? - число дней.
+AUDIENCES = {
+    'all': ('Все пользователи', 'SELECT user_id FROM users'),
+    'active': ('Активные за последние дни',
+               "SELECT user_id FROM users WHERE last_activity >= datetime('now', '-' || ? || ' days')"),
+    'open_tickets': ('С нерешенными тикетами',
+                     "SELECT DISTINCT user_id FROM support_tickets WHERE status != 'resolved'"),
+}
+
+# Управление рассылкой: действие -> (допустимые статусы, новый статус)
+CAMPAIGN_ACTIONS = {
+    'pause': (('running',), 'paused'),
+    'resume': (('paused',), 'running'),
+    'cancel': (('running', 'paused'), 'cancelled'),
+}
+
+CAMPAIGN_STATUSES = {
+    'running': 'Отправляется',
+    'paused': 'На паузе',
+    'completed': 'Завершена',
+    'cancelled': 'Отменена',
+}
+
+RECIPIENT_STATUSES = ('pending', 'sending', 'sent', 'failed')
+
+def _audience_query(audience: str, days: Optional[int]) -> Tuple[str, List[Any]]:
+    if audience not in AUDIENCES:
+        raise ValueError(f"Неизвестная аудитория: {audience}")
+    query = AUDIENCES[audience][1]
+    if audience != 'active':
+        return query, []
+    days = BROADCAST_ACTIVE_DAYS if days is None else int(days)
+    if days < 1:
+        raise ValueError("Число дней должно быть положительным")
+    return query, [days]
+
+def count_audience(audience: str, days: Optional[int] = None) -> int:
+    """Размер аудитории (для предпросмотра перед запуском)"""
+    query, params = _audience_query(audience, days)
+    conn = get_read_connection()
+    return conn.execute(f'SELECT COUNT(*) FROM ({query})', params).fetchone()[0]
+
+def create_campaign(title: str, message_text: str, audience: str, days: Optional[int] = None) -> int:
+    """Создание рассылки со списком получателей на момент создания.
+
+    Рассылка сразу получает статус running: ее подхватит отправитель в
+    процессе бота.
+    """
+    title = (title or '').strip()
+    message_text = (message_text or '').strip()
+    if not title or not message_text:
+        raise ValueError("Нужны название и текст рассылки")
+    query, params = _audience_query(audience, days)
+
+    with write_transaction() as conn:
+        campaign_id = conn.execute('''
+            INSERT INTO campaigns (title, message_text, audience, audience_days)
+            VALUES (?, ?, ?, ?)
+        ''', (title, message_text, audience, params[0] if params else None)).lastrowid
+        total = conn.execute(f'''
+            INSERT INTO campaign_recipients (campaign_id, user_id)
+            SELECT ?, user_id FROM ({query})
+        ''', (campaign_id, *params)).rowcount
+        conn.execute('UPDATE campaigns SET total = ? WHERE id = ?', (total, campaign_id))
+    logger.info(f"Создана рассылка {campaign_id} '{title}': {total} получателей")
+    return campaign_id
+
+def change_campaign_status(campaign_id: int, action: str) -> Optional[str]:
+    """Пауза, продолжение или отмена рассылки. Возвращает новый статус,
+    None - если рассылки нет. Недопустимый переход - ValueError."""
+    if action not in CAMPAIGN_ACTIONS:
+        raise ValueError(f"Неизвестное действие: {action}")
+    allowed, new_status = CAMPAIGN_ACTIONS[action]
+    with write_transaction() as conn:
+        row = conn.execute('SELECT status FROM campaigns WHERE id = ?', (campaign_id,)).fetchone()
+        if row is None:
+            return None
+        if row[0] not in allowed:
+            raise ValueError(f"Действие {action} недоступно для рассылки в статусе {row[0]}")
+        conn.execute('''
+            UPDATE campaigns SET status = ?,
+                finished_at = CASE WHEN ? = 'cancelled' THEN CURRENT_TIMESTAMP END
+            WHERE id = ?
+        ''', (new_status, new_status, campaign_id))
+    return new_status
+
+def _campaign_from_row(row, progress: Dict[str, int]) -> Dict[str, Any]:
+    campaign = {
+        'id': row[0],
+        'title': row[1],
+        'message_text': row[2],
+        'audience': row[3],
+        'audience_days': row[4],
+        'status': row[5],
+        'total': row[6],
+        'created_at': row[7],
+        'started_at': row[8],
+        'finished_at': row[9],
+    }
+    campaign.update({status: progress.get(status, 0) for status in RECIPIENT_STATUSES})
+    done = campaign['sent'] + campaign['failed']
+    campaign['progress'] = round(done / campaign['total'], 4) if campaign['total'] else 1.0
+    return campaign
+
+def _campaign_progress(conn, campaign_ids: List[int]) -> Dict[int, Dict[str, int]]:
+    progress = {campaign_id: {} for campaign_id in campaign_ids}
+    if not campaign_ids:
+        return progress
+    cursor = conn.execute(f'''
+        SELECT campaign_id, status, COUNT(*) FROM campaign_recipients
+        WHERE campaign_id IN ({', '.join('?' * len(campaign_ids))})
+        GROUP BY campaign_id, status
+    ''', campaign_ids)
+    for campaign_id, status, count in cursor.fetchall():
+        progress[campaign_id][status] = count
+    return progress
+
+CAMPAIGN_COLUMNS = '''id, title, message_text, audience, audience_days, status, total,
+                      created_at, started_at, finished_at'''
+
+def get_campaign(campaign_id: int) -> Optional[Dict[str, Any]]:
+    """Рассылка с прогрессом по статусам получателей"""
+    conn = get_read_connection()
+    row = conn.execute(f'SELECT {CAMPAIGN_COLUMNS} FROM campaigns WHERE id = ?', (campaign_id,)).fetchone()
+    if row is None:
+        return None
+    return _campaign_from_row(row, _campaign_progress(conn, [campaign_id])[campaign_id])
+
+def list_campaigns(limit: int = PAGE_SIZE) -> List[Dict[str, Any]]:
+    """Последние рассылки с прогрессом"""
+    conn = get_read_connection()
+    rows = conn.execute(f'''
+        SELECT {CAMPAIGN_COLUMNS} FROM campaigns ORDER BY id DESC LIMIT ?
+    ''', (clamp_page_size(limit),)).fetchall()
+    progress = _campaign_progress(conn, [row[0] for row in rows])
+    return [_campaign_from_row(row, progress[row[0]]) for row in rows]
+
+def get_campaign_recipients(campaign_id: int, status: str = None, limit: int = PAGE_SIZE,
+                            cursor: str = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Страница получателей рассылки по user_id, возвращает (получатели, курсор)"""
+    if status is not None and status not in RECIPIENT_STATUSES:
+        raise ValueError(f"Неизвестный статус: {status}")
+    limit = clamp_page_size(limit)
+    conditions = ['r.campaign_id = ?']
+    params = [campaign_id]
+    if status:
+        conditions.append('r.status = ?')
+        params.append(status)
+    if cursor:
+        (last_user_id,) = decode_cursor(cursor, 1)
+        conditions.append('r.user_id > ?')
+        params.append(int(last_user_id))
+
+    conn = get_read_connection()
+    rows = conn.execute(f'''
+        SELECT r.user_id, u.username, u.first_name, r.status, r.attempts,
+               r.message_id, r.error, r.sent_at
+        FROM campaign_recipients r
+        LEFT JOIN users u ON u.user_id = r.user_id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY r.user_id
+        LIMIT ?
+    ''', params + [limit + 1]).fetchall()
+
+    recipients = [{
+        'user_id': row[0],
+        'username': row[1],
+        'first_name': row[2],
+        'status': row[3],
+        'attempts': row[4],
+        'message_id': row[5],
+        'error': row[6],
+        'sent_at': row[7],
+    } for row in rows[:limit]]
+    next_cursor = encode_cursor(rows[limit - 1][0]) if len(rows) > limit else None
+    return recipients, next_cursor
+
+# Функции отправителя (процесс бота)
+
+def recover_interrupted():
+    """Получатели, чья пачка не была записана до остановки бота, снова ждут отправки.
+
+    Сообщение могло уйти до остановки, поэтому такие получатели могут
+    получить рассылку дважды - это лучше, чем не получить вовсе.
+    """
+    with write_transaction() as conn:
+        count = conn.execute('''
+            UPDATE campaign_recipients SET status = 'pending'
+            WHERE campaign_id IN (SELECT id FROM campaigns WHERE status IN ('running', 'paused'))
+              AND status = 'sending'
+        ''').rowcount
+    if count:
+        logger.warning(f"Возвращено в очередь рассылки получателей: {count}")
+
+def _running_campaigns() -> List[Tuple[int, str]]:
+    conn = get_read_connection()
+    return conn.execute("SELECT id, message_text FROM campaigns WHERE status = 'running' ORDER BY id").fetchall()
+
+def _claim_batch(campaign_id: int, size: int) -> List[int]:
+    """Следующая пачка получателей работающей рассылки (статус sending)"""
+    with write_transaction() as conn:
+        # Пауза или отмена действуют со следующей пачки
+        row = conn.execute('SELECT status FROM campaigns WHERE id = ?', (campaign_id,)).fetchone()
+        if row is None or row[0] != 'running':
+            return []
+        conn.execute('''
+            UPDATE campaigns SET started_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND started_at IS NULL
+        ''', (campaign_id,))
+        rows = conn.execute('''
+            UPDATE campaign_recipients SET status = 'sending', attempts = attempts + 1
+            WHERE campaign_id = ? AND user_id IN (
+                SELECT user_id FROM campaign_recipients
+                WHERE campaign_id = ? AND status = 'pending'
+                ORDER BY user_id LIMIT ?
+            )
+            RETURNING user_id
+        ''', (campaign_id, campaign_id, size)).fetchall()
+        if not rows:
+            conn.execute('''
+                UPDATE campaigns SET status = 'completed', finished_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'running' AND NOT EXISTS (
+                    SELECT 1 FROM campaign_recipients
+                    WHERE campaign_id = ? AND status IN ('pending', 'sending')
+                )
+            ''', (campaign_id, campaign_id))
+    return [row[0] for row in rows]
+
+def _record_results(campaign_id: int, results: List[DeliveryResult]):
+    """Итог пачки. Временная ошибка (в том числе остановка бота во время отправки)
+    возвращает получателя в pending, пока не исчерпаны попытки."""
+    with write_transaction() as conn:
+        conn.executemany('''
+            UPDATE campaign_recipients
+            SET status = CASE WHEN ? THEN 'sent' WHEN ? AND attempts < ? THEN 'pending' ELSE 'failed' END,
+                message_id = ?, error = ?,
+                sent_at = CASE WHEN ? THEN CURRENT_TIMESTAMP END
+            WHERE campaign_id = ? AND user_id = ?
+        ''', [(result.ok, result.retryable, BROADCAST_MAX_ATTEMPTS, result.message_id, result.error,
+               result.ok, campaign_id, result.chat_id)
+              for result in results])
+
+class CampaignSender:
+    """Фоновая отправка рассылок в процессе бота.
+
+    Получатели забираются пачками и отправляются через общую очередь
+    отправки с низким приоритетом: ответы администраторов не ждут рассылку,
+    а скорость ограничивают ведра токенов очереди. Итог каждой пачки
+    записывается в базу до того, как берется следующая.
+    """
+
+    def __init__(self, outbound, batch_size: int = BROADCAST_BATCH_SIZE,
+                 poll_interval: float = BROADCAST_POLL_INTERVAL):
+        self._outbound = outbound
+        self._batch_size = batch_size
+        self._poll_interval = poll_interval
+        self._stop_event = None
+        self._task = None
+
+    def start(self):
+        """Запуск в текущем event loop (повторный вызов ничего не делает)"""
+        if self._task is None:
+            self._stop_event = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Остановка после записи итогов текущей пачки"""
+        if self._task is None:
+            return
+        self._stop_event.set()
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, recover_interrupted)
+        except Exception as e:
+            logger.error(f"Ошибка восстановления рассылок: {e}")
+        while not self._stop_event.is_set():
+            try:
+                for campaign_id, message_text in await loop.run_in_executor(None, _running_campaigns):
+                    while not self._stop_event.is_set():
+                        if not await self._send_batch(campaign_id, message_text):
+                            break
+            except Exception as e:
+                logger.error(f"Ошибка отправки рассылки: {e}")
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), self._poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _send_batch(self, campaign_id: int, message_text: str) -> bool:
+        loop = asyncio.get_running_loop()
+        user_ids = await loop.run_in_executor(None, _claim_batch, campaign_id, self._batch_size)
+        if not user_ids:
+            return False
+        results = await asyncio.gather(*(
+            self._outbound.send(user_id, message_text, PRIORITY_BULK) for user_id in user_ids
+        ))
+        await loop.run_in_executor(None, _record_results, campaign_id, results)
+        failed = sum(1 for result in results if not result.ok)
+        logger.info(f"Рассылка {campaign_id}: отправлено {len(results) - failed}, ошибок {failed}")
+        return True
@@ -0,0 +1,76 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+class TTLCache:
+    """Ограниченный кэш с временем жизни записей и вытеснением давно не
+    использованных (LRU). Потокобезопасен, значения хранятся как есть."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._data = OrderedDict()  # ключ -> (срок годности, значение)
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'evicted': 0,
+            'invalidated': 0,
+        }
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Значение по ключу или None, если его нет или оно устарело"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                if item[0] > time.monotonic():
+                    self._data.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return item[1]
+                del self._data[key]
+                self._stats['expired'] += 1
+            self._stats['misses'] += 1
+            return None
+
+    def set(self, key: Hashable, value: Any):
+        """Запись значения, самые давние записи вытесняются при переполнении"""
+        if self._max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self._ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self._max_size:
+                self._data.popitem(last=False)
+                self._stats['evicted'] += 1
+
+    def invalidate(self, key: Hashable):
+        """Удаление записи по ключу"""
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self._stats['invalidated'] += 1
+
+    def invalidate_where(self, predicate: Callable[[Any], bool]):
+        """Удаление записей, значения которых удовлетворяют условию"""
+        with self._lock:
+            keys = [key for key, (_, value) in self._data.items() if predicate(value)]
+            for key in keys:
+                del self._data[key]
+            self._stats['invalidated'] += len(keys)
+
+    def clear(self):
+        """Удаление всех записей"""
+        with self._lock:
+            self._stats['invalidated'] += len(self._data)
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики попаданий и промахов, размер и доля попаданий"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._data)
+        stats['max_size'] = self._max_size
+        requests = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / requests, 3) if requests else None
+        return stats
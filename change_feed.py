@@ -0,0 +1,131 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Optional, List, Dict, Any
+
+from database import get_read_connection, get_data_version
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Настройки ленты изменений
+CHANGE_FEED_POLL_INTERVAL = float(os.getenv('CHANGE_FEED_POLL_INTERVAL', '0.5'))  # секунды
+CHANGE_FEED_BATCH_SIZE = 500
+SUBSCRIBER_QUEUE_SIZE = 1000
+# Событие вместо пропущенных, если их больше, чем помещается в очередь
+# подписчика (или они уже удалены из ленты): клиент заново загружает данные
+RESET_EVENT_KIND = 'reset'
+
+def read_events(after_id: int, limit: int = CHANGE_FEED_BATCH_SIZE) -> List[Dict[str, Any]]:
+    """Чтение событий ленты с ID больше after_id"""
+    conn = get_read_connection()
+    cursor = conn.execute('''
+        SELECT id, kind, entity_id, user_id, payload
+        FROM change_feed
+        WHERE id > ?
+        ORDER BY id
+        LIMIT ?
+    ''', (after_id, limit))
+    return [{
+        'id': row[0],
+        'kind': row[1],
+        'entity_id': row[2],
+        'user_id': row[3],
+        'data': json.loads(row[4]) if row[4] else {}
+    } for row in cursor.fetchall()]
+
+class ChangeFeed:
+    """Раздача событий ленты изменений подписчикам внутри процесса.
+
+    События пишут триггеры на стороне записи (бот и админка). Один фоновый
+    поток следит за PRAGMA data_version и читает ленту только после новой
+    фиксации в базе, а затем раскладывает события по очередям подписчиков.
+    Сколько бы ни было подписчиков, база опрашивается одним потоком.
+    """
+
+    def __init__(self, poll_interval: float = CHANGE_FEED_POLL_INTERVAL):
+        self._poll_interval = poll_interval
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_id = 0
+
+    def start(self):
+        """Запуск фонового потока (повторный вызов ничего не делает)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            row = get_read_connection().execute('SELECT MAX(id) FROM change_feed').fetchone()
+            self._last_id = row[0] or 0
+            self._thread = threading.Thread(target=self._run, name='change-feed', daemon=True)
+            self._thread.start()
+
+    def subscribe(self, last_event_id: Optional[int] = None,
+                  max_subscribers: Optional[int] = None) -> Optional[queue.Queue]:
+        """Подписка на события. Если передан last_event_id, сначала отдаются
+        пропущенные события (переподключение EventSource), а если все
+        пропущенное дослать нельзя - одно событие reset. None - уже
+        max_subscribers подписчиков."""
+        self.start()
+        subscriber = queue.Queue(SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            if max_subscribers is not None and len(self._subscribers) >= max_subscribers:
+                return None
+            if last_event_id is not None and last_event_id < self._last_id:
+                missed = [event for event in read_events(last_event_id, SUBSCRIBER_QUEUE_SIZE - 1)
+                          if event['id'] <= self._last_id]
+                # ID ленты идут подряд (AUTOINCREMENT): пропусков нет, если
+                # прочитано ровно столько событий, сколько номеров между ID
+                if len(missed) != self._last_id - last_event_id:
+                    missed = [{'id': self._last_id, 'kind': RESET_EVENT_KIND,
+                               'entity_id': None, 'user_id': None, 'data': {}}]
+                for event in missed:
+                    subscriber.put_nowait(event)
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: queue.Queue):
+        """Отписка от событий"""
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def _publish(self, events: List[Dict[str, Any]]):
+        with self._lock:
+            for event in events:
+                for subscriber in list(self._subscribers):
+                    try:
+                        subscriber.put_nowait(event)
+                    except queue.Full:
+                        # Подписчик не успевает: отключаем его, клиент
+                        # переподключится и дочитает пропущенное по Last-Event-ID
+                        self._subscribers.discard(subscriber)
+                        with subscriber.mutex:
+                            subscriber.queue.clear()
+                        subscriber.put_nowait(None)
+                self._last_id = event['id']
+
+    def _run(self):
+        last_version = None
+        while True:
+            try:
+                version = get_data_version()
+                if version != last_version:
+                    last_version = version
+                    while True:
+                        events = read_events(self._last_id)
+                        if events:
+                            self._publish(events)
+                        if len(events) < CHANGE_FEED_BATCH_SIZE:
+                            break
+            except Exception as e:
+                logger.error(f"Ошибка чтения ленты изменений: {e}")
+            time.sleep(self._poll_interval)
+
+# Общая лента изменений процесса
+change_feed = ChangeFeed()
@@ -1,11 +1,300 @@
 import pysqlite3 as sqlite3
+import base64
+import contextlib
 import datetime
 import os
-from typing import Optional, List, Dict, Any
+import asyncio
+import random
+import threading
+import time
+import urllib.parse
+import weakref
+from typing import Optional, List, Dict, Any, Tuple, Iterator
+from migrations import apply_migrations, COUNTERS_REBUILD_SQL, USER_STATS_REBUILD_SQL
+from cache import TTLCache
+from dotenv import load_dotenv
+load_dotenv()
+
+# Настройки базы данных (переопределяются переменными окружения)
+DB_PATH = os.getenv('DB_PATH', 'bot_database.db')
+DB_JOURNAL_MODE = os.getenv('DB_JOURNAL_MODE', 'WAL')
+DB_SYNCHRONOUS = os.getenv('DB_SYNCHRONOUS', 'NORMAL')
+DB_CACHE_SIZE = int(os.getenv('DB_CACHE_SIZE', '-16000'))  # отрицательное значение - размер в KiB
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', str(128 * 1024 * 1024)))
+DB_STATEMENT_CACHE = int(os.getenv('DB_STATEMENT_CACHE', '256'))
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))
+
+# Размеры страниц для списков в админке
+PAGE_SIZE = int(os.getenv('PAGE_SIZE', '50'))
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', '200'))
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', '500'))  # строк за одно чтение при потоковой выдаче
+
+# Кэш карточек пользователей и тикетов (0 - без кэша)
+CACHE_SIZE = int(os.getenv('CACHE_SIZE', '1000'))  # записей в каждом кэше
+CACHE_TTL = float(os.getenv('CACHE_TTL', '60'))  # секунды
+
+# Ожидание блокировки записи: сначала busy_timeout внутри SQLite, затем
+# повторные попытки с экспоненциальной задержкой и случайным разбросом
+DB_BUSY_TIMEOUT = int(os.getenv('DB_BUSY_TIMEOUT', '5000'))  # миллисекунды
+DB_WRITE_RETRIES = int(os.getenv('DB_WRITE_RETRIES', '5'))
+DB_RETRY_BASE_DELAY = float(os.getenv('DB_RETRY_BASE_DELAY', '0.05'))  # секунды
+DB_RETRY_MAX_DELAY = float(os.getenv('DB_RETRY_MAX_DELAY', '2.0'))  # секунды
+
+# Пул соединений: у каждого потока (и у каждого event loop внутри потока) своё
+# долгоживущее соединение для записи и отдельное - только для чтения.
+# Соединения завершившихся потоков возвращаются в пул свободных и
+# переиспользуются, лишние закрываются.
+_local = threading.local()
+_pool_lock = threading.Lock()
+_idle_connections = {False: [], True: []}  # только для чтения -> свободные соединения
+_all_connections = set()
+
+def _configure_connection(conn, readonly: bool = False):
+    """Настройка PRAGMA для нового соединения"""
+    conn.execute(f'PRAGMA busy_timeout = {DB_BUSY_TIMEOUT}')
+    conn.execute(f'PRAGMA cache_size = {DB_CACHE_SIZE}')
+    conn.execute(f'PRAGMA mmap_size = {DB_MMAP_SIZE}')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    if readonly:
+        conn.execute('PRAGMA query_only = ON')
+        return
+    conn.execute(f'PRAGMA journal_mode = {DB_JOURNAL_MODE}')
+    conn.execute(f'PRAGMA synchronous = {DB_SYNCHRONOUS}')
+    # INSERT OR REPLACE удаляет старую строку: без этого флага триггеры
+    # удаления при замене не срабатывают и счетчики расходятся
+    conn.execute('PRAGMA recursive_triggers = ON')
+
+def _connect(readonly: bool = False):
+    """Открытие соединения с базой данных (без регистрации в пуле)"""
+    if readonly:
+        try:
+            conn = sqlite3.connect(
+                f'file:{urllib.parse.quote(os.path.abspath(DB_PATH))}?mode=ro',
+                uri=True,
+                check_same_thread=False,
+                cached_statements=DB_STATEMENT_CACHE
+            )
+            _configure_connection(conn, readonly=True)
+            return conn
+        except sqlite3.OperationalError:
+            # mode=ro не откроет базу в WAL, если файла -shm еще нет и создать
+            # его нельзя; тогда читаем через обычное соединение с query_only
+            pass
+    conn = sqlite3.connect(
+        DB_PATH,
+        check_same_thread=False,
+        cached_statements=DB_STATEMENT_CACHE
+    )
+    _configure_connection(conn, readonly)
+    return conn
+
+def _open_connection(readonly: bool = False):
+    """Открытие нового соединения пула"""
+    conn = _connect(readonly)
+    with _pool_lock:
+        _all_connections.add(conn)
+    return conn
+
+def _connection_key(readonly: bool = False):
+    """Ключ соединения внутри потока: процесс, текущий event loop и режим"""
+    try:
+        loop_id = id(asyncio.get_running_loop())
+    except RuntimeError:
+        loop_id = None
+    return (os.getpid(), loop_id, readonly)
+
+def _return_to_pool(connections: Dict[Any, Any]):
+    """Возврат соединений потока в пул свободных"""
+    for key, conn in connections.items():
+        # Соединения, унаследованные после fork, не переиспользуем
+        if key[0] != os.getpid():
+            continue
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            continue
+        idle = _idle_connections[key[2]]
+        with _pool_lock:
+            if len(idle) < DB_POOL_SIZE:
+                idle.append(conn)
+                continue
+            _all_connections.discard(conn)
+        conn.close()
+
+def _get_pooled_connection(readonly: bool):
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = {}
+        _local.connections = connections
+        # Когда поток завершится, его соединения вернутся в пул
+        weakref.finalize(threading.current_thread(), _return_to_pool, connections)
+
+    key = _connection_key(readonly)
+    conn = connections.get(key)
+    if conn is None:
+        idle = _idle_connections[readonly]
+        with _pool_lock:
+            conn = idle.pop() if idle else None
+        if conn is None:
+            conn = _open_connection(readonly)
+        connections[key] = conn
+    return conn
 
 def get_connection():
-    """Создание соединения с базой данных"""
-    return sqlite3.connect('bot_database.db', check_same_thread=False)
+    """Получение долгоживущего соединения текущего потока"""
+    return _get_pooled_connection(readonly=False)
+
+def get_read_connection():
+    """Соединение текущего потока только для чтения (mode=ro, query_only).
+
+    В режиме WAL читатели не ждут писателей и не блокируют их. Данные,
+    записанные через get_connection, видны после фиксации транзакции.
+    """
+    return _get_pooled_connection(readonly=True)
+
+def release_connection():
+    """Досрочный возврат соединений текущего потока в пул (например, в конце HTTP-запроса)"""
+    connections = getattr(_local, 'connections', None)
+    if connections:
+        _return_to_pool(dict(connections))
+        connections.clear()
+
+# Статистика ожидания блокировки записи в этом процессе
+_lock_stats_lock = threading.Lock()
+_lock_stats = {
+    'write_transactions': 0,  # начатые транзакции записи
+    'contended': 0,           # транзакции, которым пришлось ждать блокировку
+    'retries': 0,             # повторные попытки после "database is locked"
+    'failures': 0,            # транзакции, не дождавшиеся блокировки
+    'wait_seconds': 0.0,      # суммарное время ожидания блокировки
+    'max_wait_seconds': 0.0,  # самое долгое ожидание
+}
+
+def _record_lock_wait(waited: float, retries: int, failed: bool = False):
+    with _lock_stats_lock:
+        _lock_stats['write_transactions'] += 1
+        _lock_stats['retries'] += retries
+        if failed:
+            _lock_stats['failures'] += 1
+        # Захват свободной блокировки занимает микросекунды
+        if waited > 0.001 or retries:
+            _lock_stats['contended'] += 1
+        _lock_stats['wait_seconds'] += waited
+        _lock_stats['max_wait_seconds'] = max(_lock_stats['max_wait_seconds'], waited)
+
+def get_lock_stats() -> Dict[str, Any]:
+    """Статистика ожидания блокировки записи в этом процессе"""
+    with _lock_stats_lock:
+        stats = dict(_lock_stats)
+    stats['wait_seconds'] = round(stats['wait_seconds'], 3)
+    stats['max_wait_seconds'] = round(stats['max_wait_seconds'], 3)
+    return stats
+
+def _is_lock_error(error: Exception) -> bool:
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+def begin_write(conn):
+    """Начало транзакции записи (BEGIN IMMEDIATE) с повторами при занятой базе.
+
+    В режиме WAL писатель ждет блокировку только здесь: после BEGIN IMMEDIATE
+    транзакция уже не получит "database is locked". Если busy_timeout истек,
+    попытка повторяется с экспоненциальной задержкой и случайным разбросом,
+    чтобы бот и админка не пробовали снова одновременно.
+    """
+    started = time.monotonic()
+    for attempt in range(DB_WRITE_RETRIES + 1):
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+        except sqlite3.OperationalError as e:
+            if not _is_lock_error(e) or attempt == DB_WRITE_RETRIES:
+                _record_lock_wait(time.monotonic() - started, attempt, failed=True)
+                raise
+            delay = min(DB_RETRY_MAX_DELAY, DB_RETRY_BASE_DELAY * 2 ** attempt)
+            time.sleep(random.uniform(0, delay))
+            continue
+        _record_lock_wait(time.monotonic() - started, attempt)
+        return
+
+@contextlib.contextmanager
+def write_transaction(conn=None):
+    """Транзакция записи: BEGIN IMMEDIATE с повторами, COMMIT или ROLLBACK"""
+    conn = conn or get_connection()
+    begin_write(conn)
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+# Отдельное соединение только для PRAGMA data_version. Оно никогда не пишет,
+# поэтому его data_version меняется после любой фиксации в базе - из другого
+# потока этого процесса или из другого процесса.
+_watch_connection = None
+_watch_lock = threading.Lock()
+
+def get_data_version() -> int:
+    """Версия данных базы: меняется после каждой зафиксированной записи (таблицы не читаются)"""
+    global _watch_connection
+    with _watch_lock:
+        if _watch_connection is None:
+            _watch_connection = _open_connection(readonly=True)
+        return _watch_connection.execute('PRAGMA data_version').fetchone()[0]
+
+def open_readonly_connection():
+    """Отдельное соединение только для чтения (вне пула) для долгих выгрузок.
+
+    В режиме WAL читатель не мешает записи: открытая транзакция чтения видит
+    снимок базы на момент первого запроса, бот в это время продолжает писать.
+    """
+    return _connect(readonly=True)
+
+def attach_archives(conn) -> List[str]:
+    """Подключение (ATTACH) архивных баз из каталога archives к соединению.
+
+    Возвращает имена схем архивов. Уже подключенные архивы остаются
+    подключенными, ATTACH внутри открытой транзакции невозможен - тогда
+    используются только подключенные ранее.
+    """
+    attached = {row[1] for row in conn.execute('PRAGMA database_list')}
+    schemas = []
+    for period, path in conn.execute('SELECT period, path FROM archives ORDER BY period'):
+        schema = archive_schema(period)
+        if schema not in attached:
+            if conn.in_transaction or not os.path.exists(path):
+                continue
+            try:
+                conn.execute('ATTACH DATABASE ? AS ' + schema, (path,))
+            except sqlite3.OperationalError:
+                # Например, превышен лимит подключенных баз
+                continue
+        schemas.append(schema)
+    return schemas
+
+def archive_schema(period: str) -> str:
+    """Имя схемы архивной базы периода ('2023' -> archive_2023)"""
+    return 'archive_' + period.replace('-', '_')
+
+def close_all_connections():
+    """Закрытие всех соединений процесса (при остановке)"""
+    global _watch_connection
+    with _watch_lock:
+        _watch_connection = None
+    with _pool_lock:
+        for idle in _idle_connections.values():
+            idle.clear()
+        connections = list(_all_connections)
+        _all_connections.clear()
+    for conn in connections:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+    local_connections = getattr(_local, 'connections', None)
+    if local_connections:
+        local_connections.clear()
 
 def init_db():
     """Инициализация базы данных"""
@@ -82,61 +371,279 @@ def init_db():
     os.makedirs('media', exist_ok=True)
     
     conn.commit()
-    conn.close()
+    
+    # Индексы и прочие изменения схемы
+    apply_migrations(conn)
 
-def save_user(user_id: int, first_name: str, username: Optional[str] = None):
-    """Сохранение/обновление пользователя"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT OR REPLACE INTO users (user_id, username, first_name, last_activity)
+# Операции записи. Функции insert_*/apply_* выполняют запрос на переданном
+# соединении без фиксации транзакции: их использует фоновая очередь записи
+# (persistence.py), которая объединяет много операций в одну транзакцию.
+def insert_user(conn, user_id: int, first_name: str, username: Optional[str] = None):
+    """Запрос сохранения пользователя.
+
+    Существующая строка обновляется, только если изменились имя или username:
+    повторный /start ничего не пишет и не сбрасывает registration_date.
+    """
+    conn.execute('''
+        INSERT INTO users (user_id, username, first_name, last_activity)
         VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT (user_id) DO UPDATE SET
+            username = excluded.username,
+            first_name = excluded.first_name,
+            last_activity = excluded.last_activity
+        WHERE username IS NOT excluded.username OR first_name IS NOT excluded.first_name
     ''', (user_id, username, first_name))
-    conn.commit()
-    conn.close()
 
-def save_message(user_id: int, message_text: str, message_type: str = 'text', is_from_admin: bool = False):
-    """Сохранение сообщения"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
+def apply_user_activity(conn, activity: List[Tuple[int, str]]):
+    """Запрос обновления last_activity пачкой (user_id, время в UTC)"""
+    conn.executemany('''
+        UPDATE users SET last_activity = ?
+        WHERE user_id = ? AND (last_activity IS NULL OR last_activity < ?)
+    ''', [(timestamp, user_id, timestamp) for user_id, timestamp in activity])
+
+def apply_menu_clicks(conn, clicks: List[Tuple[Tuple[str, str, int], int]]):
+    """Запрос прибавления нажатий меню пачкой ((час, кнопка, user_id), число)"""
+    conn.executemany('''
+        INSERT INTO menu_clicks (bucket, button, user_id, count) VALUES (?, ?, ?, ?)
+        ON CONFLICT (bucket, button, user_id) DO UPDATE SET count = count + excluded.count
+    ''', [(*key, count) for key, count in clicks])
+
+def insert_message(conn, user_id: int, message_text: str, message_type: str = 'text', is_from_admin: bool = False) -> int:
+    """Запрос сохранения сообщения, возвращает ID строки"""
+    return conn.execute('''
         INSERT INTO messages (user_id, message_text, message_type, is_from_admin)
         VALUES (?, ?, ?, ?)
-    ''', (user_id, message_text, message_type, is_from_admin))
-    conn.commit()
-    conn.close()
+    ''', (user_id, message_text, message_type, is_from_admin)).lastrowid
+
+def insert_media_file(conn, user_id: int, ticket_id: int, file_id: str, file_type: str, file_path: str, caption: str = None,
+                      blob_sha256: str = None, file_unique_id: str = None) -> int:
+    """Запрос сохранения информации о медиафайле, возвращает ID строки"""
+    return conn.execute('''
+        INSERT INTO media_files (user_id, ticket_id, file_id, file_type, file_path, caption, blob_sha256, file_unique_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, ticket_id, file_id, file_type, file_path, caption, blob_sha256, file_unique_id)).lastrowid
+
+def register_media_blob(conn, sha256: str, path: str, size: int) -> str:
+    """Запрос регистрации файла в хранилище media_blobs. Если такое содержимое
+    уже есть, возвращает путь существующего файла."""
+    return conn.execute('''
+        INSERT INTO media_blobs (sha256, path, size) VALUES (?, ?, ?)
+        ON CONFLICT (sha256) DO UPDATE SET updated_at = CURRENT_TIMESTAMP
+        RETURNING path
+    ''', (sha256, path, size)).fetchone()[0]
+
+# Очередь загрузки медиафайлов (media_jobs). Функции выполняются через очередь записи бота.
+
+MEDIA_JOB_COLUMNS = 'id, user_id, ticket_id, file_id, file_unique_id, file_type, file_name, file_size, caption, attempts'
+
+def _media_job_from_row(row) -> Dict[str, Any]:
+    return dict(zip(MEDIA_JOB_COLUMNS.split(', '), row))
+
+def insert_media_job(conn, user_id: int, ticket_id: int, file_id: str, file_unique_id: str, file_type: str,
+                     file_name: str = None, file_size: int = None, caption: str = None) -> int:
+    """Запрос постановки медиафайла в очередь загрузки"""
+    return conn.execute('''
+        INSERT INTO media_jobs (user_id, ticket_id, file_id, file_unique_id, file_type, file_name, file_size, caption)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, ticket_id, file_id, file_unique_id, file_type, file_name, file_size, caption)).lastrowid
+
+def claim_media_jobs(conn, limit: int) -> List[Dict[str, Any]]:
+    """Задания, которые пора загружать (статус downloading)"""
+    rows = conn.execute(f'''
+        UPDATE media_jobs SET status = 'downloading', attempts = attempts + 1
+        WHERE id IN (
+            SELECT id FROM media_jobs
+            WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+            ORDER BY id LIMIT ?
+        )
+        RETURNING {MEDIA_JOB_COLUMNS}
+    ''', (limit,)).fetchall()
+    return [_media_job_from_row(row) for row in sorted(rows)]
+
+def complete_media_job(conn, job_id: int, sha256: str, file_path: str, size: int) -> Optional[str]:
+    """Загруженный файл: запись в media_blobs и media_files и сообщение о вложении
+    в одной транзакции с отметкой задания, поэтому ровно один раз.
+    Возвращает путь файла в хранилище (у совпавшего содержимого - существующий)."""
+    row = conn.execute('''
+        UPDATE media_jobs SET status = 'done', error = NULL, finished_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND status = 'downloading'
+        RETURNING user_id, ticket_id, file_id, file_unique_id, file_type, file_name, caption
+    ''', (job_id,)).fetchone()
+    if row is None:
+        return None
+    user_id, ticket_id, file_id, file_unique_id, file_type, file_name, caption = row
+    file_path = register_media_blob(conn, sha256, file_path, size)
+    media_file_id = insert_media_file(conn, user_id, ticket_id, file_id, file_type, file_path, caption,
+                                      sha256, file_unique_id)
+    media_message = f"Прикрепил {file_type}: {file_name or os.path.basename(file_path)}"
+    if caption:
+        media_message += f" с подписью: {caption}"
+    insert_message(conn, user_id, media_message, 'user')
+    conn.execute('UPDATE media_jobs SET media_file_id = ? WHERE id = ?', (media_file_id, job_id))
+    return file_path
+
+def reuse_media_blob(conn, job_id: int, file_unique_id: str) -> Optional[str]:
+    """Файл уже есть в хранилище (тот же file_unique_id): задание завершается
+    без загрузки. Возвращает путь файла или None, если загружать нужно."""
+    if not file_unique_id:
+        return None
+    row = conn.execute('''
+        SELECT b.sha256, b.path, b.size FROM media_files f
+        JOIN media_blobs b ON b.sha256 = f.blob_sha256
+        WHERE f.file_unique_id = ?
+        LIMIT 1
+    ''', (file_unique_id,)).fetchone()
+    if row is None:
+        return None
+    return complete_media_job(conn, job_id, *row)
+
+def retry_media_job(conn, job_id: int, error: str, delay: float):
+    """Повтор загрузки через delay секунд"""
+    conn.execute('''
+        UPDATE media_jobs SET status = 'pending', error = ?,
+            next_attempt_at = datetime('now', '+' || ? || ' seconds')
+        WHERE id = ? AND status = 'downloading'
+    ''', (error, int(delay), job_id))
+
+def fail_media_job(conn, job_id: int, error: str):
+    """Окончательная ошибка загрузки"""
+    conn.execute('''
+        UPDATE media_jobs SET status = 'failed', error = ?, finished_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND status = 'downloading'
+    ''', (error, job_id))
+
+def reset_media_jobs(conn) -> int:
+    """Загрузки, прерванные остановкой бота, снова ждут очереди.
+    Прерванная попытка не считается: перезапуски не расходуют повторы."""
+    return conn.execute('''
+        UPDATE media_jobs SET status = 'pending', attempts = MAX(attempts - 1, 0)
+        WHERE status = 'downloading'
+    ''').rowcount
+
+def insert_support_ticket(conn, user_id: int, description: str, ticket_type: str) -> int:
+    """Запрос создания тикета, возвращает ID тикета"""
+    cursor = conn.execute('''
+        INSERT INTO support_tickets (user_id, description, ticket_type)
+        VALUES (?, ?, ?)
+    ''', (user_id, description, ticket_type))
+    return cursor.lastrowid
+
+def apply_ticket_status(conn, ticket_id: int, status: str, admin_notes: str = None):
+    """Запрос обновления статуса тикета"""
+    if status == 'resolved':
+        conn.execute('''
+            UPDATE support_tickets 
+            SET status = ?, admin_notes = ?, resolved_at = CURRENT_TIMESTAMP 
+            WHERE id = ?
+        ''', (status, admin_notes, ticket_id))
+    else:
+        conn.execute('''
+            UPDATE support_tickets 
+            SET status = ?, admin_notes = ? 
+            WHERE id = ?
+        ''', (status, admin_notes, ticket_id))
+
+def save_user(user_id: int, first_name: str, username: Optional[str] = None):
+    """Сохранение/обновление пользователя"""
+    with write_transaction() as conn:
+        insert_user(conn, user_id, first_name, username)
+    with _cache_lock:
+        _invalidate_user(user_id)
+
+def save_message(user_id: int, message_text: str, message_type: str = 'text', is_from_admin: bool = False):
+    """Сохранение сообщения"""
+    with write_transaction() as conn:
+        insert_message(conn, user_id, message_text, message_type, is_from_admin)
 
 def save_media_file(user_id: int, ticket_id: int, file_id: str, file_type: str, file_path: str, caption: str = None):
     """Сохранение информации о медиафайле"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO media_files (user_id, ticket_id, file_id, file_type, file_path, caption)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (user_id, ticket_id, file_id, file_type, file_path, caption))
-    conn.commit()
-    conn.close()
+    with write_transaction() as conn:
+        insert_media_file(conn, user_id, ticket_id, file_id, file_type, file_path, caption)
 
 def create_support_ticket(user_id: int, description: str, ticket_type: str) -> int:
     """Создание тикета поддержки"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO support_tickets (user_id, description, ticket_type)
-        VALUES (?, ?, ?)
-    ''', (user_id, description, ticket_type))
-    ticket_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return ticket_id
+    with write_transaction() as conn:
+        return insert_support_ticket(conn, user_id, description, ticket_type)
+
+# Кэши карточек. Свои записи сбрасываются сразу (save_user,
+# update_ticket_status), чужие - по событиям ленты изменений: лента
+# читается, только когда PRAGMA data_version показывает новую фиксацию.
+_user_cache = TTLCache(CACHE_SIZE, CACHE_TTL)
+_ticket_cache = TTLCache(CACHE_SIZE, CACHE_TTL)
+_cache_lock = threading.Lock()
+_cache_state = {
+    'data_version': None,
+    'feed_id': None,
+    'generation': 0,  # растет при каждом сбросе: загруженное до сброса не кэшируем
+}
+CACHE_EVENT_KINDS = ('user_updated', 'ticket_status', 'ticket_updated')
+
+def _invalidate_user(user_id: int):
+    # Имя пользователя входит и в карточки его тикетов
+    _user_cache.invalidate(user_id)
+    _ticket_cache.invalidate_where(lambda ticket: ticket['user_id'] == user_id)
+    _cache_state['generation'] += 1
+
+def _invalidate_ticket(ticket_id: int):
+    _ticket_cache.invalidate(ticket_id)
+    _cache_state['generation'] += 1
+
+def _sync_caches():
+    """Сброс записей, измененных другими соединениями и процессами"""
+    with _cache_lock:
+        version = get_data_version()
+        if version == _cache_state['data_version']:
+            return
+        _cache_state['data_version'] = version
+
+        conn = get_read_connection()
+        last_id = _cache_state['feed_id']
+        first_id, max_id = conn.execute('SELECT MIN(id), MAX(id) FROM change_feed').fetchone()
+        if last_id is None or max_id is None or last_id < (first_id or 0) - 1:
+            # Первая проверка или события уже вытеснены из ленты
+            _user_cache.clear()
+            _ticket_cache.clear()
+            _cache_state['generation'] += 1
+        elif max_id > last_id:
+            placeholders = ', '.join('?' * len(CACHE_EVENT_KINDS))
+            cursor = conn.execute(f'''
+                SELECT kind, entity_id FROM change_feed
+                WHERE id > ? AND id <= ? AND kind IN ({placeholders})
+            ''', (last_id, max_id, *CACHE_EVENT_KINDS))
+            for kind, entity_id in cursor.fetchall():
+                if kind == 'user_updated':
+                    _invalidate_user(entity_id)
+                else:
+                    _invalidate_ticket(entity_id)
+        _cache_state['feed_id'] = max_id or 0
+
+def _cached(cache: TTLCache, key: int, load) -> Optional[Dict[str, Any]]:
+    """Значение из кэша или из базы (с записью в кэш)"""
+    _sync_caches()
+    value = cache.get(key)
+    if value is None:
+        generation = _cache_state['generation']
+        value = load(key)
+        with _cache_lock:
+            # Если за время чтения были сбросы, прочитанное могло устареть
+            if value is not None and generation == _cache_state['generation']:
+                cache.set(key, value)
+    # Копия: вызывающий код может менять словарь
+    return dict(value) if value is not None else None
+
+def get_cache_stats() -> Dict[str, Any]:
+    """Попадания и промахи кэшей карточек"""
+    return {'users': _user_cache.stats(), 'tickets': _ticket_cache.stats()}
 
 def get_user_by_id(user_id: int) -> Optional[Dict[str, Any]]:
     """Получение информации о пользователе"""
-    conn = get_connection()
+    return _cached(_user_cache, user_id, _load_user)
+
+def _load_user(user_id: int) -> Optional[Dict[str, Any]]:
+    conn = get_read_connection()
     cursor = conn.cursor()
     cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
     row = cursor.fetchone()
-    conn.close()
     
     if row:
         return {
@@ -150,7 +657,10 @@ def get_user_by_id(user_id: int) -> Optional[Dict[str, Any]]:
 
 def get_ticket_by_id(ticket_id: int) -> Optional[Dict[str, Any]]:
     """Получение тикета по ID"""
-    conn = get_connection()
+    return _cached(_ticket_cache, ticket_id, _load_ticket)
+
+def _load_ticket(ticket_id: int) -> Optional[Dict[str, Any]]:
+    conn = get_read_connection()
     cursor = conn.cursor()
     cursor.execute('''
         SELECT st.*, u.username, u.first_name 
@@ -159,7 +669,19 @@ def get_ticket_by_id(ticket_id: int) -> Optional[Dict[str, Any]]:
         WHERE st.id = ?
     ''', (ticket_id,))
     row = cursor.fetchone()
-    conn.close()
+    
+    # Старые решенные тикеты перенесены в архивы
+    if not row:
+        for schema in attach_archives(conn):
+            cursor.execute(f'''
+                SELECT st.*, u.username, u.first_name 
+                FROM {schema}.support_tickets st 
+                JOIN users u ON st.user_id = u.user_id 
+                WHERE st.id = ?
+            ''', (ticket_id,))
+            row = cursor.fetchone()
+            if row:
+                break
     
     if row:
         return {
@@ -178,7 +700,7 @@ def get_ticket_by_id(ticket_id: int) -> Optional[Dict[str, Any]]:
 
 def get_media_files_by_ticket(ticket_id: int) -> List[Dict[str, Any]]:
     """Получение медиафайлов тикета"""
-    conn = get_connection()
+    conn = get_read_connection()
     cursor = conn.cursor()
     cursor.execute('''
         SELECT * FROM media_files 
@@ -199,121 +721,400 @@ def get_media_files_by_ticket(ticket_id: int) -> List[Dict[str, Any]]:
             'uploaded_at': row[7]
         })
     
-    conn.close()
     return media_files
 
-def get_conversation_messages(user_id: int, limit: int = 50) -> List[Dict[str, Any]]:
-    """Получение истории сообщений с пользователем"""
-    conn = get_connection()
+def _message_from_row(row) -> Dict[str, Any]:
+    """Преобразование строки messages в словарь"""
+    return {
+        'id': row[0],
+        'user_id': row[1],
+        'message_text': row[2],
+        'message_type': row[3],
+        'timestamp': row[4],
+        'is_from_admin': bool(row[5])
+    }
+
+def get_conversation_messages(user_id: int, limit: int = 50, since_id: int = None) -> List[Dict[str, Any]]:
+    """Получение истории сообщений с пользователем.
+
+    Если передан since_id, возвращаются только сообщения новее него.
+    """
+    conn = get_read_connection()
     cursor = conn.cursor()
+    if since_id is not None:
+        cursor.execute('''
+            SELECT * FROM messages 
+            WHERE user_id = ? AND id > ? 
+            ORDER BY id 
+            LIMIT ?
+        ''', (user_id, since_id, limit))
+        return [_message_from_row(row) for row in cursor.fetchall()]
+    
     cursor.execute('''
         SELECT * FROM messages 
         WHERE user_id = ? 
         ORDER BY timestamp DESC 
         LIMIT ?
     ''', (user_id, limit))
+    rows = cursor.fetchall()
     
-    messages = []
-    for row in cursor.fetchall():
-        messages.append({
-            'id': row[0],
-            'user_id': row[1],
-            'message_text': row[2],
-            'message_type': row[3],
-            'timestamp': row[4],
-            'is_from_admin': bool(row[5])
-        })
+    # Недостающую историю дочитываем из архивов старых сообщений
+    if len(rows) < limit:
+        schemas = attach_archives(conn)
+        if schemas:
+            archived = ' UNION ALL '.join(
+                f'SELECT * FROM {schema}.messages WHERE user_id = ?' for schema in schemas
+            )
+            cursor.execute(f'''
+                SELECT * FROM ({archived})
+                ORDER BY timestamp DESC
+                LIMIT ?
+            ''', (*[user_id] * len(schemas), limit - len(rows)))
+            # Строка может оказаться и в архиве, если перенос был прерван
+            seen = {row[0] for row in rows}
+            rows += [row for row in cursor.fetchall() if row[0] not in seen]
     
-    conn.close()
+    messages = [_message_from_row(row) for row in rows]
     return messages[::-1]  # Возвращаем в хронологическом порядке
 
+def get_last_message_id(user_id: int) -> int:
+    """ID последнего сообщения пользователя (0, если сообщений нет)"""
+    conn = get_read_connection()
+    row = conn.execute('SELECT MAX(id) FROM messages WHERE user_id = ?', (user_id,)).fetchone()
+    return row[0] or 0
+
 # Функции для административной панели
-def get_all_tickets(status: str = None) -> List[Dict[str, Any]]:
-    """Получение всех тикетов (для админки)"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
+def _ticket_from_row(row) -> Dict[str, Any]:
+    """Преобразование строки support_tickets + users в словарь"""
+    return {
+        'id': row[0],
+        'user_id': row[1],
+        'description': row[2],
+        'ticket_type': row[3],
+        'status': row[4],
+        'created_at': row[5],
+        'resolved_at': row[6],
+        'admin_notes': row[7],
+        'username': row[8],
+        'first_name': row[9]
+    }
+
+def parse_time(value: str) -> str:
+    """Приведение даты из запроса к формату SQLite ('YYYY-MM-DD HH:MM:SS', UTC)"""
+    return datetime.datetime.fromisoformat(value.replace('Z', '')).strftime('%Y-%m-%d %H:%M:%S')
+
+def encode_cursor(*values) -> str:
+    """Кодирование позиции в списке (ключа последней строки) в непрозрачный курсор"""
+    raw = '\x1f'.join('' if value is None else str(value) for value in values)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor: str, count: int) -> List[str]:
+    """Декодирование курсора; ValueError, если курсор поврежден"""
+    try:
+        values = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('\x1f')
+    except Exception:
+        raise ValueError(f"Некорректный курсор: {cursor}")
+    if len(values) != count:
+        raise ValueError(f"Некорректный курсор: {cursor}")
+    return values
+
+def clamp_page_size(limit) -> int:
+    """Ограничение размера страницы допустимыми пределами"""
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def get_tickets_page(status: str = None, limit: int = PAGE_SIZE,
+                     cursor: str = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Страница тикетов (новые сначала) с keyset-пагинацией по (created_at, id).
+
+    Возвращает тикеты и курсор следующей страницы (None, если страница последняя).
+    """
+    limit = clamp_page_size(limit)
+    conditions = []
+    params = []
     if status:
-        cursor.execute('''
-            SELECT st.*, u.username, u.first_name 
-            FROM support_tickets st 
-            JOIN users u ON st.user_id = u.user_id 
-            WHERE st.status = ?
-            ORDER BY st.created_at DESC
-        ''', (status,))
+        conditions.append('st.status = ?')
+        params.append(status)
+    if cursor:
+        created_at, ticket_id = decode_cursor(cursor, 2)
+        conditions.append('(st.created_at, st.id) < (?, ?)')
+        params.extend([created_at, int(ticket_id)])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    conn = get_read_connection()
+    cursor_db = conn.execute(f'''
+        SELECT st.*, u.username, u.first_name 
+        FROM support_tickets st 
+        JOIN users u ON st.user_id = u.user_id 
+        {where}
+        ORDER BY st.created_at DESC, st.id DESC
+        LIMIT ?
+    ''', (*params, limit + 1))
+    rows = cursor_db.fetchall()
+
+    tickets = [_ticket_from_row(row) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = tickets[-1]
+        next_cursor = encode_cursor(last['created_at'], last['id'])
+    return tickets, next_cursor
+
+def _user_from_row(row) -> Dict[str, Any]:
+    """Преобразование строки users + user_stats в словарь"""
+    return {
+        'user_id': row[0],
+        'username': row[1],
+        'first_name': row[2],
+        'registration_date': row[3],
+        'last_activity': row[4],
+        'message_count': row[5],
+        'ticket_count': row[6],
+        'last_message': row[7] or None
+    }
+
+# Сортировки списка пользователей: имя -> (колонка, тип значения в курсоре).
+# Сортировки по агрегатам идут по индексам user_stats, остальные - по индексам users.
+USER_SORTS = {
+    'last_activity': ('u.last_activity', str),
+    'registration_date': ('u.registration_date', str),
+    'message_count': ('s.message_count', int),
+    'ticket_count': ('s.ticket_count', int),
+    'last_message': ('s.last_message', str),
+}
+
+def get_users_page(sort: str = 'last_activity', order: str = 'desc', limit: int = PAGE_SIZE,
+                   cursor: str = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Страница пользователей с агрегатами из user_stats, keyset-пагинация по (sort, user_id).
+
+    Возвращает пользователей и курсор следующей страницы (None, если страница последняя).
+    """
+    if sort not in USER_SORTS:
+        raise ValueError(f"Неизвестная сортировка: {sort}")
+    if order not in ('asc', 'desc'):
+        raise ValueError(f"Неизвестный порядок сортировки: {order}")
+    column, value_type = USER_SORTS[sort]
+    limit = clamp_page_size(limit)
+
+    # Таблица с колонкой сортировки ведет запрос, чтобы читать ее по индексу
+    if column.startswith('s.'):
+        source = 'user_stats s CROSS JOIN users u ON u.user_id = s.user_id'
+        key = 's.user_id'
     else:
-        cursor.execute('''
-            SELECT st.*, u.username, u.first_name 
-            FROM support_tickets st 
-            JOIN users u ON st.user_id = u.user_id 
-            ORDER BY st.created_at DESC
-        ''')
-    
-    tickets = []
-    for row in cursor.fetchall():
-        tickets.append({
-            'id': row[0],
-            'user_id': row[1],
-            'description': row[2],
-            'ticket_type': row[3],
-            'status': row[4],
-            'created_at': row[5],
-            'resolved_at': row[6],
-            'admin_notes': row[7],
-            'username': row[8],
-            'first_name': row[9]
-        })
-    
-    conn.close()
-    return tickets
+        source = 'users u LEFT JOIN user_stats s ON s.user_id = u.user_id'
+        key = 'u.user_id'
+
+    where = ''
+    params = []
+    if cursor:
+        value, user_id = decode_cursor(cursor, 2)
+        try:
+            params = [value_type(value), int(user_id)]
+        except ValueError:
+            raise ValueError(f"Некорректный курсор: {cursor}")
+        where = f"WHERE ({column}, {key}) {'<' if order == 'desc' else '>'} (?, ?)"
+
+    conn = get_read_connection()
+    cursor_db = conn.execute(f'''
+        SELECT u.user_id, u.username, u.first_name, u.registration_date, u.last_activity,
+               COALESCE(s.message_count, 0), COALESCE(s.ticket_count, 0), s.last_message
+        FROM {source}
+        {where}
+        ORDER BY {column} {order.upper()}, {key} {order.upper()}
+        LIMIT ?
+    ''', (*params, limit + 1))
+    rows = cursor_db.fetchall()
+
+    users = [_user_from_row(row) for row in rows[:limit]]
+
+    next_cursor = None
+    if len(rows) > limit:
+        last = users[-1]
+        sort_value = last[sort] if sort != 'last_message' else (last[sort] or '')
+        next_cursor = encode_cursor(sort_value, last['user_id'])
+    return users, next_cursor
+
+def _iter_rows(cursor_db, batch_size: int = STREAM_BATCH_SIZE) -> Iterator[tuple]:
+    """Ленивое чтение результата запроса пачками"""
+    while True:
+        rows = cursor_db.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+def iter_tickets(status: str = None) -> Iterator[Dict[str, Any]]:
+    """Все тикеты (новые сначала) без загрузки в память.
+
+    Запрос читает один снимок базы, пока генератор не исчерпан или не закрыт.
+    """
+    where = 'WHERE st.status = ?' if status else ''
+    conn = get_read_connection()
+    cursor_db = conn.execute(f'''
+        SELECT st.*, u.username, u.first_name 
+        FROM support_tickets st 
+        JOIN users u ON st.user_id = u.user_id 
+        {where}
+        ORDER BY st.created_at DESC, st.id DESC
+    ''', (status,) if status else ())
+    try:
+        for row in _iter_rows(cursor_db):
+            yield _ticket_from_row(row)
+    finally:
+        cursor_db.close()
+
+def iter_users() -> Iterator[Dict[str, Any]]:
+    """Все пользователи (недавно активные сначала) с агрегатами без загрузки в память"""
+    conn = get_read_connection()
+    cursor_db = conn.execute('''
+        SELECT u.user_id, u.username, u.first_name, u.registration_date, u.last_activity,
+               COALESCE(s.message_count, 0), COALESCE(s.ticket_count, 0), s.last_message
+        FROM users u
+        LEFT JOIN user_stats s ON s.user_id = u.user_id
+        ORDER BY u.last_activity DESC
+    ''')
+    try:
+        for row in _iter_rows(cursor_db):
+            yield _user_from_row(row)
+    finally:
+        cursor_db.close()
+
+def count_users() -> int:
+    """Количество пользователей (из таблицы счетчиков)"""
+    return get_counters().get('users', 0)
+
+def count_tickets(status: str = None) -> int:
+    """Количество тикетов (из таблицы счетчиков)"""
+    name = f'tickets:{status}' if status else 'tickets'
+    return get_counters().get(name, 0)
 
 def update_ticket_status(ticket_id: int, status: str, admin_notes: str = None):
     """Обновление статуса тикета (для админки)"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    if status == 'resolved':
-        cursor.execute('''
-            UPDATE support_tickets 
-            SET status = ?, admin_notes = ?, resolved_at = CURRENT_TIMESTAMP 
-            WHERE id = ?
-        ''', (status, admin_notes, ticket_id))
+    with write_transaction() as conn:
+        apply_ticket_status(conn, ticket_id, status, admin_notes)
+    with _cache_lock:
+        _invalidate_ticket(ticket_id)
+
+def get_counters() -> Dict[str, int]:
+    """Текущие значения счетчиков (поддерживаются триггерами)"""
+    conn = get_read_connection()
+    return dict(conn.execute('SELECT name, value FROM counters').fetchall())
+
+def _actual_counters(conn) -> Dict[str, int]:
+    """Пересчет счетчиков по исходным таблицам (полные сканирования)"""
+    actual = {}
+    for table, name in (('users', 'users'), ('messages', 'messages'),
+                        ('media_files', 'media_files'), ('support_tickets', 'tickets')):
+        actual[name] = conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+    for status, count in conn.execute('SELECT COALESCE(status, \'\'), COUNT(*) FROM support_tickets GROUP BY 1'):
+        actual[f'tickets:{status}'] = count
+    return actual
+
+def _user_stats_counters(conn, source: str, schemas: List[str] = ()) -> Dict[str, Any]:
+    """Агрегаты по пользователям в виде счетчиков 'user:<id>:<поле>'.
+
+    Фактические значения считаются по основной базе и архивам schemas.
+    """
+    if source == 'stored':
+        rows = conn.execute('SELECT user_id, message_count, ticket_count, last_message FROM user_stats')
     else:
-        cursor.execute('''
-            UPDATE support_tickets 
-            SET status = ?, admin_notes = ? 
-            WHERE id = ?
-        ''', (status, admin_notes, ticket_id))
-    
-    conn.commit()
-    conn.close()
+        all_messages = ' UNION ALL '.join(
+            f'SELECT user_id, timestamp FROM {schema}.messages' for schema in ('main', *schemas)
+        )
+        all_tickets = ' UNION ALL '.join(
+            f'SELECT user_id FROM {schema}.support_tickets' for schema in ('main', *schemas)
+        )
+        rows = conn.execute(f'''
+            SELECT user_id, SUM(message_count), SUM(ticket_count), COALESCE(MAX(last_message), '')
+            FROM (
+                SELECT user_id, COUNT(*) AS message_count, 0 AS ticket_count,
+                       MAX(timestamp) AS last_message
+                FROM ({all_messages}) GROUP BY user_id
+                UNION ALL
+                SELECT user_id, 0, COUNT(*), NULL FROM ({all_tickets}) GROUP BY user_id
+            )
+            GROUP BY user_id
+        ''')
+    counters = {}
+    for user_id, message_count, ticket_count, last_message in rows:
+        # Нулевые агрегаты равны значениям по умолчанию, их не сравниваем
+        if message_count or ticket_count or last_message:
+            counters[f'user:{user_id}:messages'] = message_count
+            counters[f'user:{user_id}:tickets'] = ticket_count
+            counters[f'user:{user_id}:last_message'] = last_message
+    return counters
+
+def _add_archived_user_stats(conn, schema: str):
+    """Добавление к user_stats сообщений и тикетов архива schema
+    (агрегаты пользователей учитывают и перенесенную в архивы историю)"""
+    conn.execute(f'''
+        INSERT INTO user_stats (user_id, message_count, last_message)
+        SELECT user_id, COUNT(*), COALESCE(MAX(timestamp), '') FROM {schema}.messages
+        WHERE true GROUP BY user_id
+        ON CONFLICT (user_id) DO UPDATE SET
+            message_count = message_count + excluded.message_count,
+            last_message = max(last_message, excluded.last_message)
+    ''')
+    conn.execute(f'''
+        INSERT INTO user_stats (user_id, ticket_count)
+        SELECT user_id, COUNT(*) FROM {schema}.support_tickets
+        WHERE true GROUP BY user_id
+        ON CONFLICT (user_id) DO UPDATE SET ticket_count = ticket_count + excluded.ticket_count
+    ''')
+
+def verify_counters() -> List[Tuple[str, Any, Any]]:
+    """Сверка счетчиков и агрегатов по пользователям с таблицами:
+    список (счетчик, сохранено, фактически) с расхождениями"""
+    conn = get_read_connection()
+    schemas = attach_archives(conn)
+    with conn:
+        # Читаем счетчики и таблицы из одного снимка
+        conn.execute('BEGIN')
+        stored = dict(conn.execute('SELECT name, value FROM counters').fetchall())
+        actual = _actual_counters(conn)
+        stored.update(_user_stats_counters(conn, 'stored'))
+        actual.update(_user_stats_counters(conn, 'actual', schemas))
+
+    drift = []
+    for name in sorted(set(stored) | set(actual)):
+        default = '' if name.endswith(':last_message') else 0
+        stored_value = stored.get(name, default)
+        actual_value = actual.get(name, default)
+        if stored_value != actual_value:
+            drift.append((name, stored_value, actual_value))
+    return drift
+
+def rebuild_counters():
+    """Пересчет всех счетчиков и агрегатов по пользователям по исходным таблицам"""
+    conn = get_connection()
+    schemas = attach_archives(conn)
+    with write_transaction(conn):
+        for statement in COUNTERS_REBUILD_SQL + USER_STATS_REBUILD_SQL:
+            conn.execute(statement)
+        for schema in schemas:
+            _add_archived_user_stats(conn, schema)
 
 def get_system_stats() -> Dict[str, Any]:
     """Получение системной статистики для админки"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT COUNT(*) FROM users')
-    total_users = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM support_tickets WHERE status = "open"')
-    open_tickets = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM support_tickets WHERE status = "resolved"')
-    resolved_tickets = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM messages')
-    total_messages = cursor.fetchone()[0]
+    conn = get_read_connection()
+    counters = get_counters()
     
-    cursor.execute('SELECT COUNT(*) FROM media_files')
-    total_media = cursor.fetchone()[0]
+    # Активные пользователи за последние 24 часа (диапазон по индексу)
+    cursor = conn.execute('SELECT COUNT(*) FROM users WHERE last_activity > datetime("now", "-1 day")')
+    active_users = cursor.fetchone()[0]
     
-    conn.close()
+    # Перенесенное в архивы учитывается по каталогу архивов (в архивы попадают
+    # только решенные тикеты)
+    archived_messages, archived_tickets = conn.execute(
+        'SELECT COALESCE(SUM(messages), 0), COALESCE(SUM(tickets), 0) FROM archives'
+    ).fetchone()
     
     return {
-        'total_users': total_users,
-        'open_tickets': open_tickets,
-        'resolved_tickets': resolved_tickets,
-        'total_messages': total_messages,
-        'total_media': total_media
+        'total_users': counters.get('users', 0),
+        'open_tickets': counters.get('tickets:open', 0),
+        'resolved_tickets': counters.get('tickets:resolved', 0) + archived_tickets,
+        'total_messages': counters.get('messages', 0) + archived_messages,
+        'total_media': counters.get('media_files', 0),
+        'active_users': active_users
     }
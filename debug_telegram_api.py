@@ -0,0 +1,117 @@
+import argparse
+import asyncio
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from telegram_http import TelegramHTTPClient, AsyncTelegramHTTPClient
+
+# Локальная замена Bot API для проверки клиентов из telegram_http.py:
+# отвечает на любой метод успешным результатом с заданной задержкой.
+# Запуск админки с TELEGRAM_API_URL=http://127.0.0.1:8081 отправляет
+# ответы пользователям в заглушку вместо Telegram.
+
+_message_ids = itertools.count(1)
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, как у настоящего API
+    # Заголовки и тело уходят разными send(): без TCP_NODELAY ответ на
+    # keep-alive соединении ждет отложенного ACK клиента (~40 мс)
+    disable_nagle_algorithm = True
+    delay = 0.0
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        if self.delay:
+            time.sleep(self.delay)
+        result = {'message_id': next(_message_ids), 'chat': {'id': payload.get('chat_id')},
+                  'date': int(time.time()), 'text': payload.get('text')}
+        body = json.dumps({'ok': True, 'result': result}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(port: int = 0, delay: float = 0.0) -> ThreadingHTTPServer:
+    """Запуск заглушки в фоновом потоке (port=0 - любой свободный порт)"""
+    handler = type('Handler', (StandInHandler,), {'delay': delay})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='telegram-stand-in', daemon=True).start()
+    return server
+
+def summary(latencies) -> str:
+    latencies = sorted(latencies)
+    avg = sum(latencies) / len(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    return f"среднее {avg * 1000:.2f} мс, p50 {latencies[len(latencies) // 2] * 1000:.2f} мс, p95 {p95 * 1000:.2f} мс"
+
+def bench(base_url: str, count: int):
+    """Время одного вызова sendMessage: новое соединение на запрос и общий пул"""
+    payload = {'chat_id': 1, 'text': 'bench'}
+
+    latencies = []
+    for _ in range(count):
+        started = time.monotonic()
+        requests.post(f"{base_url}/botTEST/sendMessage", json=payload, timeout=10).json()
+        latencies.append(time.monotonic() - started)
+    print(f"requests.post (новое соединение): {summary(latencies)}")
+
+    client = TelegramHTTPClient('TEST', base_url=base_url)
+    latencies = []
+    for _ in range(count):
+        started = time.monotonic()
+        client.call('sendMessage', payload)
+        latencies.append(time.monotonic() - started)
+    client.close()
+    print(f"TelegramHTTPClient (пул):         {summary(latencies)}")
+
+    async def run_async():
+        client = AsyncTelegramHTTPClient('TEST', base_url=base_url)
+        latencies = []
+        for _ in range(count):
+            started = time.monotonic()
+            await client.call('sendMessage', payload)
+            latencies.append(time.monotonic() - started)
+        await client.close()
+        return latencies
+    print(f"AsyncTelegramHTTPClient (пул):    {summary(asyncio.run(run_async()))}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Локальная заглушка Telegram Bot API')
+    parser.add_argument('command', choices=['serve', 'bench'], help='serve - запустить заглушку, bench - замерить клиентов')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--delay', type=float, default=0.0, help='задержка ответа заглушки, секунды')
+    parser.add_argument('--count', type=int, default=200, help='число запросов в замере')
+    parser.add_argument('--url', help='замерять другой сервер вместо встроенной заглушки')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        server = start_server(args.port, args.delay)
+        print(f"🧪 Заглушка Bot API: http://127.0.0.1:{server.server_port}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+        return
+
+    if args.url:
+        bench(args.url.rstrip('/'), args.count)
+        return
+    server = start_server(0, args.delay)
+    try:
+        bench(f"http://127.0.0.1:{server.server_port}", args.count)
+    finally:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import argparse
+import itertools
+import os
+import time
+
+import requests
+from dotenv import load_dotenv
+load_dotenv()
+
+from webhook import SECRET_HEADER, WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET
+
+# Локальная замена Telegram для проверки режима webhook: отправляет боту
+# обновления с текстовыми сообщениями так же, как это делает Telegram.
+# Ответы бота уходят в настоящий Telegram API, поэтому для проверки лучше
+# использовать тестового бота и свой user_id.
+
+_update_ids = itertools.count(int(time.time()))
+
+def make_update(user_id: int, text: str, first_name: str = 'Debug', username: str = None) -> dict:
+    """Обновление Telegram с текстовым сообщением пользователя"""
+    update_id = next(_update_ids)
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private', 'first_name': first_name},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': first_name},
+        'text': text,
+    }
+    if username:
+        message['from']['username'] = username
+        message['chat']['username'] = username
+    if text.startswith('/'):
+        command = text.split()[0]
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+    return {'update_id': update_id, 'message': message}
+
+def main():
+    parser = argparse.ArgumentParser(description='Отправка тестовых обновлений в webhook бота')
+    parser.add_argument('--url', default=f'http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}',
+                        help='адрес webhook')
+    parser.add_argument('--secret', default=WEBHOOK_SECRET, help='секрет (по умолчанию WEBHOOK_SECRET)')
+    parser.add_argument('--user-id', type=int, default=int(os.getenv('DEBUG_USER_ID', '1')))
+    parser.add_argument('--count', type=int, default=1, help='сколько раз отправить каждое сообщение')
+    parser.add_argument('texts', nargs='*', default=['/start'], help='тексты сообщений')
+    args = parser.parse_args()
+
+    session = requests.Session()
+    started = time.monotonic()
+    sent = 0
+    for _ in range(args.count):
+        for text in args.texts:
+            response = session.post(
+                args.url,
+                json=make_update(args.user_id, text),
+                headers={SECRET_HEADER: args.secret},
+                timeout=10
+            )
+            sent += 1
+            if response.status_code != 200:
+                print(f"❌ {text!r}: HTTP {response.status_code}")
+    elapsed = time.monotonic() - started
+    print(f"📨 Отправлено обновлений: {sent} за {elapsed:.2f} с")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+import csv
+import io
+import json
+import logging
+import zlib
+from typing import Optional, List, Dict, Any, Tuple, Iterator
+
+from database import (
+    get_read_connection, open_readonly_connection, attach_archives, parse_time,
+    encode_cursor, decode_cursor, STREAM_BATCH_SIZE
+)
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Форматы выгрузки: имя -> (MIME-тип, расширение файла).
+# csv.gz - сжатый CSV с заголовком: читается pandas/DuckDB/Spark как таблица
+# без дополнительных зависимостей (для Parquet понадобился бы pyarrow).
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv.gz': ('application/gzip', 'csv.gz'),
+}
+
+# Выгружаемые таблицы: имя -> (ключ, колонка времени, колонки, условие по типу тикета).
+# Выгрузка идет по возрастанию ключа, поэтому ее можно продолжить с курсора.
+# {tickets} в условии - тикеты основной базы вместе с архивными.
+EXPORT_TABLES = {
+    'messages': ('id', 'timestamp',
+                 ['id', 'user_id', 'message_text', 'message_type', 'timestamp', 'is_from_admin'],
+                 'user_id IN (SELECT user_id FROM {tickets} WHERE ticket_type = ?)'),
+    'support_tickets': ('id', 'created_at',
+                        ['id', 'user_id', 'description', 'ticket_type', 'status',
+                         'created_at', 'resolved_at', 'admin_notes'],
+                        'ticket_type = ?'),
+    'media_files': ('id', 'uploaded_at',
+                    ['id', 'user_id', 'ticket_id', 'file_id', 'file_type', 'file_path',
+                     'caption', 'uploaded_at'],
+                    'ticket_id IN (SELECT id FROM {tickets} WHERE ticket_type = ?)'),
+    'users': ('user_id', 'registration_date',
+              ['user_id', 'username', 'first_name', 'registration_date', 'last_activity'],
+              'user_id IN (SELECT user_id FROM {tickets} WHERE ticket_type = ?)'),
+}
+
+# Таблицы, старые строки которых переносятся в архивные базы (archive.py)
+ARCHIVED_TABLES = ('messages', 'support_tickets')
+
+def _build_query(table: str, start: str = None, end: str = None, ticket_type: str = None,
+                 cursor: str = None) -> Tuple[str, List[Any]]:
+    """Условия выгрузки: WHERE и параметры"""
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Неизвестная таблица: {table}")
+    key, time_column, _, ticket_type_condition = EXPORT_TABLES[table]
+
+    conditions = []
+    params = []
+    if cursor:
+        cursor_table, last_key = decode_cursor(cursor, 2)
+        if cursor_table != table or not last_key.isdigit():
+            raise ValueError(f"Некорректный курсор: {cursor}")
+        conditions.append(f'{key} > ?')
+        params.append(int(last_key))
+    if start:
+        conditions.append(f'{time_column} >= ?')
+        params.append(parse_time(start))
+    if end:
+        conditions.append(f'{time_column} < ?')
+        params.append(parse_time(end))
+    if ticket_type:
+        conditions.append(ticket_type_condition)
+        params.append(ticket_type)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    return where, params
+
+def _select_with_archives(conn, table: str, columns: str, where: str, params: List[Any]) -> Tuple[str, List[Any]]:
+    """Запрос к таблице вместе с подключенными архивами (UNION ALL по схемам).
+
+    Каждая часть отбирает строки своим WHERE, ORDER BY по ключу над всем
+    запросом SQLite выполняет слиянием частей, уже упорядоченных по ключу.
+    """
+    archives = attach_archives(conn)
+    if archives:
+        tickets = '(' + ' UNION ALL '.join(
+            f'SELECT id, user_id, ticket_type FROM {schema}.support_tickets' for schema in ['main', *archives]
+        ) + ')'
+    else:
+        tickets = 'main.support_tickets'
+    schemas = ['main', *archives] if table in ARCHIVED_TABLES else ['main']
+    selects = [f'SELECT {columns} FROM {schema}.{table} {where.format(tickets=tickets)}' for schema in schemas]
+    return ' UNION ALL '.join(selects), params * len(schemas)
+
+def plan_export(table: str, start: str = None, end: str = None, ticket_type: str = None,
+                cursor: str = None, limit: int = None) -> Tuple[Optional[int], Optional[str]]:
+    """Граница порции выгрузки из limit строк.
+
+    Возвращает (последний ключ порции, курсор следующей порции). Ключи только
+    растут, поэтому строки, записанные позже, в порцию не попадут.
+    """
+    if not limit:
+        return None, None
+    where, params = _build_query(table, start, end, ticket_type, cursor)
+    key = EXPORT_TABLES[table][0]
+    conn = get_read_connection()
+    query, params = _select_with_archives(conn, table, key, where, params)
+    rows = conn.execute(f'''
+        {query}
+        ORDER BY {key}
+        LIMIT 2 OFFSET ?
+    ''', (*params, limit - 1)).fetchall()
+    if len(rows) < 2:
+        return None, None
+    return rows[0][0], encode_cursor(table, rows[0][0])
+
+def iter_export(table: str, start: str = None, end: str = None, ticket_type: str = None,
+                cursor: str = None, until_key: int = None) -> Iterator[Dict[str, Any]]:
+    """Строки таблицы по возрастанию ключа из снимка базы только для чтения.
+    Сообщения и тикеты выгружаются вместе с архивными."""
+    where, params = _build_query(table, start, end, ticket_type, cursor)
+    key, _, columns, _ = EXPORT_TABLES[table]
+    if until_key is not None:
+        where += f"{' AND' if where else 'WHERE'} {key} <= ?"
+        params.append(until_key)
+
+    conn = open_readonly_connection()
+    try:
+        query, params = _select_with_archives(conn, table, ', '.join(columns), where, params)
+        cursor_db = conn.execute(f'''
+            {query}
+            ORDER BY {key}
+        ''', params)
+        last_key = None
+        while True:
+            rows = cursor_db.fetchmany(STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                # Строка может оказаться и в архиве, если перенос был прерван
+                if row[0] == last_key:
+                    continue
+                last_key = row[0]
+                yield dict(zip(columns, row))
+    finally:
+        conn.close()
+
+def _encode_batches(table: str, rows: Iterator[Dict[str, Any]], fmt: str) -> Iterator[str]:
+    """Строки выгрузки в текст формата пачками по STREAM_BATCH_SIZE строк"""
+    columns = EXPORT_TABLES[table][2]
+    buffer = io.StringIO()
+    if fmt == 'ndjson':
+        write = lambda row: buffer.write(json.dumps(row, ensure_ascii=False) + '\n')
+    else:
+        writer = csv.DictWriter(buffer, fieldnames=columns)
+        writer.writeheader()
+        write = writer.writerow
+
+    count = 0
+    for row in rows:
+        write(row)
+        count += 1
+        if count % STREAM_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def export_chunks(table: str, fmt: str, start: str = None, end: str = None, ticket_type: str = None,
+                  cursor: str = None, until_key: int = None) -> Iterator[bytes]:
+    """Выгрузка таблицы в формате fmt потоком байтов"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат: {fmt}")
+    # Проверяем параметры до начала выгрузки, чтобы ошибка не пришла посреди потока
+    _build_query(table, start, end, ticket_type, cursor)
+
+    rows = iter_export(table, start, end, ticket_type, cursor, until_key)
+    text_format = 'ndjson' if fmt == 'ndjson' else 'csv'
+    if fmt != 'csv.gz':
+        for text in _encode_batches(table, rows, text_format):
+            yield text.encode('utf-8')
+        return
+
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # формат gzip
+    for text in _encode_batches(table, rows, text_format):
+        data = compressor.compress(text.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+def write_export(out, table: str, fmt: str, **filters) -> int:
+    """Выгрузка таблицы в двоичный файловый объект, возвращает число байтов"""
+    size = 0
+    for chunk in export_chunks(table, fmt, **filters):
+        out.write(chunk)
+        size += len(chunk)
+    logger.info(f"Выгрузка {table} ({fmt}): {size} байт")
+    return size
+
+def export_filename(table: str, fmt: str) -> str:
+    """Имя файла выгрузки"""
+    return f"{table}.{EXPORT_FORMATS[fmt][1]}"
@@ -0,0 +1,147 @@
+import argparse
+import logging
+import sys
+
+from database import init_db, verify_counters, rebuild_counters
+from rollups import refresh_rollups
+from search import rebuild_search_index, check_search_index
+from export import EXPORT_TABLES, EXPORT_FORMATS, plan_export, write_export
+from archive import run_archival, ARCHIVE_AFTER_DAYS, ARCHIVE_PERIOD, PERIOD_FORMATS
+from media_store import migrate_flat_media, collect_garbage, MEDIA_GC_GRACE
+
+# Настройка логирования
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+
+def cmd_verify_counters(args):
+    """Сверка счетчиков статистики с таблицами"""
+    drift = verify_counters()
+    if not drift:
+        print("✅ Счетчики совпадают с данными")
+        return 0
+
+    print("❌ Найдены расхождения счетчиков:")
+    for name, stored, actual in drift:
+        print(f"   {name}: сохранено {stored}, фактически {actual}")
+    if args.fix:
+        rebuild_counters()
+        print("🔧 Счетчики пересчитаны")
+        return 0
+    return 1
+
+def cmd_rebuild_counters(args):
+    """Пересчет счетчиков статистики"""
+    rebuild_counters()
+    print("🔧 Счетчики пересчитаны")
+    return 0
+
+def cmd_refresh_rollups(args):
+    """Обновление агрегатов активности"""
+    processed = refresh_rollups()
+    print(f"📈 Агрегаты обновлены: сообщений {processed['messages']}, тикетов {processed['tickets']}")
+    return 0
+
+def cmd_rebuild_search(args):
+    """Заполнение полнотекстового индекса по существующим данным"""
+    if args.check:
+        broken = check_search_index()
+        if not broken:
+            print("✅ Поисковые индексы совпадают с данными")
+            return 0
+        print(f"❌ Поисковые индексы расходятся с данными: {', '.join(broken)}")
+        return 1
+    rebuild_search_index()
+    print("🔍 Поисковые индексы перестроены")
+    return 0
+
+def cmd_export(args):
+    """Выгрузка таблицы в файл или stdout"""
+    filters = {
+        'start': args.start,
+        'end': args.end,
+        'ticket_type': args.ticket_type,
+        'cursor': args.cursor,
+    }
+    until_key, next_cursor = plan_export(args.table, limit=args.limit, **filters)
+    if args.output == '-':
+        write_export(sys.stdout.buffer, args.table, args.format, until_key=until_key, **filters)
+    else:
+        with open(args.output, 'wb') as out:
+            size = write_export(out, args.table, args.format, until_key=until_key, **filters)
+        print(f"📦 {args.table} выгружена в {args.output} ({size} байт)", file=sys.stderr)
+    if next_cursor:
+        print(f"➡️  Продолжить: --cursor {next_cursor}", file=sys.stderr)
+    return 0
+
+def cmd_archive(args):
+    """Перенос старых сообщений и решенных тикетов в архивные базы"""
+    archived = run_archival(args.days, args.period)
+    print(f"🗄 В архив перенесено: сообщений {archived['messages']}, тикетов {archived['support_tickets']}")
+    return 0
+
+def cmd_migrate_media(args):
+    """Перенос медиафайлов из плоского каталога media/ в хранилище по хешу"""
+    stats = migrate_flat_media()
+    print(f"🖼 Перенесено файлов: {stats['migrated']}, из них дубликатов {stats['deduplicated']} "
+          f"({stats['bytes_saved']} байт освобождено)")
+    if stats['missing']:
+        print(f"⚠️  Не найдено или не перенесено: {stats['missing']}")
+        return 1
+    return 0
+
+def cmd_gc_media(args):
+    """Удаление медиафайлов без ссылок"""
+    stats = collect_garbage(args.grace, args.orphans)
+    print(f"🧹 Удалено файлов: {stats['removed']} ({stats['bytes_freed']} байт), без записи в базе: {stats['orphans']}")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Обслуживание базы данных бота")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    verify_parser = subparsers.add_parser('verify-counters', help="сверить счетчики статистики с таблицами")
+    verify_parser.add_argument('--fix', action='store_true', help="пересчитать счетчики при расхождении")
+    verify_parser.set_defaults(handler=cmd_verify_counters)
+
+    rebuild_parser = subparsers.add_parser('rebuild-counters', help="пересчитать счетчики статистики")
+    rebuild_parser.set_defaults(handler=cmd_rebuild_counters)
+
+    rollups_parser = subparsers.add_parser('refresh-rollups', help="обновить почасовые/посуточные агрегаты")
+    rollups_parser.set_defaults(handler=cmd_refresh_rollups)
+
+    search_parser = subparsers.add_parser('rebuild-search', help="заполнить полнотекстовый индекс по существующим данным")
+    search_parser.add_argument('--check', action='store_true', help="только проверить индекс на расхождения")
+    search_parser.set_defaults(handler=cmd_rebuild_search)
+
+    export_parser = subparsers.add_parser('export', help="выгрузить таблицу в CSV/NDJSON/CSV.GZ")
+    export_parser.add_argument('table', choices=list(EXPORT_TABLES), help="таблица")
+    export_parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='csv', help="формат выгрузки")
+    export_parser.add_argument('--output', '-o', default='-', help="файл выгрузки ('-' - stdout)")
+    export_parser.add_argument('--from', dest='start', help="начало периода (UTC, ISO 8601)")
+    export_parser.add_argument('--to', dest='end', help="конец периода, не включается")
+    export_parser.add_argument('--ticket-type', help="только данные тикетов этого типа")
+    export_parser.add_argument('--cursor', help="продолжить выгрузку с курсора")
+    export_parser.add_argument('--limit', type=int, help="выгрузить не больше N строк")
+    export_parser.set_defaults(handler=cmd_export)
+
+    archive_parser = subparsers.add_parser('archive', help="перенести старые данные в архивные базы")
+    archive_parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS, help="старше скольких дней переносить")
+    archive_parser.add_argument('--period', choices=list(PERIOD_FORMATS), default=ARCHIVE_PERIOD, help="период одного архивного файла")
+    archive_parser.set_defaults(handler=cmd_archive)
+
+    migrate_media_parser = subparsers.add_parser('migrate-media', help="перенести медиафайлы из media/ в хранилище по хешу")
+    migrate_media_parser.set_defaults(handler=cmd_migrate_media)
+
+    gc_media_parser = subparsers.add_parser('gc-media', help="удалить медиафайлы, на которые нет ссылок")
+    gc_media_parser.add_argument('--grace', type=int, default=MEDIA_GC_GRACE, help="сколько секунд файл без ссылок хранится")
+    gc_media_parser.add_argument('--orphans', action='store_true', help="также удалить файлы хранилища без записи в базе")
+    gc_media_parser.set_defaults(handler=cmd_gc_media)
+
+    args = parser.parse_args()
+    init_db()
+    sys.exit(args.handler(args))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+from telegram.error import BadRequest, Forbidden
+
+import database
+from media_store import BlobWriter, blob_path
+from outbound import TokenBucket, PRIORITY_NORMAL
+from persistence import write_queue
+from telegram_http import TELEGRAM_HTTP_CONNECT_TIMEOUT, TELEGRAM_HTTP_READ_TIMEOUT, redact_token
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Настройки загрузки медиафайлов
+MEDIA_DOWNLOAD_WORKERS = int(os.getenv('MEDIA_DOWNLOAD_WORKERS', '3'))  # одновременных загрузок
+MEDIA_DOWNLOAD_TIMEOUT = float(os.getenv('MEDIA_DOWNLOAD_TIMEOUT', '300'))  # секунды на один файл
+MEDIA_DOWNLOAD_MAX_ATTEMPTS = int(os.getenv('MEDIA_DOWNLOAD_MAX_ATTEMPTS', '5'))
+MEDIA_RETRY_BASE_DELAY = float(os.getenv('MEDIA_RETRY_BASE_DELAY', '10'))  # секунды, удваивается
+MEDIA_RETRY_MAX_DELAY = float(os.getenv('MEDIA_RETRY_MAX_DELAY', '600'))
+MEDIA_DOWNLOAD_BANDWIDTH = int(os.getenv('MEDIA_DOWNLOAD_BANDWIDTH', '0'))  # байт в секунду на все загрузки, 0 - без ограничения
+MEDIA_MAX_FILE_SIZE = int(os.getenv('MEDIA_MAX_FILE_SIZE', str(20 * 1024 * 1024)))  # Bot API не отдает файлы больше 20 МБ
+MEDIA_POLL_INTERVAL = float(os.getenv('MEDIA_POLL_INTERVAL', '5'))  # проверка отложенных повторов, секунды
+MEDIA_CHUNK_SIZE = 64 * 1024
+
+def extract_media(message) -> Optional[Dict[str, Any]]:
+    """Описание вложения сообщения для очереди загрузки (None - вложения нет)"""
+    if message.photo:
+        # Самый большой размер фото
+        attachment, file_type, file_name = message.photo[-1], 'photo', None
+    elif message.video:
+        attachment, file_type, file_name = message.video, 'video', message.video.file_name
+    elif message.document:
+        attachment, file_type, file_name = message.document, 'document', message.document.file_name
+    else:
+        return None
+    return {
+        'file_id': attachment.file_id,
+        'file_unique_id': attachment.file_unique_id,
+        'file_type': file_type,
+        'file_name': file_name,
+        'file_size': attachment.file_size,
+    }
+
+def media_extension(job: Dict[str, Any], telegram_path: Optional[str]) -> str:
+    """Расширение файла в хранилище"""
+    if job['file_type'] == 'photo':
+        return '.jpg'
+    return (os.path.splitext(job['file_name'] or '')[1]
+            or os.path.splitext(telegram_path or '')[1]
+            or '.bin')
+
+class MediaDownloader:
+    """Фоновая загрузка вложений пользователей в процессе бота.
+
+    Задания хранятся в таблице media_jobs, поэтому переживают перезапуск:
+    прерванные загрузки при старте снова становятся в очередь. Одновременно
+    выполняется не больше workers загрузок, каждая ограничена по времени,
+    общая скорость - ведром токенов на байты. Временные ошибки повторяются
+    с нарастающей задержкой, загруженный файл записывается в media_files.
+    Файл, который уже есть в хранилище (media_store), повторно не загружается.
+    """
+
+    def __init__(self, bot, outbound=None, workers: int = MEDIA_DOWNLOAD_WORKERS,
+                 timeout: float = MEDIA_DOWNLOAD_TIMEOUT, bandwidth: int = MEDIA_DOWNLOAD_BANDWIDTH,
+                 max_attempts: int = MEDIA_DOWNLOAD_MAX_ATTEMPTS, poll_interval: float = MEDIA_POLL_INTERVAL):
+        self._bot = bot
+        self._outbound = outbound
+        self._workers = workers
+        self._timeout = timeout
+        self._max_attempts = max_attempts
+        self._poll_interval = poll_interval
+        # Запас ведра - секунда трафика, но не меньше одного блока
+        self._bandwidth = TokenBucket(bandwidth, max(bandwidth, MEDIA_CHUNK_SIZE)) if bandwidth > 0 else None
+        self._client = None
+        self._wakeup = None
+        self._stopping = False
+        self._task = None
+        self._active = set()
+        self._stats = {'downloaded': 0, 'deduplicated': 0, 'failed': 0, 'retries': 0, 'bytes': 0, 'seconds': 0.0}
+
+    def start(self):
+        """Запуск в текущем event loop (повторный вызов ничего не делает)"""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(TELEGRAM_HTTP_READ_TIMEOUT, connect=TELEGRAM_HTTP_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=self._workers, max_keepalive_connections=self._workers)
+            )
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def wake(self):
+        """Сигнал о новом задании, чтобы не ждать следующей проверки очереди"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def stop(self):
+        """Остановка: начатые загрузки прерываются и продолжатся после перезапуска"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+        for task in list(self._active):
+            task.cancel()
+        if self._active:
+            await asyncio.gather(*self._active, return_exceptions=True)
+        await self._client.aclose()
+        self._task = None
+        logger.info(f"Загрузка медиафайлов: {self.stats()}")
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats['active'] = len(self._active)
+        stats['seconds'] = round(stats['seconds'], 3)
+        stats['avg_bytes_per_second'] = round(stats['bytes'] / stats['seconds']) if stats['seconds'] else None
+        return stats
+
+    async def _run(self):
+        try:
+            count = await write_queue.call(database.reset_media_jobs)
+            if count:
+                logger.warning(f"Возвращено в очередь загрузки медиафайлов: {count}")
+        except Exception as e:
+            logger.error(f"Ошибка восстановления очереди загрузки: {e}")
+        while not self._stopping:
+            self._wakeup.clear()
+            free = self._workers - len(self._active)
+            if free > 0:
+                try:
+                    jobs = await write_queue.call(database.claim_media_jobs, free)
+                except Exception as e:
+                    logger.error(f"Ошибка чтения очереди загрузки: {e}")
+                    jobs = []
+                for job in jobs:
+                    task = asyncio.get_running_loop().create_task(self._process(job))
+                    self._active.add(task)
+                    task.add_done_callback(self._finished)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _finished(self, task):
+        self._active.discard(task)
+        # Освободилось место для следующего задания
+        self._wakeup.set()
+
+    async def _process(self, job: Dict[str, Any]):
+        try:
+            await self._attempt(job)
+        except Exception as e:
+            # Ошибка записи итога: задание останется в downloading до перезапуска
+            logger.error(f"Ошибка обработки загрузки {job['id']}: {e}")
+
+    async def _attempt(self, job: Dict[str, Any]):
+        # Тот же файл уже пересылали: только ссылка на него
+        if await write_queue.call(database.reuse_media_blob, job['id'], job['file_unique_id']):
+            self._stats['deduplicated'] += 1
+            return
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        try:
+            writer, path = await asyncio.wait_for(self._download(job), self._timeout)
+        except asyncio.TimeoutError:
+            await self._retry_or_fail(job, f"Загрузка не уложилась в {self._timeout:.0f} с")
+        except (BadRequest, Forbidden) as e:
+            # Файл недоступен боту (слишком большой, неверный file_id) - повтор не поможет
+            await self._fail(job, str(e))
+        except Exception as e:
+            await self._retry_or_fail(job, redact_token(e, self._bot.token))
+        else:
+            self._stats['downloaded'] += 1
+            self._stats['bytes'] += writer.size
+            self._stats['seconds'] += time.monotonic() - started
+            try:
+                path = await write_queue.call(database.complete_media_job, job['id'], writer.sha256, path, writer.size)
+            except BaseException:
+                await loop.run_in_executor(None, writer.discard)
+                raise
+            await loop.run_in_executor(None, writer.settle, path)
+
+    async def _download(self, job: Dict[str, Any]):
+        telegram_file = await self._bot.get_file(job['file_id'])
+        # Работа с диском и sha256 - в пуле потоков, чтобы загрузка
+        # большого файла не задерживала обработку обновлений
+        loop = asyncio.get_running_loop()
+        writer = await loop.run_in_executor(None, BlobWriter)
+        try:
+            # file_path у telegram.File - полный адрес файла на серверах Telegram
+            async with self._client.stream('GET', telegram_file.file_path) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(MEDIA_CHUNK_SIZE):
+                    if self._bandwidth is not None:
+                        delay = self._bandwidth.reserve(len(chunk), time.monotonic())
+                        if delay:
+                            await asyncio.sleep(delay)
+                    await loop.run_in_executor(None, writer.write, chunk)
+            path = blob_path(writer.sha256, media_extension(job, telegram_file.file_path))
+            await loop.run_in_executor(None, writer.place, path)
+        except BaseException:
+            await loop.run_in_executor(None, writer.discard)
+            raise
+        return writer, path
+
+    async def _retry_or_fail(self, job: Dict[str, Any], error: str):
+        if job['attempts'] >= self._max_attempts:
+            await self._fail(job, error)
+            return
+        self._stats['retries'] += 1
+        delay = min(MEDIA_RETRY_MAX_DELAY, MEDIA_RETRY_BASE_DELAY * 2 ** (job['attempts'] - 1))
+        logger.warning(f"Загрузка файла {job['id']} не удалась ({error}), повтор через {delay:.0f} с")
+        await write_queue.call(database.retry_media_job, job['id'], error, delay)
+
+    async def _fail(self, job: Dict[str, Any], error: str):
+        self._stats['failed'] += 1
+        logger.error(f"Файл {job['id']} пользователя {job['user_id']} не загружен: {error}")
+        await write_queue.call(database.fail_media_job, job['id'], error)
+        if self._outbound is not None:
+            await self._outbound.send(
+                job['user_id'],
+                f"❌ Не удалось сохранить файл к отчету #{job['ticket_id']}. Пожалуйста, отправьте его еще раз.",
+                PRIORITY_NORMAL
+            )
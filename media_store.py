@@ -0,0 +1,200 @@
+import hashlib
+import logging
+import os
+import shutil
+import time
+from typing import Dict, Optional
+
+from database import get_read_connection, write_transaction, register_media_blob
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Настройки хранилища медиафайлов
+MEDIA_DIR = 'media'
+BLOB_DIR = 'blobs'  # внутри MEDIA_DIR
+TEMP_DIR = os.path.join(BLOB_DIR, '.tmp')  # незавершенные загрузки
+MEDIA_GC_GRACE = int(os.getenv('MEDIA_GC_GRACE', '86400'))  # секунды без ссылок до удаления файла
+MEDIA_MIGRATE_BATCH_SIZE = 500
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Файлы лежат по хешу содержимого: media/blobs/ab/cd/<sha256><ext>.
+# Два уровня по 256 каталогов держат каталоги небольшими даже при
+# миллионах файлов, одинаковое содержимое хранится один раз. В media_files.file_path
+# пишется путь относительно MEDIA_DIR, поэтому /media/<path> в админке не меняется.
+
+def blob_path(sha256: str, extension: str) -> str:
+    """Путь файла с содержимым sha256 относительно MEDIA_DIR"""
+    return '/'.join((BLOB_DIR, sha256[:2], sha256[2:4], sha256 + extension.lower()))
+
+def _absolute(path: str) -> str:
+    return os.path.join(MEDIA_DIR, *path.split('/'))
+
+class BlobWriter:
+    """Запись файла во временный каталог с подсчетом sha256 на лету.
+
+    place() до записи в базу кладет файл на место, если такого содержимого
+    на диске еще нет; settle() после записи в базу убирает временный файл.
+    Сбой между ними оставляет файл без ссылок - его удалит collect_garbage.
+    """
+
+    def __init__(self):
+        os.makedirs(_absolute(TEMP_DIR), exist_ok=True)
+        self._hash = hashlib.sha256()
+        self._temp = os.path.join(_absolute(TEMP_DIR), f"{os.getpid()}_{id(self)}_{time.monotonic_ns()}")
+        self._output = open(self._temp, 'wb')
+        self._placed = None
+        self.size = 0
+
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+    def write(self, chunk: bytes):
+        self._output.write(chunk)
+        self._hash.update(chunk)
+        self.size += len(chunk)
+
+    def place(self, path: str):
+        """Перенос файла в хранилище, если там нет такого содержимого"""
+        self._output.close()
+        destination = _absolute(path)
+        if not os.path.exists(destination):
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            os.replace(self._temp, destination)
+            self._placed = path
+
+    def settle(self, path: Optional[str]):
+        """Итог после записи в базу: path - путь, на который ссылается media_files"""
+        if path is not None and path != self._placed:
+            source = _absolute(self._placed) if self._placed else self._temp
+            destination = _absolute(path)
+            if not os.path.exists(destination):
+                # Файл без ссылок успели удалить сборкой мусора до записи в базу
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                os.replace(source, destination)
+            elif self._placed:
+                # То же содержимое уже хранится под другим расширением
+                os.remove(source)
+        self.discard()
+
+    def discard(self):
+        self._output.close()
+        if os.path.exists(self._temp):
+            os.remove(self._temp)
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _migrate_file(flat_path: str, stats: Dict[str, int]):
+    """Перенос одного файла из плоского media/ в хранилище"""
+    source = os.path.join(MEDIA_DIR, flat_path)
+    if not os.path.isfile(source):
+        stats['missing'] += 1
+        logger.warning(f"Медиафайл не найден: {source}")
+        return
+    sha256 = _hash_file(source)
+    size = os.path.getsize(source)
+    path = blob_path(sha256, os.path.splitext(flat_path)[1] or '.bin')
+    destination = _absolute(path)
+    created = not os.path.exists(destination)
+    if created:
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        # Копия, а не перенос: до записи в базу старый путь должен оставаться рабочим
+        try:
+            os.link(source, destination)
+        except OSError:
+            shutil.copy2(source, destination)
+
+    with write_transaction() as conn:
+        path_in_store = register_media_blob(conn, sha256, path, size)
+        conn.execute('''
+            UPDATE media_files SET file_path = ?, blob_sha256 = ?
+            WHERE file_path = ? AND blob_sha256 IS NULL
+        ''', (path_in_store, sha256, flat_path))
+
+    if created and path_in_store != path:
+        os.remove(destination)
+    os.remove(source)
+    stats['migrated'] += 1
+    if not created or path_in_store != path:
+        stats['deduplicated'] += 1
+        stats['bytes_saved'] += size
+
+def migrate_flat_media() -> Dict[str, int]:
+    """Перенос файлов, сохраненных до хранилища (media/<user>_<ticket>_<file_id>.ext).
+
+    Безопасно прерывать и запускать повторно: запись media_files меняется
+    после того, как файл уже лежит в хранилище, старый файл удаляется последним.
+    """
+    stats = {'migrated': 0, 'deduplicated': 0, 'missing': 0, 'bytes_saved': 0}
+    conn = get_read_connection()
+    last_id = 0
+    while True:
+        rows = conn.execute('''
+            SELECT id, file_path FROM media_files
+            WHERE id > ? AND blob_sha256 IS NULL AND file_path IS NOT NULL
+            ORDER BY id LIMIT ?
+        ''', (last_id, MEDIA_MIGRATE_BATCH_SIZE)).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        # Строки с одинаковым file_path переносятся одним обновлением
+        for flat_path in dict.fromkeys(flat_path for _, flat_path in rows):
+            try:
+                _migrate_file(flat_path, stats)
+            except OSError as e:
+                logger.error(f"Ошибка переноса медиафайла {flat_path}: {e}")
+                stats['missing'] += 1
+    logger.info(f"Перенос медиафайлов в хранилище: {stats}")
+    return stats
+
+def _remove_orphans(grace: int) -> int:
+    """Файлы хранилища без строки media_blobs (сбой загрузки или переноса)"""
+    conn = get_read_connection()
+    cutoff = time.time() - grace
+    removed = 0
+    for directory, _, files in os.walk(_absolute(BLOB_DIR)):
+        for name in files:
+            full_path = os.path.join(directory, name)
+            if os.path.getmtime(full_path) >= cutoff:
+                continue
+            if directory != _absolute(TEMP_DIR):
+                path = os.path.relpath(full_path, MEDIA_DIR).replace(os.sep, '/')
+                if conn.execute('SELECT 1 FROM media_blobs WHERE path = ?', (path,)).fetchone():
+                    continue
+            os.remove(full_path)
+            removed += 1
+    return removed
+
+def collect_garbage(grace: int = MEDIA_GC_GRACE, orphans: bool = False) -> Dict[str, int]:
+    """Удаление файлов, на которые дольше grace секунд не ссылается ни одна запись media_files"""
+    stats = {'removed': 0, 'bytes_freed': 0, 'orphans': 0}
+    candidates = get_read_connection().execute('''
+        SELECT sha256 FROM media_blobs
+        WHERE ref_count <= 0 AND updated_at < datetime('now', '-' || ? || ' seconds')
+    ''', (grace,)).fetchall()
+    for (sha256,) in candidates:
+        # Ссылка могла появиться после выборки - проверяем снова при удалении
+        with write_transaction() as conn:
+            row = conn.execute(
+                'DELETE FROM media_blobs WHERE sha256 = ? AND ref_count <= 0 RETURNING path, size',
+                (sha256,)
+            ).fetchone()
+        if row is None:
+            continue
+        path, size = row
+        try:
+            os.remove(_absolute(path))
+        except FileNotFoundError:
+            pass
+        stats['removed'] += 1
+        stats['bytes_freed'] += size
+    if orphans:
+        stats['orphans'] = _remove_orphans(grace)
+    logger.info(f"Сборка мусора медиафайлов: {stats}")
+    return stats
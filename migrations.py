@@ -0,0 +1,487 @@
+import logging
+from typing import List
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Сколько последних событий хранит лента изменений change_feed
+CHANGE_FEED_SIZE = 10000
+
+# Пересчет счетчиков таблицы counters по исходным таблицам.
+# Используется при создании счетчиков и командой manage.py rebuild-counters.
+COUNTERS_REBUILD_SQL = [
+    'DELETE FROM counters',
+    "INSERT INTO counters (name, value) SELECT 'users', COUNT(*) FROM users",
+    "INSERT INTO counters (name, value) SELECT 'messages', COUNT(*) FROM messages",
+    "INSERT INTO counters (name, value) SELECT 'media_files', COUNT(*) FROM media_files",
+    "INSERT INTO counters (name, value) SELECT 'tickets', COUNT(*) FROM support_tickets",
+    """INSERT INTO counters (name, value)
+       SELECT 'tickets:' || COALESCE(status, ''), COUNT(*) FROM support_tickets GROUP BY 1""",
+]
+
+# Пересчет агрегатов по пользователям (таблица user_stats) по исходным таблицам.
+# Используется при создании таблицы и командой manage.py rebuild-counters.
+USER_STATS_REBUILD_SQL = [
+    'DELETE FROM user_stats',
+    'INSERT INTO user_stats (user_id) SELECT user_id FROM users',
+    """INSERT INTO user_stats (user_id, message_count, last_message)
+       SELECT user_id, COUNT(*), COALESCE(MAX(timestamp), '') FROM messages WHERE true GROUP BY user_id
+       ON CONFLICT (user_id) DO UPDATE SET
+           message_count = excluded.message_count, last_message = excluded.last_message""",
+    """INSERT INTO user_stats (user_id, ticket_count)
+       SELECT user_id, COUNT(*) FROM support_tickets WHERE true GROUP BY user_id
+       ON CONFLICT (user_id) DO UPDATE SET ticket_count = excluded.ticket_count""",
+]
+
+# Полнотекстовые индексы FTS5: (индекс, таблица, индексируемые колонки).
+# Индексы хранят только токены, текст читается из исходных таблиц.
+SEARCH_INDEXES = [
+    ('messages_fts', 'messages', ['message_text']),
+    ('tickets_fts', 'support_tickets', ['description', 'admin_notes']),
+    ('media_fts', 'media_files', ['caption']),
+]
+
+# Перестроение полнотекстовых индексов по исходным таблицам.
+# Используется при создании индексов и командой manage.py rebuild-search.
+SEARCH_REBUILD_SQL = [
+    f"INSERT INTO {index}({index}) VALUES ('rebuild')" for index, _, _ in SEARCH_INDEXES
+]
+
+def _counter_triggers(table: str, counter: str) -> List[str]:
+    """Триггеры, поддерживающие счетчик строк таблицы"""
+    return [
+        f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_count_insert AFTER INSERT ON {table}
+            BEGIN
+                UPDATE counters SET value = value + 1 WHERE name = '{counter}';
+            END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_count_delete AFTER DELETE ON {table}
+            BEGIN
+                UPDATE counters SET value = value - 1 WHERE name = '{counter}';
+            END''',
+    ]
+
+def search_index_sql(index: str, table: str, columns: List[str]) -> List[str]:
+    """Полнотекстовый индекс над колонками таблицы и триггеры его синхронизации"""
+    column_list = ', '.join(columns)
+    new_values = ', '.join(f'NEW.{column}' for column in columns)
+    old_values = ', '.join(f'OLD.{column}' for column in columns)
+    delete_old = f'''INSERT INTO {index} ({index}, rowid, {column_list})
+                    VALUES ('delete', OLD.id, {old_values});'''
+    insert_new = f'''INSERT INTO {index} (rowid, {column_list})
+                    VALUES (NEW.id, {new_values});'''
+    return [
+        f'''CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5(
+            {column_list},
+            content='{table}',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_{index}_insert AFTER INSERT ON {table}
+            BEGIN
+                {insert_new}
+            END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_{index}_delete AFTER DELETE ON {table}
+            BEGIN
+                {delete_old}
+            END''',
+        f'''CREATE TRIGGER IF NOT EXISTS trg_{index}_update AFTER UPDATE OF {column_list} ON {table}
+            BEGIN
+                {delete_old}
+                {insert_new}
+            END''',
+    ]
+
+# Миграции схемы: (версия, описание, шаги). Шаг - SQL-запрос или функция,
+# принимающая соединение. Миграции только добавляют объекты (индексы, таблицы,
+# триггеры) и не перестраивают существующие таблицы, поэтому применяются
+# при запуске на рабочей базе.
+MIGRATIONS = [
+    (1, 'Индексы для частых запросов', [
+        # get_conversation_messages: WHERE user_id = ? ORDER BY timestamp
+        'CREATE INDEX IF NOT EXISTS idx_messages_user_timestamp ON messages (user_id, timestamp)',
+        # Список тикетов: WHERE status = ? ORDER BY created_at, подсчет тикетов по статусу
+        'CREATE INDEX IF NOT EXISTS idx_tickets_status_created ON support_tickets (status, created_at)',
+        # Список тикетов без фильтра: ORDER BY created_at
+        'CREATE INDEX IF NOT EXISTS idx_tickets_created ON support_tickets (created_at)',
+        # get_media_files_by_ticket: WHERE ticket_id = ? ORDER BY uploaded_at
+        'CREATE INDEX IF NOT EXISTS idx_media_ticket_uploaded ON media_files (ticket_id, uploaded_at)',
+        # get_system_stats: WHERE last_activity > ?
+        'CREATE INDEX IF NOT EXISTS idx_users_last_activity ON users (last_activity)',
+    ]),
+    (2, 'Счетчики строк и тикетов по статусам', [
+        '''CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID''',
+        *_counter_triggers('users', 'users'),
+        *_counter_triggers('messages', 'messages'),
+        *_counter_triggers('media_files', 'media_files'),
+        # Тикеты: общий счетчик и счетчик по каждому статусу
+        '''CREATE TRIGGER IF NOT EXISTS trg_tickets_count_insert AFTER INSERT ON support_tickets
+            BEGIN
+                UPDATE counters SET value = value + 1 WHERE name = 'tickets';
+                INSERT INTO counters (name, value) VALUES ('tickets:' || COALESCE(NEW.status, ''), 1)
+                    ON CONFLICT (name) DO UPDATE SET value = value + 1;
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_tickets_count_delete AFTER DELETE ON support_tickets
+            BEGIN
+                UPDATE counters SET value = value - 1 WHERE name = 'tickets';
+                UPDATE counters SET value = value - 1 WHERE name = 'tickets:' || COALESCE(OLD.status, '');
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_tickets_count_status AFTER UPDATE OF status ON support_tickets
+            WHEN OLD.status IS NOT NEW.status
+            BEGIN
+                UPDATE counters SET value = value - 1 WHERE name = 'tickets:' || COALESCE(OLD.status, '');
+                INSERT INTO counters (name, value) VALUES ('tickets:' || COALESCE(NEW.status, ''), 1)
+                    ON CONFLICT (name) DO UPDATE SET value = value + 1;
+            END''',
+        *COUNTERS_REBUILD_SQL,
+    ]),
+    (3, 'Почасовые и посуточные агрегаты активности', [
+        '''CREATE TABLE IF NOT EXISTS activity_rollups (
+            granularity TEXT NOT NULL,
+            metric TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            is_from_admin INTEGER NOT NULL DEFAULT 0,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (granularity, metric, bucket, kind, is_from_admin)
+        ) WITHOUT ROWID''',
+        # Отметка последней учтенной строки каждой исходной таблицы
+        '''CREATE TABLE IF NOT EXISTS rollup_state (
+            source TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL DEFAULT 0
+        )''',
+        "INSERT OR IGNORE INTO rollup_state (source, last_id) VALUES ('messages', 0), ('support_tickets', 0)",
+    ]),
+    (4, 'Лента изменений для push-уведомлений админки', [
+        '''CREATE TABLE IF NOT EXISTS change_feed (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            entity_id INTEGER,
+            user_id INTEGER,
+            payload TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        # Лента хранит только последние CHANGE_FEED_SIZE событий
+        f'''CREATE TRIGGER IF NOT EXISTS trg_change_feed_prune AFTER INSERT ON change_feed
+            BEGIN
+                DELETE FROM change_feed WHERE id <= NEW.id - {CHANGE_FEED_SIZE};
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_messages_feed AFTER INSERT ON messages
+            BEGIN
+                INSERT INTO change_feed (kind, entity_id, user_id, payload)
+                VALUES ('message', NEW.id, NEW.user_id, json_object(
+                    'id', NEW.id,
+                    'user_id', NEW.user_id,
+                    'message_text', NEW.message_text,
+                    'message_type', NEW.message_type,
+                    'timestamp', NEW.timestamp,
+                    'is_from_admin', json(CASE WHEN NEW.is_from_admin THEN 'true' ELSE 'false' END)
+                ));
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_tickets_feed_insert AFTER INSERT ON support_tickets
+            BEGIN
+                INSERT INTO change_feed (kind, entity_id, user_id, payload)
+                VALUES ('ticket_created', NEW.id, NEW.user_id, json_object(
+                    'id', NEW.id,
+                    'user_id', NEW.user_id,
+                    'ticket_type', NEW.ticket_type,
+                    'status', NEW.status,
+                    'created_at', NEW.created_at,
+                    'description', substr(NEW.description, 1, 200)
+                ));
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_tickets_feed_status AFTER UPDATE OF status ON support_tickets
+            WHEN OLD.status IS NOT NEW.status
+            BEGIN
+                INSERT INTO change_feed (kind, entity_id, user_id, payload)
+                VALUES ('ticket_status', NEW.id, NEW.user_id, json_object(
+                    'id', NEW.id,
+                    'user_id', NEW.user_id,
+                    'old_status', OLD.status,
+                    'status', NEW.status
+                ));
+            END''',
+    ]),
+    (5, 'Полнотекстовый поиск по сообщениям, тикетам и подписям к медиа', [
+        *[step for index in SEARCH_INDEXES for step in search_index_sql(*index)],
+        # Переход от найденного сообщения к последнему тикету пользователя
+        'CREATE INDEX IF NOT EXISTS idx_tickets_user ON support_tickets (user_id)',
+        *SEARCH_REBUILD_SQL,
+    ]),
+    (6, 'Агрегаты по пользователям для страницы пользователей', [
+        # last_message - пустая строка, пока сообщений нет (для сортировки по индексу)
+        '''CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            ticket_count INTEGER NOT NULL DEFAULT 0,
+            last_message TEXT NOT NULL DEFAULT ''
+        )''',
+        # Сортировки страницы пользователей
+        'CREATE INDEX IF NOT EXISTS idx_user_stats_messages ON user_stats (message_count)',
+        'CREATE INDEX IF NOT EXISTS idx_user_stats_tickets ON user_stats (ticket_count)',
+        'CREATE INDEX IF NOT EXISTS idx_user_stats_last_message ON user_stats (last_message)',
+        'CREATE INDEX IF NOT EXISTS idx_users_registration ON users (registration_date)',
+        # Строка пользователя может замениться через INSERT OR REPLACE (так
+        # работал save_user): строка агрегатов переживает замену, поэтому
+        # триггера на удаление из users нет. OR IGNORE здесь не годится -
+        # внешний OR REPLACE переопределил бы его в триггере
+        '''CREATE TRIGGER IF NOT EXISTS trg_users_stats_insert AFTER INSERT ON users
+            BEGIN
+                INSERT INTO user_stats (user_id)
+                    SELECT NEW.user_id
+                    WHERE NOT EXISTS (SELECT 1 FROM user_stats WHERE user_id = NEW.user_id);
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_messages_stats_insert AFTER INSERT ON messages
+            BEGIN
+                INSERT INTO user_stats (user_id, message_count, last_message)
+                    VALUES (NEW.user_id, 1, COALESCE(NEW.timestamp, ''))
+                    ON CONFLICT (user_id) DO UPDATE SET
+                        message_count = message_count + 1,
+                        last_message = max(last_message, excluded.last_message);
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_messages_stats_delete AFTER DELETE ON messages
+            BEGIN
+                UPDATE user_stats SET
+                    message_count = message_count - 1,
+                    last_message = COALESCE((SELECT MAX(timestamp) FROM messages
+                                             WHERE user_id = OLD.user_id), '')
+                WHERE user_id = OLD.user_id;
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_tickets_stats_insert AFTER INSERT ON support_tickets
+            BEGIN
+                INSERT INTO user_stats (user_id, ticket_count) VALUES (NEW.user_id, 1)
+                    ON CONFLICT (user_id) DO UPDATE SET ticket_count = ticket_count + 1;
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_tickets_stats_delete AFTER DELETE ON support_tickets
+            BEGIN
+                UPDATE user_stats SET ticket_count = ticket_count - 1 WHERE user_id = OLD.user_id;
+            END''',
+        *USER_STATS_REBUILD_SQL,
+    ]),
+    (7, 'Каталог архивных баз со старыми сообщениями и тикетами', [
+        # Сколько строк перенесено в каждый архив: статистика учитывает их без ATTACH
+        '''CREATE TABLE IF NOT EXISTS archives (
+            period TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            messages INTEGER NOT NULL DEFAULT 0,
+            tickets INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+    ]),
+    (8, 'События изменения пользователей и заметок тикетов для сброса кэшей', [
+        # Новый пользователь - вставка, смена имени в save_user - обновление
+        # (INSERT OR REPLACE - удаление и вставка, его покрывает первый триггер)
+        '''CREATE TRIGGER IF NOT EXISTS trg_users_feed_insert AFTER INSERT ON users
+            BEGIN
+                INSERT INTO change_feed (kind, entity_id, user_id, payload)
+                VALUES ('user_updated', NEW.user_id, NEW.user_id, json_object(
+                    'user_id', NEW.user_id,
+                    'username', NEW.username,
+                    'first_name', NEW.first_name
+                ));
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_users_feed_update AFTER UPDATE OF username, first_name ON users
+            WHEN NEW.username IS NOT OLD.username OR NEW.first_name IS NOT OLD.first_name
+            BEGIN
+                INSERT INTO change_feed (kind, entity_id, user_id, payload)
+                VALUES ('user_updated', NEW.user_id, NEW.user_id, json_object(
+                    'user_id', NEW.user_id,
+                    'username', NEW.username,
+                    'first_name', NEW.first_name
+                ));
+            END''',
+        # Смену статуса уже публикует trg_tickets_feed_status
+        '''CREATE TRIGGER IF NOT EXISTS trg_tickets_feed_notes AFTER UPDATE OF admin_notes ON support_tickets
+            WHEN NEW.admin_notes IS NOT OLD.admin_notes AND NEW.status IS OLD.status
+            BEGIN
+                INSERT INTO change_feed (kind, entity_id, user_id, payload)
+                VALUES ('ticket_updated', NEW.id, NEW.user_id, json_object(
+                    'id', NEW.id,
+                    'user_id', NEW.user_id,
+                    'status', NEW.status
+                ));
+            END''',
+    ]),
+    (9, 'Счетчики нажатий кнопок меню по часам', [
+        # Навигация по меню не пишется в messages: бот копит нажатия в памяти
+        # и прибавляет их пачками
+        '''CREATE TABLE IF NOT EXISTS menu_clicks (
+            bucket TEXT NOT NULL,
+            button TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (bucket, button, user_id)
+        ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS idx_menu_clicks_user ON menu_clicks (user_id, bucket)',
+    ]),
+    (10, 'Рассылки и их получатели', [
+        # status: running, paused, completed, cancelled
+        '''CREATE TABLE IF NOT EXISTS campaigns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            message_text TEXT NOT NULL,
+            audience TEXT NOT NULL,
+            audience_days INTEGER,
+            status TEXT NOT NULL DEFAULT 'running',
+            total INTEGER NOT NULL DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            started_at DATETIME,
+            finished_at DATETIME
+        )''',
+        # Список получателей фиксируется при создании рассылки.
+        # status: pending, sending (пачка отправляется), sent, failed
+        '''CREATE TABLE IF NOT EXISTS campaign_recipients (
+            campaign_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            message_id INTEGER,
+            error TEXT,
+            sent_at DATETIME,
+            PRIMARY KEY (campaign_id, user_id)
+        ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS idx_campaign_recipients_status ON campaign_recipients (campaign_id, status, user_id)',
+    ]),
+    (11, 'Очередь ответов администраторов (outbox)', [
+        # Админка сохраняет ответ, бот отправляет его и пишет в messages.
+        # status: pending, sending, sent, failed
+        '''CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            ticket_id INTEGER,
+            message_text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            message_id INTEGER,
+            logged_message_id INTEGER,
+            error TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            sent_at DATETIME
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (status, next_attempt_at)',
+        '''CREATE TRIGGER IF NOT EXISTS trg_outbox_feed_status AFTER UPDATE OF status ON outbox
+            WHEN OLD.status IS NOT NEW.status
+            BEGIN
+                INSERT INTO change_feed (kind, entity_id, user_id, payload)
+                VALUES ('outbox_status', NEW.id, NEW.user_id, json_object(
+                    'id', NEW.id,
+                    'user_id', NEW.user_id,
+                    'ticket_id', NEW.ticket_id,
+                    'status', NEW.status,
+                    'attempts', NEW.attempts,
+                    'error', NEW.error
+                ));
+            END''',
+    ]),
+    (12, 'Очередь загрузки медиафайлов', [
+        # Бот сохраняет file_id и сразу отвечает пользователю, файл скачивают
+        # фоновые загрузчики. status: pending, downloading, done, failed
+        '''CREATE TABLE IF NOT EXISTS media_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            ticket_id INTEGER,
+            file_id TEXT NOT NULL,
+            file_unique_id TEXT,
+            file_type TEXT NOT NULL,
+            file_name TEXT,
+            file_size INTEGER,
+            caption TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            error TEXT,
+            media_file_id INTEGER,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            finished_at DATETIME
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_media_jobs_pending ON media_jobs (status, next_attempt_at)',
+    ]),
+    (13, 'Хранилище медиафайлов по хешу содержимого', [
+        # Один файл на содержимое: media/blobs/ab/cd/<sha256><ext>.
+        # ref_count - число строк media_files, ссылающихся на файл
+        '''CREATE TABLE IF NOT EXISTS media_blobs (
+            sha256 TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID''',
+        'ALTER TABLE media_files ADD COLUMN blob_sha256 TEXT',
+        'ALTER TABLE media_files ADD COLUMN file_unique_id TEXT',
+        # Повторная пересылка того же файла: поиск по file_unique_id без загрузки
+        'CREATE INDEX IF NOT EXISTS idx_media_files_unique_id ON media_files (file_unique_id)',
+        # Сборка мусора: файлы без ссылок
+        'CREATE INDEX IF NOT EXISTS idx_media_blobs_unreferenced ON media_blobs (updated_at) WHERE ref_count <= 0',
+        '''CREATE TRIGGER IF NOT EXISTS trg_media_blobs_ref_insert AFTER INSERT ON media_files
+            WHEN NEW.blob_sha256 IS NOT NULL
+            BEGIN
+                UPDATE media_blobs SET ref_count = ref_count + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE sha256 = NEW.blob_sha256;
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_media_blobs_ref_delete AFTER DELETE ON media_files
+            WHEN OLD.blob_sha256 IS NOT NULL
+            BEGIN
+                UPDATE media_blobs SET ref_count = ref_count - 1, updated_at = CURRENT_TIMESTAMP
+                WHERE sha256 = OLD.blob_sha256;
+            END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_media_blobs_ref_update AFTER UPDATE OF blob_sha256 ON media_files
+            WHEN OLD.blob_sha256 IS NOT NEW.blob_sha256
+            BEGIN
+                UPDATE media_blobs SET ref_count = ref_count - 1, updated_at = CURRENT_TIMESTAMP
+                WHERE sha256 = OLD.blob_sha256;
+                UPDATE media_blobs SET ref_count = ref_count + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE sha256 = NEW.blob_sha256;
+            END''',
+    ]),
+]
+
+def get_schema_version(conn) -> int:
+    """Текущая версия схемы базы данных"""
+    row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return row[0] or 0
+
+def apply_migrations(conn):
+    """Применение недостающих миграций"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+
+    current_version = get_schema_version(conn)
+    for version, description, steps in MIGRATIONS:
+        if version <= current_version:
+            continue
+
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Бот и админка стартуют одновременно: миграцию мог применить
+            # другой процесс, пока мы ждали блокировку
+            if get_schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(
+                'INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                (version, description)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.exception(f"Ошибка применения миграции {version}: {description}")
+            raise
+        logger.info(f"Применена миграция {version}: {description}")
+
+    # Обновляем статистику планировщика для новых индексов
+    conn.execute('PRAGMA optimize')
@@ -0,0 +1,449 @@
+import asyncio
+import concurrent.futures
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+
+from telegram_http import AsyncTelegramHTTPClient, TelegramAPIError, TelegramNetworkError
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Ограничения Telegram: около 30 сообщений в секунду на бота и около одного
+# в секунду в один чат (короткие всплески допускаются)
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', '25'))  # сообщений в секунду
+OUTBOUND_GLOBAL_BURST = int(os.getenv('OUTBOUND_GLOBAL_BURST', '25'))
+OUTBOUND_CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', '1'))  # сообщений в секунду в один чат
+OUTBOUND_CHAT_BURST = int(os.getenv('OUTBOUND_CHAT_BURST', '3'))
+OUTBOUND_CONCURRENCY = int(os.getenv('OUTBOUND_CONCURRENCY', '8'))  # одновременных запросов к API
+OUTBOUND_QUEUE_SIZE = int(os.getenv('OUTBOUND_QUEUE_SIZE', '10000'))
+OUTBOUND_MAX_ATTEMPTS = int(os.getenv('OUTBOUND_MAX_ATTEMPTS', '5'))
+OUTBOUND_RETRY_BASE_DELAY = float(os.getenv('OUTBOUND_RETRY_BASE_DELAY', '1.0'))  # секунды
+OUTBOUND_RETRY_MAX_DELAY = float(os.getenv('OUTBOUND_RETRY_MAX_DELAY', '60'))  # секунды
+OUTBOUND_WAIT_TIMEOUT = float(os.getenv('OUTBOUND_WAIT_TIMEOUT', '30'))  # ожидание результата в синхронном коде
+OUTBOUND_SCAN_LIMIT = 100  # сколько сообщений очереди просматривать в поисках готового к отправке
+
+# Приоритеты: меньше - раньше
+PRIORITY_ADMIN = 0   # ответы администраторов
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2    # массовые рассылки
+
+class RetryLater(Exception):
+    """Telegram просит повторить не раньше чем через retry_after секунд (HTTP 429)"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Повтор через {retry_after} с")
+        self.retry_after = retry_after
+
+class TemporaryDeliveryError(Exception):
+    """Временная ошибка (сеть, 5xx): отправка повторяется с нарастающей задержкой"""
+
+@dataclass
+class DeliveryResult:
+    """Итог доставки сообщения"""
+    ok: bool
+    chat_id: int
+    status: str  # sent, failed, rejected (очередь полна или остановлена), pending (не дождались)
+    attempts: int = 0
+    message_id: Optional[int] = None
+    error: Optional[str] = None
+    queued_seconds: float = 0.0
+    retryable: bool = False  # временная ошибка: можно отправить заново позже
+
+    @property
+    def description(self) -> str:
+        if self.ok:
+            return "Сообщение отправлено"
+        if self.status == 'pending':
+            return "Сообщение в очереди отправки"
+        return f"Ошибка отправки: {self.error}"
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity про запас"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready_at(self, now: float) -> float:
+        """Момент, когда будет доступен токен"""
+        if self.blocked_until > now:
+            return self.blocked_until
+        self._refill(now)
+        if self.tokens >= 1:
+            return now
+        return now + (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Списание amount токенов, в том числе в долг; возвращает, сколько
+        секунд ждать, пока долг не будет погашен"""
+        self._refill(now)
+        self.tokens -= amount
+        return max(0.0, -self.tokens / self.rate)
+
+    def block(self, until: float):
+        """Запрет выдачи токенов до момента until"""
+        self.blocked_until = max(self.blocked_until, until)
+
+    def idle(self, now: float) -> bool:
+        """Ведро полное и не заблокировано - его можно удалить"""
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+class _Delivery:
+    """Сообщение в очереди отправки"""
+    __slots__ = ('priority', 'seq', 'chat_id', 'text', 'options', 'future',
+                 'attempts', 'not_before', 'created', 'error')
+
+    def __init__(self, priority, seq, chat_id, text, options, future):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.text = text
+        self.options = options
+        self.future = future
+        self.attempts = 0
+        self.not_before = 0.0
+        self.created = time.monotonic()
+        self.error = None
+
+    def __lt__(self, other):
+        # Повторная попытка сохраняет исходный номер и место среди сообщений того же приоритета
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class OutboundQueue:
+    """Очередь исходящих сообщений с ограничением скорости и повторами.
+
+    Сообщения отправляются по приоритету (ответы администраторов раньше
+    рассылок) и в порядке постановки внутри приоритета. Скорость ограничивают
+    ведро токенов на всего бота и ведро на каждый чат. Ответ 429 приостанавливает
+    всю отправку на retry_after секунд, временные ошибки повторяются с
+    экспоненциальной задержкой. Итог доставки возвращается через future.
+
+    send(chat_id, text, **options) отправляет одно сообщение и возвращает его
+    message_id; он должен бросать RetryLater и TemporaryDeliveryError для
+    повторяемых ошибок, любое другое исключение - окончательная ошибка.
+    Все методы, кроме stats, вызываются из event loop очереди.
+    """
+
+    def __init__(self, send: Callable[..., Awaitable[Optional[int]]],
+                 global_rate: float = OUTBOUND_GLOBAL_RATE, global_burst: int = OUTBOUND_GLOBAL_BURST,
+                 chat_rate: float = OUTBOUND_CHAT_RATE, chat_burst: int = OUTBOUND_CHAT_BURST,
+                 concurrency: int = OUTBOUND_CONCURRENCY, max_size: int = OUTBOUND_QUEUE_SIZE,
+                 max_attempts: int = OUTBOUND_MAX_ATTEMPTS):
+        self._send = send
+        self._global = TokenBucket(global_rate, global_burst)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._chats: Dict[Any, TokenBucket] = {}
+        self._concurrency = concurrency
+        self._max_size = max_size
+        self._max_attempts = max_attempts
+        self._heap = []
+        self._seq = itertools.count()
+        self._slots = None
+        self._wakeup = None
+        self._dispatcher = None
+        self._tasks = set()
+        self._in_flight = set()  # чаты, сообщение в которые отправляется сейчас
+        self._stopping = False
+        self._stats = {
+            'submitted': 0,
+            'sent': 0,
+            'failed': 0,
+            'rejected': 0,
+            'retries': 0,
+            'retry_after': 0,
+            'queued_seconds': 0.0,
+        }
+
+    def submit(self, chat_id: int, text: str, priority: int = PRIORITY_NORMAL, **options) -> asyncio.Future:
+        """Постановка сообщения в очередь, future получит DeliveryResult"""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        if self._stopping or len(self._heap) >= self._max_size:
+            self._stats['rejected'] += 1
+            error = "Очередь отправки остановлена" if self._stopping else "Очередь отправки переполнена"
+            future.set_result(DeliveryResult(False, chat_id, 'rejected', error=error, retryable=True))
+            return future
+        self._stats['submitted'] += 1
+        heapq.heappush(self._heap, _Delivery(priority, next(self._seq), chat_id, text, options, future))
+        self._wakeup.set()
+        return future
+
+    async def send(self, chat_id: int, text: str, priority: int = PRIORITY_NORMAL, **options) -> DeliveryResult:
+        """Отправка через очередь с ожиданием итога"""
+        return await self.submit(chat_id, text, priority, **options)
+
+    async def stop(self, timeout: float = OUTBOUND_WAIT_TIMEOUT):
+        """Отправка оставшихся сообщений (не дольше timeout) и остановка"""
+        if self._dispatcher is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._dispatcher), timeout)
+            if self._tasks:
+                await asyncio.wait(list(self._tasks), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не отправлено сообщений при остановке: {len(self._heap)}")
+        self._dispatcher.cancel()
+        for task in list(self._tasks):
+            task.cancel()
+        while self._heap:
+            item = heapq.heappop(self._heap)
+            self._finish(item, 'rejected', error="Очередь отправки остановлена", retryable=True)
+        logger.info(f"Очередь отправки остановлена: {self.stats()}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики отправки и текущая длина очереди"""
+        stats = dict(self._stats)
+        delivered = stats['sent'] + stats['failed']
+        stats['avg_queued_seconds'] = round(stats['queued_seconds'] / delivered, 3) if delivered else None
+        stats['queued_seconds'] = round(stats['queued_seconds'], 3)
+        stats['queue_size'] = len(self._heap)
+        stats['in_flight'] = len(self._tasks)
+        stats['paused_seconds'] = round(max(0.0, self._global.blocked_until - time.monotonic()), 3)
+        return stats
+
+    def _ensure_started(self):
+        if self._dispatcher is None:
+            self._slots = asyncio.Semaphore(self._concurrency)
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self._chat_rate, self._chat_burst)
+        return bucket
+
+    def _next_ready(self, now: float):
+        """Первое по порядку сообщение, которое можно отправить сейчас.
+
+        Возвращает (сообщение, None) или (None, через сколько секунд проверить
+        снова). Сообщения чата, у которого есть более раннее неготовое
+        сообщение или сообщение в процессе отправки (его может ждать повтор),
+        пропускаются, чтобы не нарушить порядок в чате.
+        """
+        skipped = []
+        blocked_chats = set()
+        found = None
+        retry_at = None
+        while self._heap and len(skipped) < OUTBOUND_SCAN_LIMIT:
+            item = heapq.heappop(self._heap)
+            if item.chat_id not in blocked_chats and item.chat_id not in self._in_flight:
+                ready_at = max(item.not_before, self._chat_bucket(item.chat_id).ready_at(now))
+                if ready_at <= now:
+                    found = item
+                    break
+                blocked_chats.add(item.chat_id)
+                retry_at = ready_at if retry_at is None else min(retry_at, ready_at)
+            skipped.append(item)
+        for item in skipped:
+            heapq.heappush(self._heap, item)
+        if found is not None:
+            return found, None
+        return None, (retry_at - now) if retry_at is not None else 0.05
+
+    async def _wait(self, delay: float):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _dispatch(self):
+        while True:
+            self._wakeup.clear()
+            if not self._heap:
+                if self._stopping:
+                    return
+                await self._wakeup.wait()
+                continue
+
+            # Сначала свободное место, затем выбор сообщения: пока ждали места,
+            # мог прийти 429 или завершиться отправка в тот же чат
+            await self._slots.acquire()
+            now = time.monotonic()
+            delay = self._global.ready_at(now) - now
+            item = None
+            if delay <= 0:
+                item, delay = self._next_ready(now)
+            if item is None:
+                self._slots.release()
+                await self._wait(delay)
+                continue
+
+            self._global.take(now)
+            self._chat_bucket(item.chat_id).take(now)
+            self._in_flight.add(item.chat_id)
+            task = asyncio.get_running_loop().create_task(self._deliver(item))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+            # Полные ведра чатов не нужны: словарь не растет с числом получателей
+            if len(self._chats) > 10000:
+                self._chats = {chat_id: bucket for chat_id, bucket in self._chats.items()
+                               if not bucket.idle(now)}
+
+    async def _deliver(self, item: _Delivery):
+        item.attempts += 1
+        try:
+            message_id = await self._send(item.chat_id, item.text, **item.options)
+        except RetryLater as e:
+            self._stats['retry_after'] += 1
+            until = time.monotonic() + e.retry_after
+            # Ограничение превышено для всего бота: остальные запросы тоже получат 429
+            self._global.block(until)
+            logger.warning(f"Telegram просит подождать {e.retry_after} с перед отправкой")
+            self._retry(item, until, str(e))
+        except TemporaryDeliveryError as e:
+            delay = min(OUTBOUND_RETRY_MAX_DELAY, OUTBOUND_RETRY_BASE_DELAY * 2 ** (item.attempts - 1))
+            self._retry(item, time.monotonic() + random.uniform(delay / 2, delay), str(e))
+        except Exception as e:
+            logger.error(f"Ошибка отправки сообщения в чат {item.chat_id}: {e}")
+            self._finish(item, 'failed', error=str(e))
+        else:
+            self._finish(item, 'sent', message_id=message_id)
+        finally:
+            self._in_flight.discard(item.chat_id)
+            self._slots.release()
+            self._wakeup.set()
+
+    def _retry(self, item: _Delivery, not_before: float, error: str):
+        if item.attempts >= self._max_attempts or self._stopping:
+            logger.error(f"Сообщение в чат {item.chat_id} не отправлено после {item.attempts} попыток: {error}")
+            self._finish(item, 'failed', error=error, retryable=True)
+            return
+        self._stats['retries'] += 1
+        item.not_before = not_before
+        item.error = error
+        heapq.heappush(self._heap, item)
+        self._wakeup.set()
+
+    def _finish(self, item: _Delivery, status: str, message_id: Optional[int] = None, error: str = None,
+                retryable: bool = False):
+        queued = time.monotonic() - item.created
+        if status != 'rejected':
+            self._stats[status] += 1
+            self._stats['queued_seconds'] += queued
+        if not item.future.done():
+            item.future.set_result(DeliveryResult(
+                ok=status == 'sent',
+                chat_id=item.chat_id,
+                status=status,
+                attempts=item.attempts,
+                message_id=message_id,
+                error=error,
+                queued_seconds=round(queued, 3),
+                retryable=retryable
+            ))
+
+class ThreadedOutboundQueue:
+    """Очередь отправки в отдельном потоке со своим event loop - для синхронного кода (админка)"""
+
+    def __init__(self, send: Callable[..., Awaitable[Optional[int]]], **options):
+        self._queue = OutboundQueue(send, **options)
+        self._loop = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name='outbound', daemon=True).start()
+        return self._loop
+
+    def submit(self, chat_id: int, text: str, priority: int = PRIORITY_NORMAL, **options) -> concurrent.futures.Future:
+        """Постановка сообщения в очередь, future получит DeliveryResult"""
+        return asyncio.run_coroutine_threadsafe(
+            self._queue.send(chat_id, text, priority, **options), self._ensure_loop()
+        )
+
+    def send(self, chat_id: int, text: str, priority: int = PRIORITY_NORMAL,
+             timeout: float = OUTBOUND_WAIT_TIMEOUT, **options) -> DeliveryResult:
+        """Отправка через очередь с ожиданием итога не дольше timeout секунд"""
+        future = self.submit(chat_id, text, priority, **options)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            # Сообщение остается в очереди и будет отправлено позже
+            return DeliveryResult(False, chat_id, 'pending', error="Превышено время ожидания отправки")
+
+    def stats(self) -> Dict[str, Any]:
+        return self._queue.stats()
+
+    def stop(self, timeout: float = OUTBOUND_WAIT_TIMEOUT):
+        """Отправка оставшихся сообщений и остановка потока"""
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._queue.stop(timeout), loop).result(timeout * 2 + 1)
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+
+def bot_sender(bot) -> Callable[..., Awaitable[Optional[int]]]:
+    """Отправка через telegram.Bot (процесс бота)"""
+    async def send(chat_id: int, text: str, **options) -> Optional[int]:
+        try:
+            message = await bot.send_message(chat_id=chat_id, text=text, **options)
+        except RetryAfter as e:
+            raise RetryLater(e.retry_after) from e
+        except (BadRequest, Forbidden):
+            raise
+        except NetworkError as e:
+            # Сюда же относится TimedOut
+            raise TemporaryDeliveryError(str(e)) from e
+        except TelegramError:
+            raise
+        except Exception as e:
+            # Ошибка не от Telegram (например, клиент бота уже закрыт): сообщение не ушло
+            raise TemporaryDeliveryError(str(e) or type(e).__name__) from e
+        return message.message_id
+    return send
+
+def http_sender(client) -> Callable[..., Awaitable[Optional[int]]]:
+    """Отправка через HTTP Bot API (процессы без telegram.Bot, например админка).
+
+    client - TelegramHTTPClient (вызывается в пуле потоков) или
+    AsyncTelegramHTTPClient (вызывается в event loop очереди).
+    """
+    async def call(payload):
+        if isinstance(client, AsyncTelegramHTTPClient):
+            return await client.call('sendMessage', payload)
+        return await asyncio.get_running_loop().run_in_executor(None, client.call, 'sendMessage', payload)
+
+    async def send(chat_id: int, text: str, **options) -> Optional[int]:
+        try:
+            result = await call({'chat_id': chat_id, 'text': text, **options})
+        except TelegramNetworkError as e:
+            raise TemporaryDeliveryError(str(e)) from e
+        except TelegramAPIError as e:
+            if e.status_code == 429:
+                raise RetryLater(e.retry_after or 1) from e
+            if e.status_code >= 500:
+                raise TemporaryDeliveryError(e.description) from e
+            raise RuntimeError(f"Telegram API error: {e.description}") from e
+        return (result or {}).get('message_id')
+    return send
@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import os
+from typing import Optional, List, Dict, Any, Tuple
+
+from database import get_read_connection, write_transaction, insert_message
+from outbound import DeliveryResult
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Настройки очереди ответов администраторов
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '1'))  # секунды между проверками новых ответов
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '50'))  # ответов в отправке одновременно
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '5'))
+OUTBOX_RETRY_BASE_DELAY = int(os.getenv('OUTBOX_RETRY_BASE_DELAY', '30'))  # секунды, удваивается
+OUTBOX_RETRY_MAX_DELAY = int(os.getenv('OUTBOX_RETRY_MAX_DELAY', '900'))
+
+OUTBOX_STATUSES = ('pending', 'sending', 'sent', 'failed')
+
+OUTBOX_COLUMNS = '''id, user_id, ticket_id, message_text, status, attempts, next_attempt_at,
+                    message_id, logged_message_id, error, created_at, sent_at'''
+
+def _entry_from_row(row) -> Dict[str, Any]:
+    return {
+        'id': row[0],
+        'user_id': row[1],
+        'ticket_id': row[2],
+        'message_text': row[3],
+        'status': row[4],
+        'attempts': row[5],
+        'next_attempt_at': row[6],
+        'message_id': row[7],
+        'logged_message_id': row[8],
+        'error': row[9],
+        'created_at': row[10],
+        'sent_at': row[11],
+    }
+
+# Функции админки
+
+def enqueue_reply(user_id: int, message_text: str, ticket_id: int = None) -> int:
+    """Сохранение ответа администратора для отправки ботом, возвращает ID в outbox"""
+    with write_transaction() as conn:
+        return conn.execute('''
+            INSERT INTO outbox (user_id, ticket_id, message_text) VALUES (?, ?, ?)
+        ''', (user_id, ticket_id, message_text)).lastrowid
+
+def get_outbox_entry(outbox_id: int) -> Optional[Dict[str, Any]]:
+    """Состояние ответа в outbox"""
+    row = get_read_connection().execute(
+        f'SELECT {OUTBOX_COLUMNS} FROM outbox WHERE id = ?', (outbox_id,)
+    ).fetchone()
+    return _entry_from_row(row) if row else None
+
+# Функции отправителя (процесс бота)
+
+def recover_interrupted():
+    """Ответы, итог отправки которых не был записан до остановки бота, снова ждут отправки.
+
+    Такой ответ мог уйти до остановки, и пользователь получит его дважды -
+    это лучше, чем потерять ответ. В messages он все равно попадет один раз.
+    """
+    with write_transaction() as conn:
+        count = conn.execute("UPDATE outbox SET status = 'pending' WHERE status = 'sending'").rowcount
+    if count:
+        logger.warning(f"Возвращено в очередь ответов администраторов: {count}")
+
+def _claim_batch(size: int) -> List[Tuple[int, int, str]]:
+    """Ответы, которые пора отправить (статус sending)"""
+    with write_transaction() as conn:
+        return conn.execute('''
+            UPDATE outbox SET status = 'sending', attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM outbox
+                WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+                ORDER BY id LIMIT ?
+            )
+            RETURNING id, user_id, message_text
+        ''', (size,)).fetchall()
+
+def _record_result(outbox_id: int, result) -> str:
+    """Запись итога отправки. Отправленный ответ сохраняется в messages в той же
+    транзакции и только при переходе из sending, поэтому ровно один раз."""
+    with write_transaction() as conn:
+        if result.ok:
+            row = conn.execute('''
+                UPDATE outbox SET status = 'sent', message_id = ?, error = NULL,
+                    sent_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'sending'
+                RETURNING user_id, message_text
+            ''', (result.message_id, outbox_id)).fetchone()
+            if row is not None:
+                logged_id = insert_message(conn, row[0], row[1], 'text', True)
+                conn.execute('UPDATE outbox SET logged_message_id = ? WHERE id = ?', (logged_id, outbox_id))
+            return 'sent'
+
+        attempts = conn.execute('SELECT attempts FROM outbox WHERE id = ?', (outbox_id,)).fetchone()[0]
+        if result.retryable and attempts < OUTBOX_MAX_ATTEMPTS:
+            delay = min(OUTBOX_RETRY_MAX_DELAY, OUTBOX_RETRY_BASE_DELAY * 2 ** (attempts - 1))
+            conn.execute('''
+                UPDATE outbox SET status = 'pending', error = ?,
+                    next_attempt_at = datetime('now', '+' || ? || ' seconds')
+                WHERE id = ? AND status = 'sending'
+            ''', (result.error, delay, outbox_id))
+            return 'pending'
+        conn.execute('''
+            UPDATE outbox SET status = 'failed', error = ? WHERE id = ? AND status = 'sending'
+        ''', (result.error, outbox_id))
+        return 'failed'
+
+class OutboxRelay:
+    """Отправка ответов администраторов из outbox в процессе бота.
+
+    Админка только сохраняет ответ и сразу возвращает управление, бот
+    забирает новые ответы и отправляет их через свою очередь отправки.
+    Итог каждого ответа записывается отдельно, как только он известен:
+    смена статуса попадает в ленту изменений и показывается в админке.
+    """
+
+    def __init__(self, deliver, batch_size: int = OUTBOX_BATCH_SIZE,
+                 poll_interval: float = OUTBOX_POLL_INTERVAL):
+        # deliver(user_id, message_text) -> DeliveryResult
+        self._deliver = deliver
+        self._batch_size = batch_size
+        self._poll_interval = poll_interval
+        self._stop_event = None
+        self._wakeup = None
+        self._task = None
+        self._deliveries = set()
+
+    def start(self):
+        """Запуск в текущем event loop (повторный вызов ничего не делает)"""
+        if self._task is None:
+            self._stop_event = asyncio.Event()
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Остановка после записи итогов начатых отправок"""
+        if self._task is None:
+            return
+        self._stop_event.set()
+        self._wakeup.set()
+        await self._task
+        if self._deliveries:
+            await asyncio.gather(*self._deliveries, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, recover_interrupted)
+        except Exception as e:
+            logger.error(f"Ошибка восстановления очереди ответов: {e}")
+        while not self._stop_event.is_set():
+            # В sending переводятся не больше batch_size ответов: остальные ждут
+            # в pending, а не в очереди отправки, и не тратят попытки на ее переполнение
+            free = self._batch_size - len(self._deliveries)
+            batch = []
+            if free > 0:
+                try:
+                    batch = await loop.run_in_executor(None, _claim_batch, free)
+                except Exception as e:
+                    logger.error(f"Ошибка чтения очереди ответов: {e}")
+            for outbox_id, user_id, message_text in batch:
+                task = loop.create_task(self._send(outbox_id, user_id, message_text))
+                self._deliveries.add(task)
+                task.add_done_callback(self._delivered)
+            # Полная пачка - в очереди, скорее всего, есть еще ответы
+            if batch and len(batch) == free:
+                self._wakeup.set()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def _delivered(self, task):
+        self._deliveries.discard(task)
+        # Освободилось место для следующих ответов
+        self._wakeup.set()
+
+    async def _send(self, outbox_id: int, user_id: int, message_text: str):
+        try:
+            result = await self._deliver(user_id, message_text)
+        except Exception as e:
+            # Итог неизвестен: ответ повторится, а не останется в sending до перезапуска
+            logger.error(f"Ошибка отправки ответа {outbox_id}: {e}")
+            result = DeliveryResult(False, user_id, 'failed', error=str(e) or type(e).__name__, retryable=True)
+        try:
+            status = await asyncio.get_running_loop().run_in_executor(None, _record_result, outbox_id, result)
+        except Exception as e:
+            logger.error(f"Ошибка записи итога отправки ответа {outbox_id}: {e}")
+            return
+        if status != 'sent':
+            logger.warning(f"Ответ {outbox_id} пользователю {user_id} не отправлен ({status}): {result.error}")
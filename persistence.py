@@ -0,0 +1,320 @@
+import asyncio
+import atexit
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Optional, Dict, Any
+
+import database
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Настройки очереди записи
+WRITE_QUEUE_SIZE = int(os.getenv('WRITE_QUEUE_SIZE', '10000'))
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', '500'))
+WRITE_BATCH_WAIT = float(os.getenv('WRITE_BATCH_WAIT', '0.005'))  # секунды ожидания добора пачки
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv('ACTIVITY_FLUSH_INTERVAL', '30'))  # секунды между записями last_activity
+
+# Что делать с нажатием кнопки меню: counter - только счетчик нажатий,
+# message - строка в messages (как обычное сообщение), both - и то и другое,
+# off - ничего. Кнопки, после которых в переписке нужен контекст для менеджера,
+# по умолчанию пишутся и в messages. MENU_CLICK_POLICY переопределяет
+# политику: "Расчет ЗП=message,Назад в меню=off".
+MENU_CLICK_DEFAULT_POLICY = os.getenv('MENU_CLICK_DEFAULT_POLICY', 'counter')
+MENU_CLICK_POLICIES = {
+    'Обратиться к менеджеру': 'both',
+    'Отчет о нарушении': 'both',
+    'Завершил отчет без файла': 'both',
+    'Завершил отчет с файлами': 'both',
+}
+MENU_CLICK_POLICY_VALUES = ('counter', 'message', 'both', 'off')
+
+def _parse_menu_click_policy(value: str) -> dict:
+    policies = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        button, _, policy = item.rpartition('=')
+        if not button or policy.strip() not in MENU_CLICK_POLICY_VALUES:
+            logger.warning(f"Некорректная политика кнопки меню: {item}")
+            continue
+        policies[button.strip()] = policy.strip()
+    return policies
+
+MENU_CLICK_POLICIES.update(_parse_menu_click_policy(os.getenv('MENU_CLICK_POLICY', '')))
+
+_STOP = object()
+
+class WriteBehindQueue:
+    """Ограниченная очередь операций записи, которую разбирает отдельный поток.
+
+    Поток-писатель забирает из очереди пачку операций и выполняет их в одной
+    транзакции (group commit): одна запись на диск вместо отдельной на каждое
+    сообщение. Каждая операция выполняется внутри SAVEPOINT, поэтому ошибка
+    одной операции не откатывает остальные операции пачки.
+    """
+
+    def __init__(self, maxsize: int = WRITE_QUEUE_SIZE, batch_size: int = WRITE_BATCH_SIZE,
+                 batch_wait: float = WRITE_BATCH_WAIT):
+        self._queue = queue.Queue(maxsize)
+        self._batch_size = batch_size
+        self._batch_wait = batch_wait
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopped = False
+        atexit.register(self.stop)
+
+    def start(self):
+        """Запуск потока-писателя (повторный вызов ничего не делает)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, operation, *args) -> Future:
+        """Постановка операции в очередь (блокирует поток, если очередь заполнена)"""
+        future = Future()
+        self._put((operation, args, future), block=True)
+        return future
+
+    async def submit_async(self, operation, *args) -> Future:
+        """Постановка операции в очередь без блокировки event loop"""
+        future = Future()
+        item = (operation, args, future)
+        try:
+            self._put(item, block=False)
+        except queue.Full:
+            # Очередь заполнена: ждем освобождения места вне event loop
+            logger.warning("Очередь записи заполнена, ожидание места")
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._put, item, True)
+        return future
+
+    async def call(self, operation, *args):
+        """Выполнение операции через очередь с ожиданием результата"""
+        future = await self.submit_async(operation, *args)
+        return await asyncio.wrap_future(future)
+
+    def flush(self):
+        """Ожидание записи всех поставленных в очередь операций"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def stop(self):
+        """Запись оставшихся операций и остановка потока-писателя"""
+        with self._lock:
+            thread = self._thread
+            if thread is None or not thread.is_alive():
+                return
+            self._stopped = True
+        self._queue.put(_STOP)
+        thread.join()
+        logger.info("Очередь записи остановлена, все операции сохранены")
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def _put(self, item, block: bool):
+        if self._stopped:
+            raise RuntimeError("Очередь записи остановлена")
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+        self._queue.put(item, block=block)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                return
+
+            batch = [item]
+            stop_requested = False
+            while len(batch) < self._batch_size:
+                try:
+                    next_item = self._queue.get(timeout=self._batch_wait)
+                except queue.Empty:
+                    break
+                if next_item is _STOP:
+                    stop_requested = True
+                    break
+                batch.append(next_item)
+
+            try:
+                self._write_batch(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+            if stop_requested:
+                self._queue.task_done()
+                return
+
+    def _write_batch(self, batch):
+        conn = database.get_connection()
+        results = []
+        try:
+            database.begin_write(conn)
+            for operation, args, future in batch:
+                conn.execute('SAVEPOINT write_item')
+                try:
+                    result = operation(conn, *args)
+                except Exception as e:
+                    conn.execute('ROLLBACK TO write_item')
+                    conn.execute('RELEASE write_item')
+                    logger.error(f"Ошибка операции записи {operation.__name__}: {e}")
+                    results.append((future, None, e))
+                else:
+                    conn.execute('RELEASE write_item')
+                    results.append((future, result, None))
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Ошибка записи пачки из {len(batch)} операций: {e}")
+            if conn.in_transaction:
+                conn.rollback()
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        # Результаты отдаем только после фиксации транзакции
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+class BufferedWriter:
+    """Накопление в памяти значений, которые не требуют надежности каждой записи.
+
+    Значения копятся в словаре и раз в flush_interval секунд уходят в очередь
+    записи одной операцией operation(conn, [(ключ, значение), ...]). При
+    аварийной остановке теряется не более чем flush_interval секунд данных.
+    """
+
+    def __init__(self, write_queue: WriteBehindQueue, operation, flush_interval: float, name: str):
+        self._write_queue = write_queue
+        self._operation = operation
+        self._flush_interval = flush_interval
+        self._name = name
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
+        atexit.register(self.stop)
+
+    def _ensure_started(self):
+        # Вызывается под self._lock
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+            self._thread.start()
+
+    def flush(self) -> Optional[Future]:
+        """Постановка накопленных значений в очередь записи"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return None
+        return self._write_queue.submit(self._operation, list(pending.items()))
+
+    def stop(self):
+        """Остановка фоновой записи и сброс оставшихся значений"""
+        self._stop_event.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive():
+            thread.join()
+        try:
+            self.flush()
+        except RuntimeError:
+            logger.warning(f"Очередь записи уже остановлена, данные {self._name} не сохранены")
+
+    def _run(self):
+        while not self._stop_event.wait(self._flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи {self._name}: {e}")
+
+class ActivityTracker(BufferedWriter):
+    """Время последней активности пользователей: last_activity меняется на
+    каждое сообщение, в базу попадает последняя отметка пользователя за интервал"""
+
+    def __init__(self, write_queue: WriteBehindQueue, flush_interval: float = ACTIVITY_FLUSH_INTERVAL):
+        super().__init__(write_queue, database.apply_user_activity, flush_interval, 'activity-flush')
+
+    def touch(self, user_id: int):
+        """Отметка активности пользователя (без обращения к базе)"""
+        timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            self._pending[user_id] = timestamp
+            self._ensure_started()
+
+class MenuClickCounter(BufferedWriter):
+    """Счетчики нажатий кнопок меню по пользователям, кнопкам и часам"""
+
+    def __init__(self, write_queue: WriteBehindQueue, flush_interval: float = ACTIVITY_FLUSH_INTERVAL):
+        super().__init__(write_queue, database.apply_menu_clicks, flush_interval, 'menu-clicks-flush')
+
+    def record(self, user_id: int, button: str):
+        """Учет нажатия кнопки (без обращения к базе)"""
+        bucket = datetime.utcnow().strftime('%Y-%m-%d %H:00:00')
+        key = (bucket, button, user_id)
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0) + 1
+            self._ensure_started()
+
+# Общая очередь записи процесса бота
+write_queue = WriteBehindQueue()
+activity_tracker = ActivityTracker(write_queue)
+menu_clicks = MenuClickCounter(write_queue)
+
+# Функции для асинхронных обработчиков. Функции без результата возвращаются
+# сразу после постановки в очередь, функции с результатом ждут записи.
+async def save_user(user_id: int, first_name: str, username: Optional[str] = None):
+    """Сохранение пользователя в фоне"""
+    activity_tracker.touch(user_id)
+    await write_queue.submit_async(database.insert_user, user_id, first_name, username)
+
+async def save_message(user_id: int, message_text: str, message_type: str = 'text', is_from_admin: bool = False):
+    """Сохранение сообщения в фоне"""
+    if not is_from_admin:
+        activity_tracker.touch(user_id)
+    await write_queue.submit_async(database.insert_message, user_id, message_text, message_type, is_from_admin)
+
+async def save_menu_click(user_id: int, button: str):
+    """Учет нажатия кнопки меню по политике кнопки (MENU_CLICK_POLICIES)"""
+    activity_tracker.touch(user_id)
+    policy = MENU_CLICK_POLICIES.get(button, MENU_CLICK_DEFAULT_POLICY)
+    if policy in ('counter', 'both'):
+        menu_clicks.record(user_id, button)
+    if policy in ('message', 'both'):
+        await write_queue.submit_async(database.insert_message, user_id, button, 'user', False)
+
+async def save_media_file(user_id: int, ticket_id: int, file_id: str, file_type: str, file_path: str, caption: str = None):
+    """Сохранение информации о медиафайле в фоне"""
+    await write_queue.submit_async(database.insert_media_file, user_id, ticket_id, file_id, file_type, file_path, caption)
+
+async def queue_media_download(user_id: int, ticket_id: int, media: Dict[str, Any], caption: str = None) -> int:
+    """Постановка вложения в очередь загрузки с ожиданием записи (задание не потеряется)"""
+    return await write_queue.call(
+        database.insert_media_job, user_id, ticket_id, media['file_id'], media['file_unique_id'],
+        media['file_type'], media['file_name'], media['file_size'], caption
+    )
+
+async def update_ticket_status(ticket_id: int, status: str, admin_notes: str = None):
+    """Обновление статуса тикета в фоне"""
+    await write_queue.submit_async(database.apply_ticket_status, ticket_id, status, admin_notes)
+
+async def create_support_ticket(user_id: int, description: str, ticket_type: str) -> int:
+    """Создание тикета с ожиданием его ID"""
+    return await write_queue.call(database.insert_support_ticket, user_id, description, ticket_type)
+
+def shutdown():
+    """Сброс отметок активности, счетчиков меню и очереди записи при остановке процесса"""
+    activity_tracker.stop()
+    menu_clicks.stop()
+    write_queue.stop()
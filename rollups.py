@@ -0,0 +1,183 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any
+
+from database import get_connection, get_read_connection, begin_write, parse_time
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Настройки агрегатов активности
+ROLLUP_REFRESH_INTERVAL = float(os.getenv('ROLLUP_REFRESH_INTERVAL', '60'))  # секунды
+ROLLUP_BATCH_SIZE = int(os.getenv('ROLLUP_BATCH_SIZE', '20000'))
+
+GRANULARITIES = {
+    'hour': '%Y-%m-%d %H:00:00',
+    'day': '%Y-%m-%d 00:00:00',
+}
+
+# Источники агрегатов: метрика -> (таблица, колонка времени, измерение, признак админа)
+SOURCES = {
+    'messages': ('messages', 'timestamp', 'message_type', 'is_from_admin'),
+    'tickets': ('support_tickets', 'created_at', 'ticket_type', '0'),
+}
+
+def _refresh_batch(conn, metric: str) -> int:
+    """Учет следующей пачки новых строк источника, возвращает число строк"""
+    table, time_column, kind_column, admin_column = SOURCES[metric]
+    begin_write(conn)
+    try:
+        last_id = conn.execute(
+            'SELECT last_id FROM rollup_state WHERE source = ?', (table,)
+        ).fetchone()[0]
+        row = conn.execute(f'''
+            SELECT COUNT(*), MAX(id) FROM (
+                SELECT id FROM {table} WHERE id > ? ORDER BY id LIMIT ?
+            )
+        ''', (last_id, ROLLUP_BATCH_SIZE)).fetchone()
+        count, max_id = row
+        if not count:
+            conn.rollback()
+            return 0
+
+        for granularity, bucket_format in GRANULARITIES.items():
+            conn.execute(f'''
+                INSERT INTO activity_rollups (granularity, metric, bucket, kind, is_from_admin, count)
+                SELECT ?, ?, strftime(?, {time_column}), COALESCE({kind_column}, ''),
+                       COALESCE({admin_column}, 0), COUNT(*)
+                FROM {table}
+                WHERE id > ? AND id <= ? AND {time_column} IS NOT NULL
+                GROUP BY 3, 4, 5
+                ON CONFLICT (granularity, metric, bucket, kind, is_from_admin)
+                DO UPDATE SET count = count + excluded.count
+            ''', (granularity, metric, bucket_format, last_id, max_id))
+
+        conn.execute('UPDATE rollup_state SET last_id = ? WHERE source = ?', (max_id, table))
+        conn.commit()
+        return count
+    except Exception:
+        conn.rollback()
+        raise
+
+def refresh_rollups() -> Dict[str, int]:
+    """Инкрементальное обновление агрегатов от отметки последней учтенной строки.
+
+    Строки получают возрастающие ID в порядке фиксации транзакций (запись
+    в SQLite последовательна), поэтому строки с ID не больше отметки уже учтены.
+    """
+    conn = get_connection()
+    processed = {}
+    for metric in SOURCES:
+        total = 0
+        while True:
+            count = _refresh_batch(conn, metric)
+            total += count
+            if count < ROLLUP_BATCH_SIZE:
+                break
+        processed[metric] = total
+    return processed
+
+def _bucket_start(value: str, granularity: str) -> str:
+    """Начало периода, в который попадает время: первый период ряда не обрезается"""
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S').strftime(GRANULARITIES[granularity])
+
+def query_timeseries(metric: str, granularity: str = 'hour', start: str = None, end: str = None,
+                     kind: str = None, is_from_admin: Optional[bool] = None,
+                     group_by: str = None) -> List[Dict[str, Any]]:
+    """Временной ряд из агрегатов (исходные таблицы не читаются).
+
+    start/end - границы периода в UTC (end не включается). group_by может быть
+    'kind' или 'is_from_admin' для разбивки ряда по измерению.
+    """
+    if metric not in SOURCES:
+        raise ValueError(f"Неизвестная метрика: {metric}")
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Неизвестная гранулярность: {granularity}")
+    if group_by not in (None, 'kind', 'is_from_admin'):
+        raise ValueError(f"Неизвестная группировка: {group_by}")
+
+    now = datetime.utcnow()
+    default_span = timedelta(days=7) if granularity == 'hour' else timedelta(days=30)
+    end = parse_time(end) if end else (now + timedelta(hours=1)).strftime('%Y-%m-%d %H:%M:%S')
+    start = _bucket_start(parse_time(start) if start else (now - default_span).strftime('%Y-%m-%d %H:%M:%S'),
+                          granularity)
+
+    conditions = ['granularity = ?', 'metric = ?', 'bucket >= ?', 'bucket < ?']
+    params = [granularity, metric, start, end]
+    if kind is not None:
+        conditions.append('kind = ?')
+        params.append(kind)
+    if is_from_admin is not None:
+        conditions.append('is_from_admin = ?')
+        params.append(1 if is_from_admin else 0)
+
+    group_columns = 'bucket' + (f', {group_by}' if group_by else '')
+    conn = get_read_connection()
+    cursor = conn.execute(f'''
+        SELECT {group_columns}, SUM(count)
+        FROM activity_rollups
+        WHERE {' AND '.join(conditions)}
+        GROUP BY {group_columns}
+        ORDER BY {group_columns}
+    ''', params)
+
+    series = []
+    for row in cursor.fetchall():
+        point = {'bucket': row[0], 'count': row[-1]}
+        if group_by == 'kind':
+            point['kind'] = row[1]
+        elif group_by == 'is_from_admin':
+            point['is_from_admin'] = bool(row[1])
+        series.append(point)
+    return series
+
+def query_menu_clicks(granularity: str = 'day', start: str = None, end: str = None,
+                      user_id: Optional[int] = None, button: str = None) -> List[Dict[str, Any]]:
+    """Нажатия кнопок меню по периодам: число нажатий и уникальных пользователей"""
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Неизвестная гранулярность: {granularity}")
+
+    now = datetime.utcnow()
+    default_span = timedelta(days=7) if granularity == 'hour' else timedelta(days=30)
+    end = parse_time(end) if end else (now + timedelta(hours=1)).strftime('%Y-%m-%d %H:%M:%S')
+    start = _bucket_start(parse_time(start) if start else (now - default_span).strftime('%Y-%m-%d %H:%M:%S'),
+                          granularity)
+
+    conditions = ['bucket >= ?', 'bucket < ?']
+    params = [start, end]
+    if user_id is not None:
+        conditions.append('user_id = ?')
+        params.append(user_id)
+    if button is not None:
+        conditions.append('button = ?')
+        params.append(button)
+
+    conn = get_read_connection()
+    cursor = conn.execute(f'''
+        SELECT strftime(?, bucket) AS period, button, SUM(count), COUNT(DISTINCT user_id)
+        FROM menu_clicks
+        WHERE {' AND '.join(conditions)}
+        GROUP BY period, button
+        ORDER BY period, button
+    ''', [GRANULARITIES[granularity], *params])
+    return [{'bucket': row[0], 'button': row[1], 'count': row[2], 'users': row[3]}
+            for row in cursor.fetchall()]
+
+def start_rollup_refresher(interval: float = ROLLUP_REFRESH_INTERVAL) -> threading.Thread:
+    """Фоновое обновление агрегатов с заданным интервалом"""
+    def run():
+        while True:
+            try:
+                processed = refresh_rollups()
+                if any(processed.values()):
+                    logger.debug(f"Агрегаты обновлены: {processed}")
+            except Exception as e:
+                logger.error(f"Ошибка обновления агрегатов: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name='rollup-refresher', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,158 @@
+import html
+import re
+from typing import Optional, List, Dict, Any, Tuple
+
+from database import get_connection, get_read_connection, attach_archives, encode_cursor, decode_cursor
+from migrations import SEARCH_REBUILD_SQL, SEARCH_INDEXES
+
+# Настройки поиска
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 100
+MAX_SEARCH_OFFSET = 1000  # дальше релевантность уже не важна, уточните запрос
+
+# Маркеры совпадений в сниппетах, заменяются на <mark> после экранирования
+_MATCH_START = '\x02'
+_MATCH_END = '\x03'
+
+# Источники результатов: имя -> запрос к индексу (параметры: маркеры, MATCH).
+# {schema} - основная база или архив, у медиафайлов архивов нет.
+SEARCH_SOURCES = {
+    'messages': '''
+        SELECT 'message' AS source, m.id, m.user_id, NULL AS ticket_id,
+               snippet(messages_fts, 0, ?, ?, '…', 16) AS snippet,
+               m.timestamp AS created_at, messages_fts.rank AS rank
+        FROM {schema}.messages_fts
+        JOIN {schema}.messages m ON m.id = messages_fts.rowid
+        WHERE messages_fts MATCH ?
+    ''',
+    'tickets': '''
+        SELECT 'ticket' AS source, st.id, st.user_id, st.id AS ticket_id,
+               snippet(tickets_fts, -1, ?, ?, '…', 16) AS snippet,
+               st.created_at AS created_at, tickets_fts.rank AS rank
+        FROM {schema}.tickets_fts
+        JOIN {schema}.support_tickets st ON st.id = tickets_fts.rowid
+        WHERE tickets_fts MATCH ?
+    ''',
+    'media': '''
+        SELECT 'media' AS source, mf.id, mf.user_id, mf.ticket_id,
+               snippet(media_fts, 0, ?, ?, '…', 16) AS snippet,
+               mf.uploaded_at AS created_at, media_fts.rank AS rank
+        FROM {schema}.media_fts
+        JOIN {schema}.media_files mf ON mf.id = media_fts.rowid
+        WHERE media_fts MATCH ?
+    ''',
+}
+ARCHIVED_SOURCES = ('messages', 'tickets')
+
+def build_match_query(text: str) -> str:
+    """Запрос FTS5 из пользовательского ввода.
+
+    Берутся только слова (операторы FTS5 из ввода не проходят), все слова
+    обязательны, последнее слово ищется по префиксу - для поиска по мере ввода.
+    """
+    words = re.findall(r'\w+', text or '')
+    if not words:
+        raise ValueError("Пустой поисковый запрос")
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+def _highlight(snippet: Optional[str]) -> str:
+    """HTML сниппета с подсветкой совпадений"""
+    escaped = html.escape(snippet or '')
+    return escaped.replace(_MATCH_START, '<mark>').replace(_MATCH_END, '</mark>')
+
+def search(text: str, sources: Optional[List[str]] = None, user_id: Optional[int] = None,
+           limit: int = SEARCH_PAGE_SIZE, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Поиск по сообщениям, тикетам и подписям к медиа, результаты по релевантности.
+
+    Возвращает (результаты, курсор следующей страницы). Сообщения не привязаны
+    к тикету, для них ticket_id - последний тикет пользователя. Архивы
+    перенесенных сообщений и тикетов подключаются и ищутся вместе с основной базой.
+    """
+    sources = sources or list(SEARCH_SOURCES)
+    unknown = set(sources) - set(SEARCH_SOURCES)
+    if unknown:
+        raise ValueError(f"Неизвестные источники поиска: {', '.join(sorted(unknown))}")
+
+    match = build_match_query(text)
+    limit = max(1, min(limit, MAX_SEARCH_PAGE_SIZE))
+    offset = 0
+    if cursor:
+        (offset,) = decode_cursor(cursor, 1)
+        offset = int(offset)
+    if offset < 0 or offset >= MAX_SEARCH_OFFSET:
+        return [], None
+
+    conn = get_read_connection()
+    # Старые сообщения и тикеты ищутся и в архивах
+    archives = attach_archives(conn)
+    selects = []
+    params = []
+    for source in sources:
+        schemas = ['main', *archives] if source in ARCHIVED_SOURCES else ['main']
+        for schema in schemas:
+            query = SEARCH_SOURCES[source].format(schema=schema)
+            params.extend([_MATCH_START, _MATCH_END, match])
+            if user_id is not None:
+                query += ' AND user_id = ?'
+                params.append(user_id)
+            selects.append(query)
+
+    cursor = conn.execute(f'''
+        SELECT h.source, h.id, h.user_id,
+               COALESCE(h.ticket_id, (SELECT MAX(st.id) FROM support_tickets st
+                                      WHERE st.user_id = h.user_id)),
+               h.snippet, h.created_at, h.rank, u.username, u.first_name
+        FROM (
+            SELECT * FROM ({' UNION ALL '.join(selects)})
+            ORDER BY rank
+            LIMIT ? OFFSET ?
+        ) h
+        LEFT JOIN users u ON u.user_id = h.user_id
+        ORDER BY h.rank
+    ''', params + [limit + 1, offset])
+
+    results = []
+    for row in cursor.fetchall():
+        results.append({
+            'source': row[0],
+            'id': row[1],
+            'user_id': row[2],
+            'ticket_id': row[3],
+            'snippet': (row[4] or '').replace(_MATCH_START, '').replace(_MATCH_END, ''),
+            'snippet_html': _highlight(row[4]),
+            'created_at': row[5],
+            'rank': row[6],
+            'username': row[7],
+            'first_name': row[8]
+        })
+
+    next_cursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        if offset + limit < MAX_SEARCH_OFFSET:
+            next_cursor = encode_cursor(offset + limit)
+    return results, next_cursor
+
+def rebuild_search_index():
+    """Перестроение полнотекстовых индексов по исходным таблицам"""
+    conn = get_connection()
+    with conn:
+        for step in SEARCH_REBUILD_SQL:
+            conn.execute(step)
+    for index, _, _ in SEARCH_INDEXES:
+        conn.execute(f"INSERT INTO {index}({index}) VALUES ('optimize')")
+    conn.commit()
+
+def check_search_index() -> List[str]:
+    """Проверка индексов на соответствие исходным таблицам, возвращает поврежденные"""
+    conn = get_connection()
+    broken = []
+    for index, _, _ in SEARCH_INDEXES:
+        try:
+            conn.execute(f"INSERT INTO {index}({index}, rank) VALUES ('integrity-check', 1)")
+        except Exception:
+            broken.append(index)
+    conn.rollback()
+    return broken
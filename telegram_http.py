@@ -0,0 +1,193 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Настройки HTTP-клиента Telegram Bot API
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')  # адрес можно заменить локальной заглушкой
+TELEGRAM_HTTP_POOL_SIZE = int(os.getenv('TELEGRAM_HTTP_POOL_SIZE', '8'))  # соединений к API одновременно
+TELEGRAM_HTTP_CONNECT_TIMEOUT = float(os.getenv('TELEGRAM_HTTP_CONNECT_TIMEOUT', '5'))
+TELEGRAM_HTTP_READ_TIMEOUT = float(os.getenv('TELEGRAM_HTTP_READ_TIMEOUT', '10'))
+TELEGRAM_HTTP_RETRIES = int(os.getenv('TELEGRAM_HTTP_RETRIES', '2'))  # повторы при ошибке соединения
+LATENCY_WINDOW = 1000  # по скольким последним запросам считаются перцентили
+
+class TelegramNetworkError(Exception):
+    """Сетевая ошибка или таймаут: неизвестно, выполнен ли запрос"""
+
+class TelegramAPIError(Exception):
+    """Ошибка, которую вернул Bot API"""
+
+    def __init__(self, status_code: int, description: str, retry_after: Optional[float] = None):
+        super().__init__(description)
+        self.status_code = status_code
+        self.description = description
+        self.retry_after = retry_after
+
+class _LatencyStats:
+    """Время запросов к API: счетчики и перцентили по последним запросам"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=LATENCY_WINDOW)
+        self._stats = {'calls': 0, 'errors': 0, 'total_seconds': 0.0, 'max_seconds': 0.0}
+
+    def record(self, method: str, elapsed: float, error: Optional[str] = None):
+        with self._lock:
+            self._stats['calls'] += 1
+            self._stats['total_seconds'] += elapsed
+            self._stats['max_seconds'] = max(self._stats['max_seconds'], elapsed)
+            self._recent.append(elapsed)
+            if error:
+                self._stats['errors'] += 1
+        if error:
+            logger.warning(f"Telegram API {method}: {error} ({elapsed * 1000:.0f} мс)")
+        else:
+            logger.debug(f"Telegram API {method}: {elapsed * 1000:.0f} мс")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            recent = sorted(self._recent)
+
+        def percentile(p):
+            return round(recent[min(len(recent) - 1, int(len(recent) * p))] * 1000, 1) if recent else None
+
+        stats['avg_ms'] = round(stats['total_seconds'] / stats['calls'] * 1000, 1) if stats['calls'] else None
+        stats['p50_ms'] = percentile(0.5)
+        stats['p95_ms'] = percentile(0.95)
+        stats['max_ms'] = round(stats.pop('max_seconds') * 1000, 1)
+        stats['total_seconds'] = round(stats['total_seconds'], 3)
+        return stats
+
+def redact_token(error: Exception, token: str) -> str:
+    """Текст ошибки без токена бота (он входит в адрес запроса)"""
+    text = str(error) or type(error).__name__
+    return text.replace(token, '***') if token else text
+
+def _parse_response(status_code: int, data: Optional[dict]) -> Any:
+    data = data or {}
+    if status_code == 200 and data.get('ok'):
+        return data.get('result')
+    parameters = data.get('parameters') or {}
+    raise TelegramAPIError(
+        status_code,
+        data.get('description') or f"HTTP {status_code}",
+        parameters.get('retry_after')
+    )
+
+class TelegramHTTPClient:
+    """Синхронный клиент Bot API с общим пулом соединений.
+
+    Соединения с api.telegram.org переиспользуются между запросами
+    (keep-alive), пул ограничен pool_size. Повторяются только ошибки
+    установки соединения: запрос еще не ушел, поэтому повтор не приведет
+    к двойной отправке. Клиент потокобезопасен.
+    """
+
+    def __init__(self, token: str, base_url: str = TELEGRAM_API_URL, pool_size: int = TELEGRAM_HTTP_POOL_SIZE,
+                 connect_timeout: float = TELEGRAM_HTTP_CONNECT_TIMEOUT,
+                 read_timeout: float = TELEGRAM_HTTP_READ_TIMEOUT, retries: int = TELEGRAM_HTTP_RETRIES):
+        self._token = token
+        self._url = f"{base_url.rstrip('/')}/bot{token}/"
+        self._timeout = (connect_timeout, read_timeout)
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            pool_block=True,
+            max_retries=Retry(total=retries, connect=retries, read=0, status=0, other=0,
+                              redirect=0, backoff_factor=0.2)
+        )
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+        self._latency = _LatencyStats()
+
+    def call(self, method: str, payload: Dict[str, Any] = None) -> Any:
+        """Вызов метода API, возвращает поле result ответа"""
+        started = time.monotonic()
+        try:
+            response = self._session.post(self._url + method, json=payload or {}, timeout=self._timeout)
+        except requests.RequestException as e:
+            error = redact_token(e, self._token)
+            self._latency.record(method, time.monotonic() - started, error)
+            raise TelegramNetworkError(error) from None
+        try:
+            data = response.json()
+        except ValueError:
+            data = None
+        try:
+            result = _parse_response(response.status_code, data)
+        except TelegramAPIError as e:
+            self._latency.record(method, time.monotonic() - started, f"{e.status_code} {e.description}")
+            raise
+        self._latency.record(method, time.monotonic() - started)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return self._latency.snapshot()
+
+    def close(self):
+        self._session.close()
+
+class AsyncTelegramHTTPClient:
+    """Асинхронный вариант клиента на httpx для event loop (ASGI, очередь отправки).
+
+    Клиент создается при первом запросе и привязан к event loop, в котором
+    работает; пул и повторы те же, что у TelegramHTTPClient.
+    """
+
+    def __init__(self, token: str, base_url: str = TELEGRAM_API_URL, pool_size: int = TELEGRAM_HTTP_POOL_SIZE,
+                 connect_timeout: float = TELEGRAM_HTTP_CONNECT_TIMEOUT,
+                 read_timeout: float = TELEGRAM_HTTP_READ_TIMEOUT, retries: int = TELEGRAM_HTTP_RETRIES):
+        self._token = token
+        self._url = f"{base_url.rstrip('/')}/bot{token}/"
+        self._limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        self._timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self._retries = retries
+        self._client = None
+        self._latency = _LatencyStats()
+
+    async def call(self, method: str, payload: Dict[str, Any] = None) -> Any:
+        """Вызов метода API, возвращает поле result ответа"""
+        if self._client is None:
+            # Пул задается транспорту: при явном транспорте limits клиента не действуют
+            self._client = httpx.AsyncClient(
+                timeout=self._timeout,
+                transport=httpx.AsyncHTTPTransport(limits=self._limits, retries=self._retries)
+            )
+        started = time.monotonic()
+        try:
+            response = await self._client.post(self._url + method, json=payload or {})
+        except httpx.HTTPError as e:
+            error = redact_token(e, self._token)
+            self._latency.record(method, time.monotonic() - started, error)
+            raise TelegramNetworkError(error) from None
+        try:
+            data = response.json()
+        except ValueError:
+            data = None
+        try:
+            result = _parse_response(response.status_code, data)
+        except TelegramAPIError as e:
+            self._latency.record(method, time.monotonic() - started, f"{e.status_code} {e.description}")
+            raise
+        self._latency.record(method, time.monotonic() - started)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return self._latency.snapshot()
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
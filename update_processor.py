@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Dict, Hashable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Настройки параллельной обработки обновлений
+BOT_CONCURRENCY = int(os.getenv('BOT_CONCURRENCY', '8'))  # обновлений в обработке одновременно
+BOT_MAX_PENDING_UPDATES = int(os.getenv('BOT_MAX_PENDING_UPDATES', '1000'))  # принятых, но не начатых
+LANE_STATS_TOP = 5  # сколько самых загруженных очередей показывать в статистике
+
+class _Lane:
+    """Очередь обновлений одного пользователя"""
+    __slots__ = ('lock', 'waiting')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.waiting = deque()  # время постановки ожидающих обновлений
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений с сохранением порядка для каждого пользователя.
+
+    Обновления разных пользователей обрабатываются одновременно (не больше
+    concurrency), обновления одного пользователя - строго по очереди: состояние
+    ConversationHandler меняется в том же порядке, что и при последовательной
+    обработке. asyncio.Lock отдается ожидающим в порядке очереди.
+    """
+
+    def __init__(self, concurrency: int = BOT_CONCURRENCY, max_pending: int = BOT_MAX_PENDING_UPDATES):
+        # Семафор базового класса захватывается до очереди пользователя: если
+        # ограничивать им обработку, ждущие обновления одного пользователя
+        # заняли бы все места. Поэтому он ограничивает только число принятых
+        # обновлений, а число обрабатываемых - собственный семафор.
+        # Значение больше 1 нужно, чтобы Application запускал обновления задачами.
+        super().__init__(max(max_pending, concurrency, 2))
+        if concurrency < 1:
+            raise ValueError("concurrency должно быть положительным")
+        self._concurrency = concurrency
+        self._workers = asyncio.Semaphore(concurrency)
+        self._lanes: Dict[Hashable, _Lane] = {}
+        self._stats = {
+            'processed': 0,
+            'active': 0,
+            'waiting': 0,
+            'wait_seconds': 0.0,
+            'max_wait_seconds': 0.0,
+        }
+
+    @staticmethod
+    def lane_key(update: object) -> Optional[Hashable]:
+        """Ключ очереди обновления: пользователь, иначе чат (None - без очереди)"""
+        if isinstance(update, Update):
+            if update.effective_user is not None:
+                return update.effective_user.id
+            if update.effective_chat is not None:
+                return ('chat', update.effective_chat.id)
+        return None
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        key = self.lane_key(update)
+        if key is None:
+            await self._run(time.monotonic(), coroutine)
+            return
+
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _Lane()
+        enqueued = time.monotonic()
+        lane.waiting.append(enqueued)
+        started = False
+        try:
+            async with lane.lock:
+                lane.waiting.remove(enqueued)
+                started = True
+                await self._run(enqueued, coroutine)
+        finally:
+            if not started:
+                lane.waiting.remove(enqueued)
+            # Пустые очереди удаляем, чтобы словарь не рос с числом пользователей
+            if not lane.waiting and not lane.lock.locked() and self._lanes.get(key) is lane:
+                del self._lanes[key]
+
+    async def _run(self, enqueued: float, coroutine):
+        self._stats['waiting'] += 1
+        try:
+            await self._workers.acquire()
+        finally:
+            self._stats['waiting'] -= 1
+        waited = time.monotonic() - enqueued
+        self._stats['wait_seconds'] += waited
+        self._stats['max_wait_seconds'] = max(self._stats['max_wait_seconds'], waited)
+        self._stats['active'] += 1
+        try:
+            await coroutine
+        finally:
+            self._stats['active'] -= 1
+            self._stats['processed'] += 1
+            self._workers.release()
+
+    async def initialize(self) -> None:
+        """Ресурсы не нужны"""
+
+    async def shutdown(self) -> None:
+        """Вывод итоговой статистики"""
+        logger.info(f"Обработка обновлений: {self.stats()}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика обработки: активные и ожидающие обновления, время ожидания,
+        самые длинные очереди пользователей"""
+        now = time.monotonic()
+        stats = dict(self._stats)
+        stats['concurrency'] = self._concurrency
+        stats['wait_seconds'] = round(stats['wait_seconds'], 3)
+        stats['max_wait_seconds'] = round(stats['max_wait_seconds'], 3)
+        stats['avg_wait_seconds'] = round(stats['wait_seconds'] / stats['processed'], 4) if stats['processed'] else None
+        lanes = [(key, lane) for key, lane in list(self._lanes.items()) if lane.waiting]
+        lanes.sort(key=lambda item: len(item[1].waiting), reverse=True)
+        stats['lanes'] = len(self._lanes)
+        stats['lanes_waiting'] = sum(len(lane.waiting) for _, lane in lanes)
+        stats['busiest_lanes'] = [{
+            'key': key if isinstance(key, int) else list(key),
+            'depth': len(lane.waiting),
+            'oldest_wait_seconds': round(now - lane.waiting[0], 3)
+        } for key, lane in lanes[:LANE_STATS_TOP]]
+        return stats
@@ -0,0 +1,96 @@
+import hmac
+import logging
+import os
+import re
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from telegram import Update
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+# Настройки webhook
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')  # публичный адрес бота, например https://bot.example.com
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+
+# Telegram передает секрет из setWebhook в этом заголовке каждого запроса
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+SECRET_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,256}$')
+
+def create_webhook_app(application, secret: str = WEBHOOK_SECRET, path: str = WEBHOOK_PATH) -> FastAPI:
+    """ASGI-приложение, принимающее обновления Telegram.
+
+    Запрос только проверяется и кладется в application.update_queue, ответ
+    Telegram уходит сразу. Обработчики вызывает Application.process_update
+    из очереди, как и при long polling.
+    """
+    app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
+
+    @app.post(path)
+    async def telegram_webhook(request: Request):
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), secret):
+            logger.warning(f"Запрос к webhook с неверным секретом от {request.client.host if request.client else '?'}")
+            return Response(status_code=403)
+        try:
+            update = Update.de_json(await request.json(), application.bot)
+        except Exception as e:
+            logger.warning(f"Некорректное обновление в webhook: {e}")
+            return Response(status_code=400)
+        if update is None:
+            return Response(status_code=400)
+        await application.update_queue.put(update)
+        return Response(status_code=200)
+
+    @app.get('/health')
+    async def health():
+        health = {'status': 'ok', 'queued_updates': application.update_queue.qsize()}
+        stats = getattr(application.update_processor, 'stats', None)
+        if stats is not None:
+            health['processing'] = stats()
+        return health
+
+    return app
+
+async def run_webhook(application):
+    """Работа бота через webhook до остановки сервера (Ctrl+C или SIGTERM)"""
+    if not SECRET_PATTERN.match(WEBHOOK_SECRET):
+        raise ValueError("WEBHOOK_SECRET должен состоять из 1-256 символов A-Z, a-z, 0-9, _ и -")
+
+    async with application:
+        # run_polling вызывает post_init, post_stop и post_shutdown сам,
+        # здесь это делается вручную в том же порядке
+        if application.post_init is not None:
+            await application.post_init(application)
+        await application.start()
+        if WEBHOOK_URL:
+            await application.bot.set_webhook(
+                url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=WEBHOOK_MAX_CONNECTIONS
+            )
+            logger.info(f"Webhook установлен: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+        else:
+            logger.info("WEBHOOK_URL не задан, setWebhook не вызывается")
+
+        server = uvicorn.Server(uvicorn.Config(
+            create_webhook_app(application),
+            host=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            log_level='info'
+        ))
+        try:
+            await server.serve()
+        finally:
+            await application.stop()
+            # Внутри async with: клиент бота закроется только при выходе из блока
+            if application.post_stop is not None:
+                await application.post_stop(application)
+
+    if application.post_shutdown is not None:
+        await application.post_shutdown(application)